@@ -0,0 +1,172 @@
+# All-pairs mode of the legacy face_similarity_tool.py / face_disimilarity_tool.py. Instead of one
+# DeepFace.verify call per (i, j) image pair, every image listed in rfw/test/txts/<race>/<race>_people.txt
+# is embedded once (through the embedding cache and detection store used by verify.py) and the cosine
+# distances of all image pairs come from blocked matrix products of the L2-normalised embeddings. Same
+# identity pairs are written to tmp/<model>/all_pairs/<race>_genuine.npy and all other pairs to
+# <race>_impostor.npy, with the row block size chosen so a block fits in memory_budget_mb.
+import os
+import time
+
+import numpy as np
+from deepface.modules import verification
+
+import detection_cache
+import embedding_cache
+from pair_index import get_image_path
+
+# bytes held per similarity matrix entry of a block: the float32 value, the two masks and the copies
+# boolean indexing makes
+BYTES_PER_ENTRY = 16
+
+
+def _get_output_dir(model):
+    return f'tmp/{model}/all_pairs'
+
+
+def read_people(race):
+    # (identity, image count) rows of the race's people file
+    people = []
+    with open(f'rfw/test/txts/{race}/{race}_people.txt', 'r') as file:
+        for line in file:
+            identity, image_count = line.strip().split('\t')
+            people.append((identity, int(image_count)))
+    return people
+
+
+def build_embedding_matrix(cache, image_paths, identity_ids):
+    # one L2-normalised row per embedded image; for an image with several faces the largest face is used
+    rows = []
+    row_identity_ids = []
+    for image_path, identity_id in zip(image_paths, identity_ids):
+        if image_path not in cache.entries:
+            continue
+        embeddings, facial_areas, _ = cache.entries[image_path]
+        largest_face = int(np.argmax(facial_areas[:, 2] * facial_areas[:, 3]))
+        rows.append(embeddings[largest_face])
+        row_identity_ids.append(identity_id)
+
+    matrix = np.asarray(rows, dtype=np.float32)
+    matrix /= np.maximum(np.linalg.norm(matrix, axis=1, keepdims=True), np.finfo(np.float32).tiny)
+    return matrix, np.asarray(row_identity_ids, dtype=np.int32)
+
+
+def get_block_rows(image_count, memory_budget_mb):
+    return max(1, int(memory_budget_mb * 1024 ** 2 // (max(image_count, 1) * BYTES_PER_ENTRY)))
+
+
+def compute_all_pair_distances(matrix, identity_ids, genuine_path, impostor_path, memory_budget_mb):
+    # identity_ids must be sorted, so the number of same identity pairs is known before the first block
+    image_count = len(matrix)
+    _, identity_sizes = np.unique(identity_ids, return_counts=True)
+    genuine_count = int(np.sum(identity_sizes * (identity_sizes - 1) // 2))
+    impostor_count = image_count * (image_count - 1) // 2 - genuine_count
+
+    # written block by block, so the distances never have to fit in memory at once
+    genuine = np.lib.format.open_memmap(genuine_path, mode='w+', dtype=np.float32, shape=(genuine_count,))
+    impostor = np.lib.format.open_memmap(impostor_path, mode='w+', dtype=np.float32, shape=(impostor_count,))
+
+    block_rows = get_block_rows(image_count, memory_budget_mb)
+    genuine_offset = 0
+    impostor_offset = 0
+    for start in range(0, image_count, block_rows):
+        stop = min(start + block_rows, image_count)
+
+        # only the upper triangle: rows start..stop against columns start..image_count
+        distances = 1 - matrix[start:stop] @ matrix[start:].T
+        upper = np.arange(start, stop)[:, None] < np.arange(start, image_count)[None, :]
+        same_identity = identity_ids[start:stop, None] == identity_ids[None, start:]
+
+        block_genuine = distances[upper & same_identity]
+        block_impostor = distances[upper & ~same_identity]
+        genuine[genuine_offset:genuine_offset + len(block_genuine)] = block_genuine
+        impostor[impostor_offset:impostor_offset + len(block_impostor)] = block_impostor
+        genuine_offset += len(block_genuine)
+        impostor_offset += len(block_impostor)
+
+    genuine.flush()
+    impostor.flush()
+    return genuine, impostor
+
+
+def _write_summary(model, detector, race, genuine, impostor, threshold, image_count, failed_count, run_time,
+                   summary_path):
+    tp = int(np.count_nonzero(genuine <= threshold))
+    fp = int(np.count_nonzero(impostor <= threshold))
+
+    with open(summary_path, 'a') as file:
+        file.write(f'\n{race}\n')
+        file.write(f'\tModel: {model}\n\tDetector: {detector}\n')
+        file.write(f'\tImages: {image_count}\n\tFailed Images: {failed_count}\n')
+        file.write(f'\tGenuine Pairs: {len(genuine)}\n\tImpostor Pairs: {len(impostor)}\n')
+        file.write(f'\tThreshold: {threshold}\n')
+        file.write(f'\tTrue Positive: {tp}\n\tFalse Negative: {len(genuine) - tp}\n')
+        file.write(f'\tFalse Positive: {fp}\n\tTrue Negative: {len(impostor) - fp}\n')
+        for name, distances in (('Genuine', genuine), ('Impostor', impostor)):
+            if len(distances):
+                p5, p50, p95 = np.percentile(distances, [5, 50, 95])
+                file.write(f'\t{name} Distance: mean {float(np.mean(distances)):.4f}, '
+                           f'p5 {p5:.4f}, p50 {p50:.4f}, p95 {p95:.4f}\n')
+        file.write(f'\tRun Time: {run_time:.1f}\n')
+
+
+def embed_people(race, model, detector, use_detection_store, batch_size):
+    # every image of the people file embedded once; images are ordered by identity, then image index
+    people = sorted(read_people(race))
+    image_paths = []
+    identity_ids = []
+    for identity_id, (identity, image_count) in enumerate(people):
+        for image_index in range(1, image_count + 1):
+            image_paths.append(get_image_path(race, identity, image_index))
+            identity_ids.append(identity_id)
+
+    cache = embedding_cache.EmbeddingCache(model, detector, race)
+    detection_store = None
+    if use_detection_store:
+        detection_store = detection_cache.DetectionStore(detector, race)
+        detection_cache.detect_faces(detection_store, cache.get_missing_paths(image_paths))
+    embedding_cache.compute_embeddings(cache, image_paths, detection_store, batch_size)
+
+    return people, image_paths, identity_ids, cache
+
+
+def run_all_pairs(race, model, detector, use_detection_store, batch_size, memory_budget_mb, summary_path):
+    start_time = time.time()
+
+    # sorted by identity, compute_all_pair_distances relies on it
+    _, image_paths, identity_ids, cache = embed_people(race, model, detector, use_detection_store, batch_size)
+    matrix, matrix_identity_ids = build_embedding_matrix(cache, image_paths, identity_ids)
+
+    output_dir = _get_output_dir(model)
+    os.makedirs(output_dir, exist_ok=True)
+    genuine, impostor = compute_all_pair_distances(
+        matrix, matrix_identity_ids, f'{output_dir}/{race}_genuine.npy', f'{output_dir}/{race}_impostor.npy',
+        memory_budget_mb)
+
+    threshold = verification.find_threshold(model, 'cosine')
+    _write_summary(model, detector, race, genuine, impostor, threshold, len(image_paths),
+                   len(image_paths) - len(matrix), time.time() - start_time, summary_path)
+    print(f"{model} - {race}: {len(genuine)} genuine and {len(impostor)} impostor distances "
+          f"in {time.time() - start_time:.1f}s")
+
+
+def main():
+    race_list = ['African', 'Asian', 'Caucasian', 'Indian']
+    model_list = ['Facenet', 'Facenet512', 'DeepFace', 'ArcFace']
+    detector = 'mtcnn'
+    use_detection_store = True
+    batch_size = 32
+    # memory for one block of the similarity matrix
+    memory_budget_mb = 512
+
+    for model in model_list:
+        summary_path = f'{_get_output_dir(model)}/Race_results.txt'
+        os.makedirs(_get_output_dir(model), exist_ok=True)
+        with open(summary_path, 'w') as file:
+            file.write(f'Model: {model}\nDetector: {detector}\n')
+
+        for race in race_list:
+            run_all_pairs(race, model, detector, use_detection_store, batch_size, memory_budget_mb, summary_path)
+
+
+if __name__ == "__main__":
+    main()
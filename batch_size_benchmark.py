@@ -0,0 +1,61 @@
+# Measures pairs/sec of the cached embedding pass at several batch sizes for each model, so the
+# batch_size in verify.py can be chosen per model. Also checks that the batched embeddings match the
+# one-face-per-forward-pass embeddings. Faces are read from the detection store, which is filled
+# here if needed.
+import time
+
+import detection_cache
+import embedding_cache
+from pair_index import load_pair_index
+
+
+def _measure_pairs_per_second(model, detection_store, image_path_pairs, batch_size):
+    cache = embedding_cache.EmbeddingCache(model, detection_store.detector, detection_store.race, persist=False)
+    image_paths = embedding_cache.get_unique_image_paths(image_path_pairs)
+
+    start_time = time.time()
+    embedding_cache.compute_embeddings(cache, image_paths, detection_store, batch_size)
+    for template_image_path, test_image_path in image_path_pairs:
+        if template_image_path in cache.entries and test_image_path in cache.entries:
+            embedding_cache.find_pair_distance(cache, template_image_path, test_image_path, 'cosine')
+    elapsed_time = time.time() - start_time
+
+    return len(image_path_pairs) / elapsed_time
+
+
+def main():
+    race = 'African'
+    model_list = ['Facenet', 'Facenet512', 'DeepFace', 'ArcFace']
+    detector = 'mtcnn'
+    batch_sizes = [1, 8, 16, 32, 64, 128]
+    pair_limit = 1000
+
+    pairs = load_pair_index(race).get_pairs(0, pair_limit)
+    image_path_pairs = [(pair[2], pair[5]) for pair in pairs]
+
+    detection_store = detection_cache.DetectionStore(detector, race)
+    detection_cache.detect_faces(detection_store, embedding_cache.get_unique_image_paths(image_path_pairs))
+
+    results = {}
+    for model in model_list:
+        # also loads the model, so the timed runs below do not pay for it
+        sample_paths = embedding_cache.get_unique_image_paths(image_path_pairs[:50])
+        if not embedding_cache.check_batched_embeddings(model, detection_store, sample_paths, max(batch_sizes)):
+            print(f"{model}: batched embeddings differ from single-face embeddings")
+
+        for batch_size in batch_sizes:
+            results[(model, batch_size)] = _measure_pairs_per_second(model, detection_store, image_path_pairs, batch_size)
+            print(f"Model: {model}\nBatch Size: {batch_size}\nPairs/sec: {results[(model, batch_size)]:.2f}")
+
+    with open('tmp/batch_size_benchmark.txt', 'w') as file:
+        file.write(f'Race: {race}\nDetector: {detector}\nPairs: {len(image_path_pairs)}\n')
+        for model in model_list:
+            file.write(f'\n{model}\n')
+            for batch_size in batch_sizes:
+                file.write(f'\tBatch Size {batch_size}:\t{results[(model, batch_size)]:.2f} pairs/sec\n')
+            best_batch_size = max(batch_sizes, key=lambda batch_size: results[(model, batch_size)])
+            file.write(f'\tBest Batch Size:\t{best_batch_size}\n')
+
+
+if __name__ == "__main__":
+    main()
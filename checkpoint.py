@@ -0,0 +1,187 @@
+# Journal of completed pairs so an interrupted run can carry on where it stopped. Results are written
+# in chunks: the text and columnar results of a chunk are appended and fsynced before the chunk's pair
+# keys go into the journal, so after a crash the journal never lists a pair whose result is missing.
+# On resume both results files are cut back to the journaled pairs and those pairs are skipped.
+# Failed pairs are not journaled, so a resumed run retries them.
+import os
+from collections import Counter
+
+import numpy as np
+
+from result_store import ColumnarResultWriter, get_columnar_paths, get_row_key, read_results
+
+RESULTS_HEADER = 'File1\tFile2\tResult\n'
+CHUNK_SIZE = 64
+
+
+def get_journal_path(results_path):
+    # tmp/<model>/<race>_results.txt -> tmp/<model>/<race>_journal.txt
+    root = os.path.splitext(results_path)[0]
+    if root.endswith('_results'):
+        root = root[:-len('_results')]
+    return root + '_journal.txt'
+
+
+def get_pair_key(template_folder, template_index, test_folder, test_index):
+    return (str(template_folder), str(template_index), str(test_folder), str(test_index))
+
+
+def load_journal(journal_path, model, race):
+    # a Counter, since a pairs file may list the same pair more than once
+    done_keys = Counter()
+    if not os.path.exists(journal_path):
+        return done_keys
+
+    with open(journal_path, 'r') as file:
+        for line in file:
+            # a line without its newline was cut off mid-write
+            if not line.endswith('\n'):
+                break
+            fields = line.rstrip('\n').split('\t')
+            if fields[:2] == [model, race]:
+                done_keys[tuple(fields[2:])] += 1
+    return done_keys
+
+
+def _format_text_result(template_folder, template_index, test_folder, test_index, result):
+    return (f'{template_folder}\t'
+            f'{template_index}\t'
+            f'{test_folder}\t'
+            f'{test_index}\t'
+            f'{result}\t\n')
+
+
+def _recover_text_results(results_path, done_keys, header):
+    # keep only complete, journaled lines, each as often as the journal lists it
+    kept_lines = []
+    kept_keys = Counter()
+    if os.path.exists(results_path):
+        with open(results_path, 'r') as file:
+            if header:
+                file.readline()
+            for line in file:
+                if not line.endswith('\n'):
+                    break
+                key = get_pair_key(*line.split('\t')[:4])
+                if kept_keys[key] < done_keys[key]:
+                    kept_keys[key] += 1
+                    kept_lines.append(line)
+
+    tmp_path = results_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        if header:
+            file.write(RESULTS_HEADER)
+        file.writelines(kept_lines)
+    os.replace(tmp_path, results_path)
+    return kept_keys
+
+
+def _recover_columnar_results(results_path, done_keys):
+    data_path, metadata_path = get_columnar_paths(results_path)
+    if not os.path.exists(data_path) or not os.path.exists(metadata_path):
+        return Counter()
+
+    rows = read_results(results_path)
+    kept = np.zeros(len(rows), dtype=bool)
+    kept_keys = Counter()
+    for i, row in enumerate(rows):
+        key = get_row_key(row)
+        if kept_keys[key] < done_keys[key]:
+            kept_keys[key] += 1
+            kept[i] = True
+    kept_rows = np.array(rows[kept])
+    del rows
+
+    tmp_path = data_path + '.tmp'
+    kept_rows.tofile(tmp_path)
+    os.replace(tmp_path, data_path)
+    return kept_keys
+
+
+class ResultJournal:
+
+    def __init__(self, model, race, results_path, resume, header=True, write_text=True, chunk_size=CHUNK_SIZE):
+        self.model = model
+        self.race = race
+        self.results_path = results_path
+        self.journal_path = get_journal_path(results_path)
+        self.header = header
+        self.write_text = write_text
+        self.chunk_size = chunk_size
+        os.makedirs(os.path.dirname(results_path), exist_ok=True)
+
+        done_keys = Counter()
+        if resume:
+            # a pair only counts as done if every results file still has it
+            done_keys = load_journal(self.journal_path, model, race)
+            if write_text:
+                done_keys &= _recover_text_results(results_path, done_keys, header)
+            columnar_keys = _recover_columnar_results(results_path, done_keys)
+            if write_text and columnar_keys != done_keys:
+                _recover_text_results(results_path, columnar_keys, header)
+            done_keys = columnar_keys
+        elif write_text:
+            with open(results_path, 'w') as file:
+                if header:
+                    file.write(RESULTS_HEADER)
+
+        # rewrite the journal so it matches the recovered results exactly
+        with open(self.journal_path, 'w') as file:
+            for key, key_count in done_keys.items():
+                for _ in range(key_count):
+                    file.write(f'{model}\t{race}\t' + '\t'.join(key) + '\n')
+
+        # pairs of the interrupted run still to be skipped
+        self._skip_keys = Counter(done_keys)
+        self._pending_keys = []
+
+        self.results_file = open(results_path, 'a') if write_text else None
+        self.columnar = ColumnarResultWriter(results_path, model, race, append=resume)
+        self._journal_file = open(self.journal_path, 'a')
+
+        if done_keys:
+            print(f"Resuming {model} - {race}: {sum(done_keys.values())} pairs already done")
+
+    def is_done(self, template_folder, template_index, test_folder, test_index):
+        key = get_pair_key(template_folder, template_index, test_folder, test_index)
+        if self._skip_keys[key] > 0:
+            self._skip_keys[key] -= 1
+            return True
+        return False
+
+    def write_result(self, template_folder, template_index, test_folder, test_index, result):
+        # the columnar row goes first, it is the one that can reject a malformed result
+        self.columnar.append(template_folder, template_index, test_folder, test_index, result)
+        if self.write_text:
+            self.results_file.write(
+                _format_text_result(template_folder, template_index, test_folder, test_index, result))
+
+        self._pending_keys.append(get_pair_key(template_folder, template_index, test_folder, test_index))
+        if len(self._pending_keys) >= self.chunk_size:
+            self.commit()
+
+    def commit(self):
+        # the chunk's results must be on disk before the journal says its pairs are done
+        if self.write_text:
+            self.results_file.flush()
+            os.fsync(self.results_file.fileno())
+        self.columnar.flush()
+
+        for key in self._pending_keys:
+            self._journal_file.write(f'{self.model}\t{self.race}\t' + '\t'.join(key) + '\n')
+        self._journal_file.flush()
+        os.fsync(self._journal_file.fileno())
+        self._pending_keys = []
+
+    def close(self):
+        self.commit()
+        if self.write_text:
+            self.results_file.close()
+        self.columnar.close()
+        self._journal_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
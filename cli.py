@@ -0,0 +1,218 @@
+# One entry point for the whole pipeline, driven by config.json: run (verification), fairface (attribute
+# analysis), calibrate, report, charts, ingest and query (the SQLite results database) and bench. Every
+# subcommand imports its modules only when it runs, so deepface and TensorFlow are loaded by run and
+# fairface alone and the analysis subcommands start without them. Run from the repository root, e.g.
+# python cli.py report --mode optimal --bootstrap
+import argparse
+import json
+import os
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+DEFAULT_CONFIG_PATH = os.path.join(REPO_DIR, 'config.json')
+# report mode -> (name in the result file names, dictionary in scripts/threshold_config.py)
+REPORT_MODES = {
+    'standard': ('Standard', 'standard_threshold_dictionary'),
+    'optimal': ('Optimal', 'optimal_threshold_dictionary'),
+    'eer': ('EER', 'eer_threshold_dictionary'),
+    'fmr_1e2': ('FMR_1e-2', 'fmr_1e2_threshold_dictionary'),
+    'fmr_1e3': ('FMR_1e-3', 'fmr_1e3_threshold_dictionary'),
+    'global': ('Global', 'global_threshold_dictionary')}
+# query parameter -> the option setting it
+QUERY_OPTIONS = {'model': '--model', 'model_a': '--model', 'model_b': '--other-model', 'race': '--race'}
+
+
+def load_config(path):
+    with open(path, 'r') as file:
+        return json.load(file)
+
+
+def _use_scripts():
+    # the analysis scripts import their neighbours by module name
+    scripts_dir = os.path.join(REPO_DIR, 'scripts')
+    if scripts_dir not in sys.path:
+        sys.path.append(scripts_dir)
+
+
+def run_command(args, config):
+    options = config['run']
+    if args.parallel:
+        from parallel_runner import run_parallel
+
+        run_parallel(config['models'], config['races'], config['detector'], config['distance_metric'],
+                     options['test_limit'], args.workers or options['workers'] or os.cpu_count(),
+                     options['shard_size'], options['threads_per_worker'], options['reset_every'],
+                     options['rss_limit_mb'], args.resume, options['worker_queue_depth'],
+                     options['worker_prefetch_threads'])
+        return
+
+    from verify import run_verification
+
+    run_verification(config['models'], config['races'], config['detector'], config['distance_metric'],
+                     options['test_limit'], args.resume, options['use_embedding_cache'],
+                     options['use_detection_store'], options['batch_size'], options['reset_every'],
+                     options['rss_limit_mb'], options['write_text_results'], options['prefetch_queue_depth'],
+                     options['prefetch_threads'], options['snapshot_every'])
+
+
+def fairface_command(args, config):
+    options = config['fairface']
+    if args.evaluate_only:
+        # re-scores the cached predictions, no model is loaded
+        from fairface_attributes import get_predictions_path, load_predictions
+        from fairface_evaluation import evaluate_csv
+
+        evaluator = evaluate_csv(options['csv_path'], load_predictions(get_predictions_path(options['detector'])))
+        evaluator.write_report('testing_results/fairface/Attribute_Results.txt')
+        print(f"{evaluator.totals.sum()} of {evaluator.row_count} rows evaluated: "
+              + ', '.join(f"{attribute} {evaluator.accuracy(attribute):.2f}%" for attribute in evaluator.correct))
+        return
+
+    from main import run_fairface
+
+    run_fairface(options['csv_path'], options['image_dir'], options['detector'],
+                 args.limit or options['image_limit'], options['batch_size'], options['decode_threads'])
+
+
+def calibrate_command(args, config):
+    _use_scripts()
+    from calibrate_thresholds import run_calibration
+
+    options = config['calibrate']
+    run_calibration(config['models'], config['races'], options['reference_race'], options['reference_fmr'])
+
+
+def report_command(args, config):
+    _use_scripts()
+    import threshold_config
+    from create_model_result_file import create_result_files
+
+    options = config['report']
+    mode, dictionary_name = REPORT_MODES[args.mode or options['mode']]
+    threshold_dictionary = getattr(threshold_config, dictionary_name)
+    create_result_files(config['models'], config['races'], mode, threshold_dictionary)
+
+    if args.bootstrap:
+        from bootstrap import run_bootstrap
+
+        run_bootstrap(config['models'], config['races'], mode, threshold_dictionary,
+                      options['bootstrap_replicates'], options['bootstrap_level'])
+
+
+def charts_command(args, config):
+    _use_scripts()
+    from render_charts import render_charts
+
+    options = config['charts']
+    start_time = time.time()
+    rendered, skipped = render_charts(config['models'], config['races'], options['output_dir'], options['formats'],
+                                      options['workers'], args.force)
+    print(f"Rendered {rendered} chart jobs, skipped {skipped} unchanged, in {time.time() - start_time:.1f}s "
+          f"to {options['output_dir']}")
+
+
+def ingest_command(args, config):
+    _use_scripts()
+    from results_db import ingest
+
+    options = config['database']
+    start_time = time.time()
+    written, skipped = ingest(config['models'], config['races'], options['results_dir'], options['path'], args.force)
+    print(f"Ingested {written} scores into {options['path']}, {skipped} runs unchanged, "
+          f"in {time.time() - start_time:.2f}s")
+
+
+def query_command(args, config):
+    _use_scripts()
+    from results_db import QUERY_PARAMS, connect, print_rows, run_query
+
+    # every query takes the parameters it names and ignores the rest
+    params = {'model': args.model, 'model_a': args.model, 'model_b': args.other_model, 'race': args.race,
+              'limit': args.limit}
+    missing = sorted({QUERY_OPTIONS[param] for param in QUERY_PARAMS[args.name] if params[param] is None})
+    if missing:
+        args.parser.error(f"{args.name} needs {' and '.join(missing)}")
+    connection = connect(config['database']['path'])
+    try:
+        print_rows(*run_query(connection, args.name, **{key: value for key, value in params.items()
+                                                         if value is not None}))
+    finally:
+        connection.close()
+
+
+def bench_command(args, config):
+    from pipeline_benchmark import run_benchmark
+
+    options = config['bench']
+    run_benchmark(args.sizes or options['sizes'], options['batch_size'], args.real_models, options['output'])
+
+
+def _split_list(value):
+    return [item for item in value.split(',') if item]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser(description='Face verification bias benchmark')
+    parser.add_argument('--config', default=DEFAULT_CONFIG_PATH)
+    parser.add_argument('--models', type=_split_list, help='comma separated, overrides the models of the config file')
+    parser.add_argument('--races', type=_split_list, help='comma separated, overrides the races of the config file')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    run_parser = subparsers.add_parser('run', help='verify the pairs of every model and race')
+    run_parser.add_argument('--resume', action='store_true', help='skip pairs finished by an interrupted run')
+    run_parser.add_argument('--parallel', action='store_true', help='shard the pairs over worker processes')
+    run_parser.add_argument('--workers', type=int, help='processes of a parallel run')
+    run_parser.set_defaults(handler=run_command)
+
+    fairface_parser = subparsers.add_parser('fairface', help='predict and score the FairFace attributes')
+    fairface_parser.add_argument('--limit', type=int, help='only the first N images of the CSV')
+    fairface_parser.add_argument('--evaluate-only', action='store_true',
+                                 help='score the cached predictions without running a model')
+    fairface_parser.set_defaults(handler=fairface_command)
+
+    calibrate_parser = subparsers.add_parser('calibrate', help='recalibrate scripts/threshold_config.py')
+    calibrate_parser.set_defaults(handler=calibrate_command)
+
+    report_parser = subparsers.add_parser('report', help='write the per-race result files')
+    report_parser.add_argument('--mode', choices=list(REPORT_MODES))
+    report_parser.add_argument('--bootstrap', action='store_true', help='also write bootstrap confidence intervals')
+    report_parser.set_defaults(handler=report_command)
+
+    charts_parser = subparsers.add_parser('charts', help='render the charts to files')
+    charts_parser.add_argument('--force', action='store_true', help='render every figure, even if its inputs are unchanged')
+    charts_parser.set_defaults(handler=charts_command)
+
+    ingest_parser = subparsers.add_parser('ingest', help='load the results files into the SQLite database')
+    ingest_parser.add_argument('--force', action='store_true', help='reload runs whose results files are unchanged')
+    ingest_parser.set_defaults(handler=ingest_command)
+
+    query_parser = subparsers.add_parser('query', help='run a canned query on the SQLite database')
+    query_parser.add_argument('name', choices=['identity_failures', 'model_disagreements', 'common_failures',
+                                               'error_rates'])
+    query_parser.add_argument('--model', help='the model, or the first model of model_disagreements')
+    query_parser.add_argument('--other-model', help='the second model of model_disagreements')
+    query_parser.add_argument('--race', help='only this race, all races by default')
+    query_parser.add_argument('--limit', type=int, help='rows printed, 20 by default and -1 for all')
+    query_parser.set_defaults(handler=query_command, parser=query_parser)
+
+    bench_parser = subparsers.add_parser('bench', help='benchmark the verification pipeline')
+    bench_parser.add_argument('--sizes', type=int, nargs='+', help='pairs per run')
+    bench_parser.add_argument('--real-models', action='store_true',
+                              help='use the installed deepface and TensorFlow instead of the stubs')
+    bench_parser.set_defaults(handler=bench_command)
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    config = load_config(args.config)
+    if args.models:
+        config['models'] = args.models
+    if args.races:
+        config['races'] = args.races
+    args.handler(args, config)
+
+
+if __name__ == "__main__":
+    main()
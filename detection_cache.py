@@ -0,0 +1,103 @@
+# Runs the face detector once per RFW image and stores the aligned crops, facial_areas boxes and eye
+# landmarks under tmp/detections/<detector>/<race>/. Detection does not depend on the recognition
+# model, so every model's embedding pass reads the crops from here instead of re-running MTCNN.
+import os
+import time
+
+import numpy as np
+from deepface.modules import detection
+
+from failure_log import DECODE, DETECT, UNKNOWN, get_failure
+from image_prefetch import read_image
+from result_store import FACIAL_AREA_FIELDS, facial_area_to_array
+
+
+def _get_store_root(detector, race):
+    return f'tmp/detections/{detector}/{race}'
+
+
+class DetectionStore:
+    # one .npz per image holding face_0 .. face_n (uint8 BGR aligned crops at detector resolution),
+    # their facial areas and the detection time, or the failed stage and error if detection failed
+
+    def __init__(self, detector, race):
+        self.detector = detector
+        self.race = race
+        self.root = _get_store_root(detector, race)
+
+    def get_face_path(self, image_path):
+        identity_folder = os.path.basename(os.path.dirname(image_path))
+        image_name = os.path.splitext(os.path.basename(image_path))[0]
+        return f'{self.root}/{identity_folder}/{image_name}.npz'
+
+    def contains(self, image_path):
+        return os.path.exists(self.get_face_path(image_path))
+
+    def _write(self, image_path, **arrays):
+        face_path = self.get_face_path(image_path)
+        os.makedirs(os.path.dirname(face_path), exist_ok=True)
+
+        # write to a temporary file first so an interrupted run never leaves a half-written entry
+        tmp_path = face_path + '.tmp.npz'
+        np.savez(tmp_path, **arrays)
+        os.replace(tmp_path, face_path)
+
+    def save(self, image_path, faces, facial_areas, detect_time):
+        arrays = {f'face_{i}': face for i, face in enumerate(faces)}
+        self._write(image_path,
+                    facial_areas=np.asarray(facial_areas, dtype=np.int32).reshape(-1, FACIAL_AREA_FIELDS),
+                    time=np.float64(detect_time),
+                    **arrays)
+
+    def save_failure(self, image_path, failure):
+        self._write(image_path, error=np.array(failure['message']), stage=np.array(failure['stage']),
+                    exception=np.array(failure['exception']))
+
+    def load(self, image_path):
+        # returns (faces, facial_areas, detect_time, failure); failure is None on success
+        with np.load(self.get_face_path(image_path)) as data:
+            if 'error' in data:
+                failure = {
+                    'stage': str(data['stage']) if 'stage' in data else UNKNOWN,
+                    'exception': str(data['exception']) if 'exception' in data else 'Exception',
+                    'message': str(data['error'])}
+                return None, None, None, failure
+
+            facial_areas = data['facial_areas']
+            faces = [data[f'face_{i}'] for i in range(len(facial_areas))]
+            return faces, facial_areas, float(data['time']), None
+
+
+def detect_faces(store, image_paths, timer=None):
+    missing_paths = [path for path in image_paths if not store.contains(path)]
+    print(f"{store.detector} - {store.race}: {len(image_paths) - len(missing_paths)} detected, "
+          f"{len(missing_paths)} images to detect")
+
+    for count, image_path in enumerate(missing_paths):
+        stage = DECODE
+        try:
+            start_time = time.time()
+            image = read_image(image_path)
+            decode_time = time.time() - start_time
+
+            stage = DETECT
+            # target_size=None keeps the aligned crop at detector resolution, each model resizes it
+            face_objs = detection.extract_faces(
+                img_path=image, target_size=None, detector_backend=store.detector,
+                grayscale=False, enforce_detection=True, align=True)
+            detect_time = time.time() - start_time
+
+            if timer is not None:
+                timer.add('decode', decode_time)
+                timer.add('detect', detect_time - decode_time)
+
+            # extract_faces scales the uint8 crop to [0, 1], so this round trip is lossless
+            faces = [np.rint(face_obj['face'][0] * 255).astype(np.uint8) for face_obj in face_objs]
+            facial_areas = [facial_area_to_array(face_obj['facial_area']) for face_obj in face_objs]
+            store.save(image_path, faces, facial_areas, detect_time)
+        except Exception as e:
+            print(f"{image_path}\n{str(e)}")
+            store.save_failure(image_path, get_failure(e, stage))
+
+        if count % 100 == 0:
+            print(f"Detector: {store.detector}\nDetected: {count}/{len(missing_paths)}")
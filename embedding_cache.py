@@ -0,0 +1,298 @@
+# Computes each RFW image's embedding once per (model, detector, race) and stores it in
+# tmp/<model>/<race>_<detector>_embeddings.npz so every pair distance can be read from the cache
+# instead of calling DeepFace.verify (which re-embeds both images) for every pair.
+import os
+import time
+
+import cv2
+import numpy as np
+from deepface import DeepFace
+from deepface.modules import modeling, verification
+
+from failure_log import EMBED, UNKNOWN, StageError, get_failure
+from result_store import FACIAL_AREA_FIELDS, array_to_facial_area, facial_area_to_array
+
+SAVE_EVERY = 500
+
+
+def get_cache_path(model, detector, race):
+    return f'tmp/{model}/{race}_{detector}_embeddings.npz'
+
+
+def get_unique_image_paths(image_path_pairs):
+    # dict keeps first-seen order so the cache layout is stable between runs
+    unique_paths = {}
+    for template_image_path, test_image_path in image_path_pairs:
+        unique_paths.setdefault(template_image_path, None)
+        unique_paths.setdefault(test_image_path, None)
+    return list(unique_paths)
+
+
+class EmbeddingCache:
+    # one entry per image: a (faces, dims) embedding matrix, a (faces, 8) facial area matrix and
+    # the time it took to compute them. Images that failed are kept with their failure (stage, exception
+    # class and message).
+
+    def __init__(self, model, detector, race, persist=True):
+        self.model = model
+        self.detector = detector
+        self.race = race
+        # a cache with persist=False lives in memory only, e.g. for comparisons and benchmarks
+        self.path = get_cache_path(model, detector, race) if persist else None
+        self.entries = {}
+        self.failures = {}
+        self._unsaved = 0
+
+        if self.path is not None and os.path.exists(self.path):
+            self._load()
+
+    def _load(self):
+        with np.load(self.path) as data:
+            face_offsets = data['face_offsets']
+            for i, image_path in enumerate(data['paths']):
+                start, end = face_offsets[i], face_offsets[i + 1]
+                self.entries[str(image_path)] = (
+                    data['embeddings'][start:end], data['facial_areas'][start:end], float(data['times'][i]))
+            failure_count = len(data['failed_paths'])
+            stages = data['failure_stages'] if 'failure_stages' in data else [UNKNOWN] * failure_count
+            exceptions = data['failure_exceptions'] if 'failure_exceptions' in data else ['Exception'] * failure_count
+            for image_path, stage, exception, error in zip(data['failed_paths'], stages, exceptions, data['errors']):
+                self.failures[str(image_path)] = {'stage': str(stage), 'exception': str(exception), 'message': str(error)}
+
+    def save(self):
+        if self.path is None:
+            return
+
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+
+        paths = list(self.entries)
+        face_counts = [len(self.entries[path][0]) for path in paths]
+        face_offsets = np.concatenate(([0], np.cumsum(face_counts))).astype(np.int64)
+        if paths:
+            embeddings = np.concatenate([self.entries[path][0] for path in paths])
+            facial_areas = np.concatenate([self.entries[path][1] for path in paths])
+        else:
+            embeddings = np.empty((0, 0), dtype=np.float64)
+            facial_areas = np.empty((0, FACIAL_AREA_FIELDS), dtype=np.int32)
+
+        # write to a temporary file first so an interrupted save never corrupts the cache
+        tmp_path = self.path + '.tmp.npz'
+        np.savez(tmp_path,
+                 paths=np.array(paths, dtype=str),
+                 face_offsets=face_offsets,
+                 embeddings=embeddings,
+                 facial_areas=facial_areas,
+                 times=np.array([self.entries[path][2] for path in paths], dtype=np.float64),
+                 failed_paths=np.array(list(self.failures), dtype=str),
+                 failure_stages=np.array([failure['stage'] for failure in self.failures.values()], dtype=str),
+                 failure_exceptions=np.array([failure['exception'] for failure in self.failures.values()], dtype=str),
+                 errors=np.array([failure['message'] for failure in self.failures.values()], dtype=str))
+        os.replace(tmp_path, self.path)
+        self._unsaved = 0
+
+    def add(self, image_path, embeddings, facial_areas, compute_time):
+        self.entries[image_path] = (
+            np.asarray(embeddings, dtype=np.float64),
+            np.asarray(facial_areas, dtype=np.int32).reshape(-1, FACIAL_AREA_FIELDS),
+            compute_time)
+        self._mark_dirty()
+
+    def add_failure(self, image_path, failure):
+        self.failures[image_path] = failure
+        self._mark_dirty()
+
+    def _mark_dirty(self):
+        self._unsaved += 1
+        if self._unsaved >= SAVE_EVERY:
+            self.save()
+
+    def get_missing_paths(self, image_paths):
+        return [path for path in image_paths if path not in self.entries and path not in self.failures]
+
+
+def preprocess_face(face, target_size):
+    # same resize-and-pad that DeepFace.verify applies to a detected face before embedding it
+    factor = min(target_size[0] / face.shape[0], target_size[1] / face.shape[1])
+    dsize = (int(face.shape[1] * factor), int(face.shape[0] * factor))
+    face = cv2.resize(face, dsize)
+
+    diff_0 = target_size[0] - face.shape[0]
+    diff_1 = target_size[1] - face.shape[1]
+    face = np.pad(face, ((diff_0 // 2, diff_0 - diff_0 // 2), (diff_1 // 2, diff_1 - diff_1 // 2), (0, 0)), 'constant')
+    if face.shape[0:2] != target_size:
+        face = cv2.resize(face, target_size)
+
+    face = np.expand_dims(face.astype(np.float32), axis=0)
+    face /= 255
+    return face
+
+
+def _embed_image(cache, image_path, detection_store):
+    if detection_store is None:
+        face_objs = DeepFace.represent(
+            img_path=image_path, model_name=cache.model, detector_backend=cache.detector,
+            enforce_detection=True, align=True)
+        embeddings = [face_obj['embedding'] for face_obj in face_objs]
+        facial_areas = [facial_area_to_array(face_obj['facial_area']) for face_obj in face_objs]
+        return embeddings, facial_areas, 0
+
+    faces, facial_areas, detect_time, failure = detection_store.load(image_path)
+    if failure is not None:
+        raise StageError(failure)
+
+    client = modeling.build_model(cache.model)
+    embeddings = [client.find_embeddings(preprocess_face(face, client.input_shape)) for face in faces]
+    return embeddings, facial_areas, detect_time
+
+
+def _flush_batch(cache, client, batch_faces, batch_images, timer=None):
+    # one forward pass for the whole batch, then scatter the rows back to their images
+    start_time = time.time()
+    try:
+        batch_embeddings = np.asarray(client.model.predict_on_batch(np.concatenate(batch_faces)))
+    except Exception as e:
+        # every image of a failed batch is logged like a failed single image, the run carries on
+        print(f"Batch of {len(batch_images)} images\n{str(e)}")
+        for image_path, _, _ in batch_images:
+            cache.add_failure(image_path, get_failure(e, EMBED))
+        batch_faces.clear()
+        batch_images.clear()
+        return
+    batch_time = time.time() - start_time
+    if timer is not None:
+        timer.add('embed_batch', batch_time)
+
+    row = 0
+    for image_path, facial_areas, detect_time in batch_images:
+        face_count = len(facial_areas)
+        compute_time = detect_time + batch_time * face_count / len(batch_faces)
+        cache.add(image_path, batch_embeddings[row:row + face_count], facial_areas, compute_time)
+        row += face_count
+
+    batch_faces.clear()
+    batch_images.clear()
+
+
+def _compute_embeddings_batched(cache, missing_paths, detection_store, batch_size, timer=None):
+    client = modeling.build_model(cache.model)
+    batch_faces = []
+    batch_images = []
+
+    for count, image_path in enumerate(missing_paths):
+        faces, facial_areas, detect_time, failure = detection_store.load(image_path)
+        if failure is not None:
+            cache.add_failure(image_path, failure)
+            continue
+
+        # keep all faces of an image in the same batch
+        if batch_faces and len(batch_faces) + len(faces) > batch_size:
+            _flush_batch(cache, client, batch_faces, batch_images, timer)
+
+        start_time = time.time()
+        try:
+            image_faces = [preprocess_face(face, client.input_shape) for face in faces]
+        except Exception as e:
+            print(f"{image_path}\n{str(e)}")
+            cache.add_failure(image_path, get_failure(e, EMBED))
+            continue
+        if timer is not None:
+            timer.add('preprocess', time.time() - start_time)
+        batch_faces.extend(image_faces)
+        batch_images.append((image_path, facial_areas, detect_time))
+
+        if count % 100 == 0:
+            print(f"Model: {cache.model}\nEmbedded: {count}/{len(missing_paths)}")
+
+    if batch_faces:
+        _flush_batch(cache, client, batch_faces, batch_images, timer)
+
+
+def compute_embeddings(cache, image_paths, detection_store=None, batch_size=1, timer=None):
+    missing_paths = cache.get_missing_paths(image_paths)
+    print(f"{cache.model} - {cache.race}: {len(image_paths) - len(missing_paths)} cached, "
+          f"{len(missing_paths)} images to embed")
+
+    # batching needs the preprocessed crops, so it only applies when reading from the detection store
+    if detection_store is not None and batch_size > 1:
+        _compute_embeddings_batched(cache, missing_paths, detection_store, batch_size, timer)
+        cache.save()
+        return
+
+    for count, image_path in enumerate(missing_paths):
+        try:
+            start_time = time.time()
+            embeddings, facial_areas, detect_time = _embed_image(cache, image_path, detection_store)
+            embed_time = time.time() - start_time
+            compute_time = detect_time + embed_time
+
+            # without the detection store DeepFace.represent also decodes and detects
+            if timer is not None:
+                timer.add('embed' if detection_store is not None else 'represent', embed_time)
+
+            cache.add(image_path, embeddings, facial_areas, compute_time)
+        except Exception as e:
+            print(f"{image_path}\n{str(e)}")
+            cache.add_failure(image_path, get_failure(e))
+
+        if count % 100 == 0:
+            print(f"Model: {cache.model}\nEmbedded: {count}/{len(missing_paths)}")
+
+    cache.save()
+
+
+def check_batched_embeddings(model, detection_store, image_paths, batch_size, tolerance=1e-4):
+    # embeds the same images one face at a time and in batches and returns the largest difference
+    client = modeling.build_model(model)
+    single_cache = EmbeddingCache(model, detection_store.detector, detection_store.race, persist=False)
+    batched_cache = EmbeddingCache(model, detection_store.detector, detection_store.race, persist=False)
+
+    for image_path in image_paths:
+        faces, facial_areas, detect_time, failure = detection_store.load(image_path)
+        if failure is None:
+            embeddings = [client.find_embeddings(preprocess_face(face, client.input_shape)) for face in faces]
+            single_cache.add(image_path, embeddings, facial_areas, detect_time)
+    _compute_embeddings_batched(batched_cache, list(single_cache.entries), detection_store, batch_size)
+
+    max_difference = 0.0
+    for image_path, (embeddings, _, _) in single_cache.entries.items():
+        difference = np.max(np.abs(embeddings - batched_cache.entries[image_path][0]))
+        max_difference = max(max_difference, float(difference))
+
+    print(f"{model}: max batched/single difference {max_difference:.2e} over {len(single_cache.entries)} images")
+    return max_difference <= tolerance
+
+
+def find_pair_distance(cache, template_image_path, test_image_path, distance_metric):
+    # mirrors DeepFace.verify: when an image holds several faces the closest face pair is used
+    template_embeddings, template_areas, template_time = cache.entries[template_image_path]
+    test_embeddings, test_areas, test_time = cache.entries[test_image_path]
+
+    best_distance = None
+    for i, template_embedding in enumerate(template_embeddings):
+        for j, test_embedding in enumerate(test_embeddings):
+            distance = float(verification.find_distance(template_embedding, test_embedding, distance_metric))
+            if best_distance is None or distance < best_distance:
+                best_distance = distance
+                facial_areas = (template_areas[i], test_areas[j])
+
+    return best_distance, facial_areas, template_time + test_time
+
+
+def build_result(cache, template_image_path, test_image_path, distance_metric):
+    # same keys as the DeepFace.verify response so the results files keep their format
+    tic = time.time()
+    distance, facial_areas, embed_time = find_pair_distance(
+        cache, template_image_path, test_image_path, distance_metric)
+    threshold = verification.find_threshold(cache.model, distance_metric)
+
+    return {
+        'verified': distance <= threshold,
+        'distance': distance,
+        'threshold': threshold,
+        'model': cache.model,
+        'detector_backend': cache.detector,
+        'similarity_metric': distance_metric,
+        'facial_areas': {
+            'img1': array_to_facial_area(facial_areas[0]),
+            'img2': array_to_facial_area(facial_areas[1])},
+        'time': round(embed_time + time.time() - tic, 2)}
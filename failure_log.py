@@ -0,0 +1,85 @@
+# Streams one JSON line per failed pair to tmp/<model>/failures.jsonl as the failure happens, so
+# nothing accumulates in memory and each model's log only holds that model's failures. A record
+# carries the model, race, pair key, position in the pairs file, the stage that failed (decode,
+# detect or embed), the exception class and message.
+import json
+import os
+import traceback
+
+DECODE = 'decode'
+DETECT = 'detect'
+EMBED = 'embed'
+# failures read from caches written before stages were recorded
+UNKNOWN = 'unknown'
+
+
+def get_failure_log_path(model):
+    return f'tmp/{model}/failures.jsonl'
+
+
+def get_stage(exception):
+    # DeepFace.verify and represent decode, detect and embed in one call, the innermost DeepFace
+    # frame of the traceback tells which of them raised
+    stage = EMBED
+    for frame in traceback.extract_tb(exception.__traceback__):
+        file_path = frame.filename.replace('\\', '/')
+        if '/deepface/' not in file_path:
+            continue
+        if frame.name == 'load_image' or file_path.endswith('/image_utils.py'):
+            stage = DECODE
+        elif '/detectors/' in file_path or file_path.endswith('/modules/detection.py'):
+            stage = DETECT
+    return stage
+
+
+class StageError(Exception):
+    # raises a failure recorded earlier again, e.g. a detection error read back from the detection store
+
+    def __init__(self, failure):
+        super().__init__(failure['message'])
+        self.failure = failure
+
+
+def get_failure(exception, stage=None):
+    if isinstance(exception, StageError):
+        return exception.failure
+    return {
+        'stage': stage or get_stage(exception),
+        'exception': type(exception).__name__,
+        'message': str(exception)}
+
+
+class FailureLog:
+
+    def __init__(self, model, path=None, append=False):
+        self.model = model
+        self.path = path or get_failure_log_path(model)
+        self.count = 0
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        self._file = open(self.path, 'a' if append else 'w')
+
+    def write(self, race, count, template_folder, template_index, test_folder, test_index,
+              template_image_path, test_image_path, failure):
+        record = {
+            'model': self.model,
+            'race': race,
+            'pair': [str(template_folder), str(template_index), str(test_folder), str(test_index)],
+            'count': count,
+            'stage': failure['stage'],
+            'exception': failure['exception'],
+            'message': failure['message'],
+            'template_image_path': template_image_path,
+            'test_image_path': test_image_path}
+        self._file.write(json.dumps(record) + '\n')
+        # flushed per record so a crash loses at most the line being written
+        self._file.flush()
+        self.count += 1
+
+    def close(self):
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
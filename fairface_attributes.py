@@ -0,0 +1,162 @@
+# Batched age / gender / race prediction for the FairFace images, in place of one DeepFace.analyze call
+# per image. DeepFace.analyze re-runs detection and every attribute head (emotion included) image by
+# image; here the images are decoded ahead on a thread pool, each face is detected once, and only the
+# requested heads run, each as one forward pass per batch of crops. Detection stays on the calling thread:
+# deepface caches one detector object per backend, and the OpenCV, MTCNN and RetinaFace detectors are not
+# safe to build or call from several threads at once, so the worker pool only decodes the CSV's images
+# and its workers are decoding threads; detection and prediction run on the calling thread. The scores of
+# every image are appended to tmp/fairface/<detector>_predictions.jsonl as its batch finishes, so an
+# interrupted run carries on where it stopped and re-scoring the predictions needs no model at all.
+# deepface is only imported once an image is analyzed, so fairface_evaluation.py and the cli's report
+# commands start without TensorFlow.
+import json
+import os
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from image_prefetch import read_image
+
+ACTIONS = ['age', 'gender', 'race']
+# DeepFace model name and the key its scores are stored under
+ACTION_MODELS = {
+    'age': ('Age', 'age_scores'),
+    'gender': ('Gender', 'gender_scores'),
+    'race': ('Race', 'race_scores')}
+# label order of the Gender and Race heads
+GENDER_LABELS = ['Woman', 'Man']
+RACE_LABELS = ['asian', 'indian', 'black', 'white', 'middle eastern', 'latino hispanic']
+# input size of the attribute heads
+TARGET_SIZE = (224, 224)
+
+
+def get_predictions_path(detector):
+    return f'tmp/fairface/{detector}_predictions.jsonl'
+
+
+def load_predictions(path):
+    # file -> latest record; records of failed images are left out, so those images are retried
+    predictions = {}
+    if not os.path.exists(path):
+        return predictions
+
+    with open(path, 'r') as file:
+        for line in file:
+            # a line without its newline was cut off mid-write
+            if not line.endswith('\n'):
+                break
+            record = json.loads(line)
+            if 'error' in record:
+                predictions.pop(record['file'], None)
+            else:
+                predictions[record['file']] = record
+    return predictions
+
+
+def get_age(age_scores):
+    # the apparent age DeepFace.analyze reports, the expected value over the 101 age classes cut to an int;
+    # one age per row of a (N, 101) score matrix
+    scores = np.asarray(age_scores)
+    return np.floor(scores @ np.arange(scores.shape[-1])).astype(np.int64)
+
+
+def get_gender(gender_scores):
+    # position in GENDER_LABELS, per row of a score matrix
+    return np.argmax(gender_scores, axis=-1)
+
+
+def get_race(race_scores):
+    # position in RACE_LABELS, per row of a score matrix
+    return np.argmax(race_scores, axis=-1)
+
+
+def detect_face(image, detector):
+    # DeepFace.analyze with enforce_detection=False: the whole image stands in when no face is found,
+    # and only the first face is reported
+    from deepface.modules import detection
+
+    face_objs = detection.extract_faces(
+        img_path=image, target_size=TARGET_SIZE, detector_backend=detector,
+        grayscale=False, enforce_detection=False, align=True)
+    return face_objs[0]['face'], float(face_objs[0].get('confidence') or 0)
+
+
+def predict_batch(faces, actions):
+    # one forward pass per requested head for the whole batch of (1, 224, 224, 3) crops
+    from deepface.modules import modeling
+
+    batch = np.concatenate(faces)
+    scores = {}
+    for action in actions:
+        model_name, key = ACTION_MODELS[action]
+        client = modeling.build_model(model_name)
+        scores[key] = np.asarray(client.model.predict_on_batch(batch))
+    return scores
+
+
+def _is_complete(record, actions):
+    return all(ACTION_MODELS[action][1] in record for action in actions)
+
+
+def analyze_files(files, image_dir, detector, actions=ACTIONS, batch_size=64, workers=4, queue_depth=4,
+                  predictions_path=None):
+    # file -> prediction record for every file that could be analyzed
+    predictions_path = predictions_path or get_predictions_path(detector)
+    os.makedirs(os.path.dirname(predictions_path), exist_ok=True)
+    predictions = load_predictions(predictions_path)
+    missing = [file for file in dict.fromkeys(files)
+               if file not in predictions or not _is_complete(predictions[file], actions)]
+    print(f"FairFace - {detector}: {len(files) - len(missing)} cached, {len(missing)} images to analyze")
+
+    batches = [missing[start:start + batch_size] for start in range(0, len(missing), batch_size)]
+    start_time = time.time()
+    failure_count = 0
+    with ThreadPoolExecutor(max_workers=workers) as executor, open(predictions_path, 'a') as out:
+        # the next queue_depth batches are decoded while the current batch is detected and predicted
+        window = deque()
+        next_batch = 0
+        for _ in range(len(batches)):
+            while next_batch < len(batches) and len(window) <= queue_depth:
+                window.append((batches[next_batch], [executor.submit(read_image, os.path.join(image_dir, file))
+                                                     for file in batches[next_batch]]))
+                next_batch += 1
+
+            batch_files, futures = window.popleft()
+            faces = []
+            records = []
+            for file, future in zip(batch_files, futures):
+                try:
+                    face, confidence = detect_face(future.result(), detector)
+                except Exception as e:
+                    print(f"{file}: {e}")
+                    out.write(json.dumps({'file': file, 'error': str(e)}) + '\n')
+                    failure_count += 1
+                    continue
+                faces.append(face)
+                records.append({'file': file, 'detector': detector, 'confidence': confidence})
+
+            if faces:
+                try:
+                    scores = predict_batch(faces, actions)
+                except Exception as e:
+                    # the files of a failed batch get error records and are retried by the next run
+                    print(f"Batch of {len(records)} images: {e}")
+                    for record in records:
+                        out.write(json.dumps({'file': record['file'], 'error': str(e)}) + '\n')
+                    failure_count += len(records)
+                    records = []
+                for row, record in enumerate(records):
+                    for key, values in scores.items():
+                        record[key] = values[row].tolist()
+                    predictions[record['file']] = record
+                    out.write(json.dumps(record) + '\n')
+            out.flush()
+
+            print(f"FairFace - {detector}: {len(predictions)} analyzed")
+
+    if batches:
+        print(f"FairFace - {detector}: {len(missing)} images in {time.time() - start_time:.1f}s, "
+              f"{failure_count} failed")
+    return {file: predictions[file] for file in files if file in predictions}
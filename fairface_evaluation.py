@@ -0,0 +1,162 @@
+# Accuracy and confusion matrices of the FairFace age, gender and race predictions, overall and per
+# ground-truth race x gender group. The CSV is read in chunks; each chunk's age buckets are parsed into
+# integer bounds once per distinct label, the labels are mapped to index arrays, and the per-group counts
+# come from np.bincount over a group id, so there is no per-row Python work past looking up the
+# predictions. Rows without a prediction yet are skipped, so running this while main.py is still
+# analyzing reports on everything in tmp/fairface/<detector>_predictions.jsonl so far.
+import os
+import time
+
+import numpy as np
+import pandas as pd
+
+from fairface_attributes import (GENDER_LABELS, RACE_LABELS, get_age, get_gender, get_predictions_path, get_race,
+                                 load_predictions)
+
+AGE_BUCKETS = ['0-2', '3-9', '10-19', '20-29', '30-39', '40-49', '50-59', '60-69', 'more than 70']
+FAIRFACE_GENDERS = ['Male', 'Female']
+FAIRFACE_RACES = ['White', 'Black', 'Latino_Hispanic', 'East Asian', 'Southeast Asian', 'Indian', 'Middle Eastern']
+# FairFace label -> label of the DeepFace head; DeepFace has a single asian class
+GENDER_MAP = {'Male': 'Man', 'Female': 'Woman'}
+RACE_MAP = {
+    'White': 'white',
+    'Black': 'black',
+    'Latino_Hispanic': 'latino hispanic',
+    'East Asian': 'asian',
+    'Southeast Asian': 'asian',
+    'Indian': 'indian',
+    'Middle Eastern': 'middle eastern'}
+# upper bound of the open 'more than 70' bucket
+MAX_AGE = 150
+
+
+def parse_age_bounds(age_labels):
+    # (lower, upper) integer arrays, each distinct label is parsed once
+    labels, inverse = np.unique(np.asarray(age_labels, dtype=str), return_inverse=True)
+    bounds = np.empty((len(labels), 2), dtype=np.int64)
+    for i, label in enumerate(labels):
+        if label.startswith('more than'):
+            bounds[i] = int(label.split()[-1]), MAX_AGE
+        else:
+            lower, upper = label.split('-')
+            bounds[i] = int(lower), int(upper)
+    return bounds[inverse, 0], bounds[inverse, 1]
+
+
+def _to_index(values, labels):
+    # position of every value in labels, -1 for an unknown value
+    lookup = {label: i for i, label in enumerate(labels)}
+    return np.array([lookup.get(value, -1) for value in values], dtype=np.int64)
+
+
+class AttributeEvaluator:
+
+    def __init__(self):
+        self.group_count = len(FAIRFACE_RACES) * len(FAIRFACE_GENDERS)
+        self.totals = np.zeros(self.group_count, dtype=np.int64)
+        self.correct = {attribute: np.zeros(self.group_count, dtype=np.int64) for attribute in ['age', 'gender', 'race']}
+        # ground truth x prediction, the predictions in the DeepFace label order
+        self.age_confusion = np.zeros((len(AGE_BUCKETS), len(AGE_BUCKETS)), dtype=np.int64)
+        self.gender_confusion = np.zeros((len(FAIRFACE_GENDERS), len(GENDER_LABELS)), dtype=np.int64)
+        self.race_confusion = np.zeros((len(FAIRFACE_RACES), len(RACE_LABELS)), dtype=np.int64)
+        self.row_count = 0
+        # a predicted age falls in the last bucket whose lower bound it reaches
+        self._bucket_starts = parse_age_bounds(AGE_BUCKETS)[0]
+
+    def update(self, chunk, predictions):
+        # chunk: rows of fairface_label_val.csv; predictions: file -> record from analyze_files
+        self.row_count += len(chunk)
+        chunk = chunk[chunk['file'].isin(predictions)]
+        if len(chunk) == 0:
+            return 0
+        records = [predictions[file] for file in chunk['file']]
+
+        predicted_age = get_age([record['age_scores'] for record in records])
+        predicted_gender = get_gender([record['gender_scores'] for record in records])
+        predicted_race = get_race([record['race_scores'] for record in records])
+
+        lower, upper = parse_age_bounds(chunk['age'])
+        true_age = _to_index(chunk['age'], AGE_BUCKETS)
+        true_gender = _to_index(chunk['gender'], FAIRFACE_GENDERS)
+        true_race = _to_index(chunk['race'], FAIRFACE_RACES)
+        mapped_gender = _to_index([GENDER_MAP[gender] for gender in chunk['gender']], GENDER_LABELS)
+        mapped_race = _to_index([RACE_MAP[race] for race in chunk['race']], RACE_LABELS)
+
+        group = true_race * len(FAIRFACE_GENDERS) + true_gender
+        self.totals += np.bincount(group, minlength=self.group_count)
+        self.correct['age'] += np.bincount(group, weights=(lower <= predicted_age) & (predicted_age <= upper),
+                                           minlength=self.group_count).astype(np.int64)
+        self.correct['gender'] += np.bincount(group, weights=predicted_gender == mapped_gender,
+                                              minlength=self.group_count).astype(np.int64)
+        self.correct['race'] += np.bincount(group, weights=predicted_race == mapped_race,
+                                            minlength=self.group_count).astype(np.int64)
+
+        predicted_bucket = np.searchsorted(self._bucket_starts, predicted_age, side='right') - 1
+        np.add.at(self.age_confusion, (true_age, predicted_bucket), 1)
+        np.add.at(self.gender_confusion, (true_gender, predicted_gender), 1)
+        np.add.at(self.race_confusion, (true_race, predicted_race), 1)
+        return len(chunk)
+
+    def accuracy(self, attribute, groups=None):
+        # percentage over the given group ids, all groups by default; NaN without any rows
+        groups = slice(None) if groups is None else groups
+        total = self.totals[groups].sum()
+        return 100 * self.correct[attribute][groups].sum() / total if total else float('nan')
+
+    def get_group(self, race, gender):
+        return FAIRFACE_RACES.index(race) * len(FAIRFACE_GENDERS) + FAIRFACE_GENDERS.index(gender)
+
+    def write_report(self, output_file):
+        os.makedirs(os.path.dirname(output_file) or '.', exist_ok=True)
+        with open(output_file, 'w') as file:
+            file.write(f"Evaluated: {self.totals.sum()} of {self.row_count} rows\n\n")
+            file.write("Overall\n")
+            for attribute in self.correct:
+                file.write(f"\t{attribute}:\t{self.accuracy(attribute):.2f}%\n")
+
+            for race in FAIRFACE_RACES:
+                race_groups = [self.get_group(race, gender) for gender in FAIRFACE_GENDERS]
+                file.write(f"\n{race}\t({self.totals[race_groups].sum()} rows)\n")
+                file.write('\t\t' + '\t'.join(['all'] + FAIRFACE_GENDERS) + '\n')
+                for attribute in self.correct:
+                    values = [self.accuracy(attribute, race_groups)] + [self.accuracy(attribute, [group])
+                                                                         for group in race_groups]
+                    file.write(f"\t{attribute}:\t" + '\t'.join(f'{value:.2f}%' for value in values) + '\n')
+
+            for name, matrix, row_labels, column_labels in (
+                    ('Age', self.age_confusion, AGE_BUCKETS, AGE_BUCKETS),
+                    ('Gender', self.gender_confusion, FAIRFACE_GENDERS, GENDER_LABELS),
+                    ('Race', self.race_confusion, FAIRFACE_RACES, RACE_LABELS)):
+                file.write(f"\n{name} Confusion Matrix (rows ground truth, columns prediction)\n")
+                file.write('\t' + '\t'.join(column_labels) + '\n')
+                for label, row in zip(row_labels, matrix):
+                    file.write(f"{label}\t" + '\t'.join(str(value) for value in row) + '\n')
+
+
+def evaluate_csv(csv_path, predictions, chunk_size=2000):
+    # the CSV in chunks, so a report can be written while main.py is still adding predictions
+    evaluator = AttributeEvaluator()
+    for chunk in pd.read_csv(csv_path, chunksize=chunk_size):
+        evaluator.update(chunk, predictions)
+    return evaluator
+
+
+def main():
+    csv_path = 'fair_face/archive/fairface_label_val.csv'
+    detector = 'opencv'
+    output_file = 'testing_results/fairface/Attribute_Results.txt'
+    # seconds between two reports while main.py is running, None for a single report
+    watch_interval = None
+
+    while True:
+        evaluator = evaluate_csv(csv_path, load_predictions(get_predictions_path(detector)))
+        evaluator.write_report(output_file)
+        print(f"{evaluator.totals.sum()} of {evaluator.row_count} rows evaluated: "
+              + ', '.join(f"{attribute} {evaluator.accuracy(attribute):.2f}%" for attribute in evaluator.correct))
+        if watch_interval is None:
+            break
+        time.sleep(watch_interval)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+# 1:N identification benchmark over the per-model RFW embeddings. The gallery enrols the first embedded
+# image of every identity of all four races, except every HOLD_OUT_EVERY-th identity, which is left out
+# of the gallery so its images can act as non-mated probes. The remaining images of enrolled identities
+# are mated probes. Every probe is searched with an exact brute-force index and an approximate IVF index
+# (spherical k-means coarse quantiser, both in NumPy). The report has rank-k identification accuracy and
+# the false-positive identification rate (FPIR) at the model's threshold per race, queries/sec of both
+# indexes and the recall of the IVF search against the exact one.
+import time
+
+import numpy as np
+from deepface.modules import verification
+
+from all_pairs import build_embedding_matrix, embed_people
+
+HOLD_OUT_EVERY = 10
+RANKS = [1, 5, 10]
+# memory for one block of query x gallery similarities
+MEMORY_BUDGET_MB = 256
+
+
+def _get_block_rows(column_count):
+    return max(1, int(MEMORY_BUDGET_MB * 1024 ** 2 // (max(column_count, 1) * 8)))
+
+
+def _top_k(similarities, k):
+    # column indices of the k largest similarities of each row, best first
+    k = min(k, similarities.shape[1])
+    top = np.argpartition(-similarities, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(similarities, top, axis=1), axis=1)
+    return np.take_along_axis(top, order, axis=1)
+
+
+class ExactIndex:
+
+    def __init__(self, gallery):
+        self.gallery = gallery
+
+    def search(self, queries, k):
+        # (distances, gallery rows) of the k nearest gallery entries of every query
+        k = min(k, len(self.gallery))
+        distances = np.empty((len(queries), k), dtype=np.float32)
+        indices = np.empty((len(queries), k), dtype=np.int64)
+        block_rows = _get_block_rows(len(self.gallery))
+        for start in range(0, len(queries), block_rows):
+            similarities = queries[start:start + block_rows] @ self.gallery.T
+            top = _top_k(similarities, k)
+            distances[start:start + block_rows] = 1 - np.take_along_axis(similarities, top, axis=1)
+            indices[start:start + block_rows] = top
+        return distances, indices
+
+
+class IVFIndex:
+    # inverted file index: the gallery is split into list_count clusters and a query only scans the
+    # probe_count clusters whose centroids are closest to it
+
+    def __init__(self, gallery, list_count, probe_count, iterations=10, seed=0):
+        self.gallery = gallery
+        self.probe_count = min(probe_count, list_count)
+        self.centroids = self._train(gallery, min(list_count, len(gallery)), iterations, np.random.default_rng(seed))
+        self.list_count = len(self.centroids)
+
+        assignments = self._assign(gallery)
+        self.lists = [np.flatnonzero(assignments == i) for i in range(self.list_count)]
+
+    def _assign(self, vectors):
+        # nearest centroid of every vector, in blocks so the similarity matrix stays small
+        assignments = np.empty(len(vectors), dtype=np.int64)
+        block_rows = _get_block_rows(len(self.centroids))
+        for start in range(0, len(vectors), block_rows):
+            assignments[start:start + block_rows] = np.argmax(vectors[start:start + block_rows] @ self.centroids.T, axis=1)
+        return assignments
+
+    def _train(self, vectors, list_count, iterations, rng):
+        # spherical k-means, the embeddings are compared by cosine
+        self.centroids = vectors[rng.choice(len(vectors), size=list_count, replace=False)].copy()
+        for _ in range(iterations):
+            assignments = self._assign(vectors)
+            sums = np.zeros_like(self.centroids)
+            np.add.at(sums, assignments, vectors)
+            # an empty cluster keeps its old centroid
+            empty = ~np.any(sums, axis=1)
+            sums[empty] = self.centroids[empty]
+            self.centroids = sums / np.linalg.norm(sums, axis=1, keepdims=True)
+        return self.centroids
+
+    def search(self, queries, k):
+        k = min(k, len(self.gallery))
+        best_similarities = np.full((len(queries), k), -np.inf, dtype=np.float32)
+        best_indices = np.full((len(queries), k), -1, dtype=np.int64)
+
+        # group the (query, list) probes by list, so each list is scanned once for all queries probing it
+        probes = _top_k(queries @ self.centroids.T, self.probe_count).ravel()
+        probe_queries = np.repeat(np.arange(len(queries)), self.probe_count)
+        order = np.argsort(probes, kind='stable')
+        bounds = np.searchsorted(probes[order], np.arange(self.list_count + 1))
+
+        # one matrix product per list, merged into the running top k; a query that sees fewer than k
+        # gallery entries keeps -1 rows at infinite distance
+        for list_id, members in enumerate(self.lists):
+            query_rows = probe_queries[order[bounds[list_id]:bounds[list_id + 1]]]
+            if len(members) == 0 or len(query_rows) == 0:
+                continue
+            similarities = np.concatenate([best_similarities[query_rows], queries[query_rows] @ self.gallery[members].T],
+                                          axis=1)
+            candidates = np.concatenate([best_indices[query_rows], np.broadcast_to(members, (len(query_rows), len(members)))],
+                                        axis=1)
+            top = _top_k(similarities, k)
+            best_similarities[query_rows] = np.take_along_axis(similarities, top, axis=1)
+            best_indices[query_rows] = np.take_along_axis(candidates, top, axis=1)
+
+        return 1 - best_similarities, best_indices
+
+
+def build_gallery(model, detector, race_list, use_detection_store, batch_size):
+    # gallery rows, the identity label of each row, and the probes with their race and identity label
+    gallery_rows = []
+    gallery_labels = []
+    probe_rows = []
+    probe_labels = []
+    probe_races = []
+    probe_mated = []
+
+    label_offset = 0
+    for race in race_list:
+        people, image_paths, identity_ids, cache = embed_people(race, model, detector, use_detection_store, batch_size)
+        matrix, row_identity_ids = build_embedding_matrix(cache, image_paths, identity_ids)
+        labels = row_identity_ids + label_offset
+        label_offset += len(people)
+
+        # rows are ordered by identity, the first row of an identity is its enrolment image
+        first_rows = np.flatnonzero(np.diff(row_identity_ids, prepend=-1) != 0)
+        enrolled = np.zeros(len(matrix), dtype=bool)
+        enrolled[first_rows] = True
+        held_out = row_identity_ids % HOLD_OUT_EVERY == 0
+
+        gallery_rows.append(matrix[enrolled & ~held_out])
+        gallery_labels.append(labels[enrolled & ~held_out])
+
+        probes = ~enrolled | held_out
+        probe_rows.append(matrix[probes])
+        probe_labels.append(labels[probes])
+        probe_races.append(np.full(np.count_nonzero(probes), race))
+        probe_mated.append(~held_out[probes])
+
+    return (np.concatenate(gallery_rows), np.concatenate(gallery_labels), np.concatenate(probe_rows),
+            np.concatenate(probe_labels), np.concatenate(probe_races), np.concatenate(probe_mated))
+
+
+def _timed_search(index, queries, k):
+    start_time = time.time()
+    distances, indices = index.search(queries, k)
+    return distances, indices, len(queries) / max(time.time() - start_time, 1e-9)
+
+
+def evaluate_race(distances, indices, gallery_labels, probe_labels, mated, threshold):
+    # rank-k accuracy over the mated probes, FPIR over the non-mated ones, FNIR at the threshold
+    hits = (gallery_labels[indices] == probe_labels[:, None]) & (indices >= 0)
+    scores = {}
+    for rank in RANKS:
+        scores[f'rank-{rank}'] = float(np.mean(np.any(hits[mated, :rank], axis=1))) if np.any(mated) else np.nan
+
+    # a probe is identified when its top candidate is within the threshold
+    candidate = distances[:, 0] <= threshold
+    scores['fnir'] = float(np.mean(~(candidate & hits[:, 0])[mated])) if np.any(mated) else np.nan
+    scores['fpir'] = float(np.mean(candidate[~mated])) if np.any(~mated) else np.nan
+    return scores
+
+
+def recall_at_k(exact_indices, approximate_indices):
+    # share of the exact top k that the approximate search also returns
+    found = (approximate_indices[:, :, None] == exact_indices[:, None, :]).any(axis=1)
+    return float(np.mean(found))
+
+
+def run_identification(model, detector, race_list, use_detection_store, batch_size, list_count, probe_count,
+                       output_file):
+    gallery, gallery_labels, probes, probe_labels, probe_races, mated = build_gallery(
+        model, detector, race_list, use_detection_store, batch_size)
+    threshold = verification.find_threshold(model, 'cosine')
+    k = max(RANKS)
+
+    exact_index = ExactIndex(gallery)
+    exact_distances, exact_indices, exact_qps = _timed_search(exact_index, probes, k)
+
+    start_time = time.time()
+    ivf_index = IVFIndex(gallery, list_count, probe_count)
+    train_time = time.time() - start_time
+    ivf_distances, ivf_indices, ivf_qps = _timed_search(ivf_index, probes, k)
+
+    with open(output_file, 'w') as file:
+        file.write(f'Model: {model}\nDetector: {detector}\nThreshold: {threshold}\n')
+        file.write(f'Gallery: {len(gallery)} identities\nProbes: {len(probes)} '
+                   f'({np.count_nonzero(mated)} mated, {np.count_nonzero(~mated)} non-mated)\n\n')
+        file.write(f'Exact Index:\t{exact_qps:.0f} queries/sec\n')
+        file.write(f'IVF Index:\t{ivf_qps:.0f} queries/sec, {ivf_index.list_count} lists, '
+                   f'{ivf_index.probe_count} probed, trained in {train_time:.1f}s\n')
+        file.write(f'IVF Recall@{k}:\t{recall_at_k(exact_indices, ivf_indices):.4f}\n')
+        file.write(f'IVF Recall@1:\t{recall_at_k(exact_indices[:, :1], ivf_indices[:, :1]):.4f}\n')
+
+        for race in race_list:
+            rows = probe_races == race
+            file.write(f'\n{race}\n')
+            for name, distances, indices in (('Exact', exact_distances, exact_indices),
+                                             ('IVF', ivf_distances, ivf_indices)):
+                scores = evaluate_race(distances[rows], indices[rows], gallery_labels, probe_labels[rows],
+                                       mated[rows], threshold)
+                file.write(f'\t{name}:\t' + ', '.join(f'{key} {value:.4f}' for key, value in scores.items()) + '\n')
+
+    print(f"{model}: exact {exact_qps:.0f} q/s, IVF {ivf_qps:.0f} q/s, results in {output_file}")
+
+
+def main():
+    race_list = ['African', 'Asian', 'Caucasian', 'Indian']
+    model_list = ['Facenet', 'Facenet512', 'DeepFace', 'ArcFace']
+    detector = 'mtcnn'
+    use_detection_store = True
+    batch_size = 32
+    # about sqrt(gallery size) lists; more probed lists trade speed for recall
+    list_count = 128
+    probe_count = 8
+
+    for model in model_list:
+        run_identification(model, detector, race_list, use_detection_store, batch_size, list_count, probe_count,
+                           f'tmp/{model}/identification_results.txt')
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Reads and decodes the images of upcoming pairs on a thread pool while the current pair is verified.
+# At most queue_depth pairs are in flight; an image shared by several pairs in that window is only
+# read once. verify.py's _verify_images takes the decoded BGR arrays in place of the paths and runs
+# detection, preprocessing and embedding on them, so the recognition loop only blocks on disk when the
+# readers fall behind, and that wait is what summary() reports.
+import threading
+import time
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+
+
+def read_image(image_path):
+    # the same decode DeepFace does for a path, cv2 releases the GIL while reading
+    image = cv2.imread(image_path)
+    if image is None:
+        raise ValueError(f"Confirm that {image_path} exists")
+    return image
+
+
+class ImagePrefetcher:
+
+    def __init__(self, path_pairs, queue_depth=16, threads=4, timer=None):
+        self.queue_depth = max(queue_depth, 1)
+        self.threads = threads
+        # a StageTimer that gets the per-image decode and per-pair I/O wait times
+        self.timer = timer
+        self._path_pairs = path_pairs
+        self._next_index = 0
+        self._window = deque()
+        self._futures = {}
+        self._references = Counter()
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._lock = threading.Lock()
+
+        self.read_count = 0
+        self.wait_time = 0
+        self.read_time = 0
+        self._start_time = time.time()
+
+    def _timed_read(self, image_path):
+        start_time = time.time()
+        try:
+            image = read_image(image_path)
+        finally:
+            read_time = time.time() - start_time
+            with self._lock:
+                self.read_time += read_time
+
+        if self.timer is not None:
+            self.timer.add('decode', read_time)
+        return image
+
+    def _submit_next(self):
+        path_pair = self._path_pairs[self._next_index]
+        self._next_index += 1
+        for image_path in path_pair:
+            if image_path not in self._futures:
+                self._futures[image_path] = self._executor.submit(self._timed_read, image_path)
+                self.read_count += 1
+            self._references[image_path] += 1
+        self._window.append(path_pair)
+
+    def _release(self, path_pair):
+        for image_path in path_pair:
+            self._references[image_path] -= 1
+            if self._references[image_path] == 0:
+                del self._references[image_path]
+                del self._futures[image_path]
+
+    def __iter__(self):
+        # yields the futures of one pair at a time, in order; pass them to wait() for the images
+        while self._next_index < len(self._path_pairs) or self._window:
+            # one more than queue_depth, so queue_depth pairs stay queued behind the one being verified
+            while self._next_index < len(self._path_pairs) and len(self._window) <= self.queue_depth:
+                self._submit_next()
+
+            path_pair = self._window.popleft()
+            futures = [self._futures[image_path] for image_path in path_pair]
+            self._release(path_pair)
+            yield futures
+
+    def wait(self, futures):
+        # raises the read error if an image could not be decoded
+        start_time = time.time()
+        try:
+            images = [future.result() for future in futures]
+        finally:
+            wait_time = time.time() - start_time
+            self.wait_time += wait_time
+
+        if self.timer is not None:
+            self.timer.add('io_wait', wait_time)
+        return images
+
+    def close(self):
+        self._executor.shutdown(wait=True, cancel_futures=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def summary(self):
+        total_time = time.time() - self._start_time
+        wait_share = self.wait_time / total_time * 100 if total_time > 0 else 0
+        return (f"Prefetch: {self.read_count} images read with {self.threads} threads, queue depth "
+                f"{self.queue_depth}, {self.read_time:.1f}s reading, waited on I/O for "
+                f"{self.wait_time:.1f}s ({wait_share:.1f}% of {total_time:.1f}s)")
+
@@ -0,0 +1,142 @@
+# Confusion counts and error rates of a race while it is still running. Every finished pair adds its
+# distance to a genuine or impostor histogram over fixed distance bins, so an update is O(1) and the
+# FMR/FNMR at every bin edge (and from them the EER) come from cumulative sums of the bins. Every
+# `every` pairs, and at the end of the race, a snapshot with the TP/FP/TN/FN at the model's threshold,
+# FMR/FNMR, the EER estimate, the failure count and the throughput is written to
+# tmp/<model>/<race>_live_metrics.json, so a long run can be watched and stopped early.
+import json
+import os
+import time
+
+import numpy as np
+
+# cosine distances lie in [0, 2]; 0.001 wide bins keep the EER estimate well inside its own noise
+BIN_EDGES = np.linspace(0, 2, 2001)
+
+
+def get_snapshot_path(model, race):
+    return f'tmp/{model}/{race}_live_metrics.json'
+
+
+def _format_rate(value):
+    return 'n/a' if value is None else f'{value:.4f}'
+
+
+class LiveMetrics:
+
+    def __init__(self, model, race, every=500, path=None):
+        self.model = model
+        self.race = race
+        self.every = every
+        self.path = path or get_snapshot_path(model, race)
+        self.genuine_counts = np.zeros(len(BIN_EDGES) + 1, dtype=np.int64)
+        self.impostor_counts = np.zeros(len(BIN_EDGES) + 1, dtype=np.int64)
+        self.threshold = None
+        # (tp, fp, tn, fn) at the threshold, counted exactly rather than from the bins
+        self.outcomes = np.zeros(4, dtype=np.int64)
+        self.failures = 0
+        # pairs finished before this run, left out of the throughput
+        self.resumed = 0
+        self.start_time = time.time()
+        self._pairs_since_snapshot = 0
+
+    @property
+    def count(self):
+        return int(self.genuine_counts.sum() + self.impostor_counts.sum())
+
+    def add(self, genuine, result):
+        # bin i holds the distances in (BIN_EDGES[i - 1], BIN_EDGES[i]], matching the <= acceptance rule
+        counts = self.genuine_counts if genuine else self.impostor_counts
+        counts[np.searchsorted(BIN_EDGES, result['distance'], side='left')] += 1
+
+        self.threshold = result['threshold']
+        accepted = result['distance'] <= result['threshold']
+        self.outcomes[(0 if accepted else 3) if genuine else (1 if accepted else 2)] += 1
+
+        self._pairs_since_snapshot += 1
+        if self._pairs_since_snapshot >= self.every:
+            self.write_snapshot()
+
+    def add_rows(self, rows):
+        # results of an interrupted run, RESULT_DTYPE rows as read_results returns them
+        if len(rows) == 0:
+            return
+        genuine = np.asarray(rows['genuine'])
+        distance = np.asarray(rows['distance'])
+        accepted = distance <= np.asarray(rows['threshold'])
+        bins = np.searchsorted(BIN_EDGES, distance, side='left')
+        self.genuine_counts += np.bincount(bins[genuine], minlength=len(self.genuine_counts))
+        self.impostor_counts += np.bincount(bins[~genuine], minlength=len(self.impostor_counts))
+        self.outcomes += [np.count_nonzero(genuine & accepted), np.count_nonzero(~genuine & accepted),
+                          np.count_nonzero(~genuine & ~accepted), np.count_nonzero(genuine & ~accepted)]
+        self.threshold = float(rows['threshold'][-1])
+        self.resumed += len(rows)
+
+    def add_failure(self):
+        self.failures += 1
+
+    def _equal_error_rate(self):
+        # rates at every bin edge; the EER is interpolated where FMR rises past FNMR
+        genuine_count = max(int(self.genuine_counts.sum()), 1)
+        impostor_count = max(int(self.impostor_counts.sum()), 1)
+        fmr = np.cumsum(self.impostor_counts)[:-1] / impostor_count
+        fnmr = 1 - np.cumsum(self.genuine_counts)[:-1] / genuine_count
+
+        crossing = int(np.argmax(fmr >= fnmr))
+        if crossing == 0:
+            return (fmr[0] + fnmr[0]) / 2, BIN_EDGES[0]
+        before = (fnmr - fmr)[crossing - 1]
+        after = (fnmr - fmr)[crossing]
+        weight = before / (before - after)
+        eer = fmr[crossing - 1] + weight * (fmr[crossing] - fmr[crossing - 1])
+        return eer, BIN_EDGES[crossing - 1] + weight * (BIN_EDGES[crossing] - BIN_EDGES[crossing - 1])
+
+    def snapshot(self):
+        tp, fp, tn, fn = (int(value) for value in self.outcomes)
+        elapsed = time.time() - self.start_time
+        values = {
+            'model': self.model,
+            'race': self.race,
+            'updated': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'pairs': self.count,
+            'genuine_pairs': int(self.genuine_counts.sum()),
+            'impostor_pairs': int(self.impostor_counts.sum()),
+            'failures': self.failures,
+            'elapsed': elapsed,
+            'pairs_per_second': (self.count - self.resumed) / elapsed if elapsed > 0 else None,
+            'threshold': self.threshold,
+            'true_positive': tp,
+            'false_positive': fp,
+            'true_negative': tn,
+            'false_negative': fn,
+            'fmr': fp / (fp + tn) if fp + tn else None,
+            'fnmr': fn / (fn + tp) if fn + tp else None,
+            'eer': None,
+            'eer_threshold': None}
+
+        # the EER needs both kinds of pairs
+        if values['genuine_pairs'] and values['impostor_pairs']:
+            eer, eer_threshold = self._equal_error_rate()
+            values['eer'] = float(eer)
+            values['eer_threshold'] = float(eer_threshold)
+        return values
+
+    def write_snapshot(self):
+        values = self.snapshot()
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        # replaced in one step, so a reader never sees a half written snapshot
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as file:
+            json.dump(values, file, indent=2)
+        os.replace(tmp_path, self.path)
+        self._pairs_since_snapshot = 0
+
+        print(self.summary(values))
+        return values
+
+    def summary(self, values=None):
+        values = values or self.snapshot()
+        return (f"Live metrics {self.model} - {self.race}: {values['pairs']} pairs, {values['failures']} failures, "
+                f"TP={values['true_positive']} FP={values['false_positive']} TN={values['true_negative']} "
+                f"FN={values['false_negative']} FMR={_format_rate(values['fmr'])} FNMR={_format_rate(values['fnmr'])} "
+                f"EER={_format_rate(values['eer'])}")
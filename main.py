@@ -1,75 +1,48 @@
-from deepface import DeepFace
 import pandas as pd
-import os
 
-# Load the FairFace dataset
-fairface_data = pd.read_csv('fair_face/archive/fairface_label_val.csv')
-image_dir = 'C:/Users/quris/Documents/fair_face/pythonProject2/fair_face/img'
-age_start = 0
-age_end = 0
-images = 300
+from fairface_attributes import ACTIONS, analyze_files
+from fairface_evaluation import evaluate_csv
 
-# Function to evaluate predictions
-def evaluate_predictions(predictions, ground_truth):
-    #Uncomment to see what the age range is
-    #print(age_ground_truth)
-    #Uncomment to see what the age prediction is
-    #print(predictions)
-    correct = 0
-    total = len(predictions)
-    for pred, gt in zip(predictions, ground_truth):
-        #print('gt is:', gt)
-        age_range_split = gt.split('-')
-        age_range_start = int(age_range_split[0])
-        age_range_end = int(age_range_split[1])
-        if age_range_start <= pred <= age_range_end:
-            correct += 1
-    accuracy = (correct / total) * 100
-    return accuracy
-def evaluate_other_predictions(predictions, ground_truth):
-    #print('predictions', predictions)
-    #print('ground truth', ground_truth)
-    other_correct = 0
-    other_total = len(predictions)
-    for pred, gt in zip(predictions, ground_truth):
-        if pred == gt:
-            other_correct += 1
-    other_accuracy = (other_correct / other_total) * 100
-    return other_accuracy
 
-# Function to predict age, gender, and race
-def predict_age_gender_race(image_path):
-    obj = DeepFace.analyze(image_path, enforce_detection=False)
-    age = obj[0]['age']
-    gender = obj[0]['dominant_gender']
-    race = obj[0]['dominant_race']
-    return age, gender, race
+def run_fairface(csv_path, image_dir, detector='opencv', image_limit=None, batch_size=64, workers=4):
+    # Load the FairFace dataset
+    fairface_data = pd.read_csv(csv_path)
+    if image_limit is not None:
+        fairface_data = fairface_data.head(image_limit)
 
-# Test predictions on the FairFace dataset
-age_predictions = []
-gender_predictions = []
-race_predictions = []
-age_ground_truth = fairface_data['age']
-gender_ground_truth = fairface_data['gender']
-race_ground_truth = fairface_data['race']
+    # predictions are cached in tmp/fairface/<detector>_predictions.jsonl, only new images are analyzed
+    predictions = analyze_files(list(fairface_data['file']), image_dir, detector, ACTIONS, batch_size, workers)
 
-for idx, row in fairface_data.iterrows():
-    image_path = os.path.join(image_dir, row['file'])
-    #print("Image path", image_path)
-    age_pred, gender_pred, race_pred = predict_age_gender_race(image_path)
-    age_predictions.append(age_pred)
-    gender_predictions.append(gender_pred)
-    race_predictions.append(race_pred)
+    # Evaluate accuracy, overall and per ground-truth race x gender; rows past image_limit have no prediction
+    evaluator = evaluate_csv(csv_path, predictions)
+    evaluator.write_report('testing_results/fairface/Attribute_Results.txt')
+    age_accuracy = evaluator.accuracy('age')
+    gender_accuracy = evaluator.accuracy('gender')
+    race_accuracy = evaluator.accuracy('race')
 
-# Evaluate accuracy
-age_accuracy = evaluate_predictions(age_predictions, age_ground_truth)
-gender_accuracy = evaluate_other_predictions(gender_predictions, gender_ground_truth)
-race_accuracy = evaluate_other_predictions(race_predictions, race_ground_truth)
+    with open('results.txt', 'w') as file:
+        file.write("Accuracy for predicting age: {:.2f}%\n".format(age_accuracy))
+        file.write("Accuracy for predicting gender: {:.2f}%\n".format(gender_accuracy))
+        file.write("Accuracy for predicting race: {:.2f}%\n".format(race_accuracy))
+    print("Accuracy for predicting age: {:.2f}%".format(age_accuracy))
+    print("Accuracy for predicting gender: {:.2f}%".format(gender_accuracy))
+    print("Accuracy for predicting race: {:.2f}%".format(race_accuracy))
 
-with open('results.txt', 'w') as file:
-    file.write("Accuracy for predicting age: {:.2f}%\n".format(age_accuracy))
-    file.write("Accuracy for predicting gender: {:.2f}%\n".format(gender_accuracy))
-    file.write("Accuracy for predicting race: {:.2f}%\n".format(race_accuracy))
-print("Accuracy for predicting age: {:.2f}%".format(age_accuracy))
-print("Accuracy for predicting gender: {:.2f}%".format(gender_accuracy))
-print("Accuracy for predicting race: {:.2f}%".format(race_accuracy))
+
+def main():
+    csv_path = 'fair_face/archive/fairface_label_val.csv'
+    image_dir = 'fair_face/img'
+    # None runs the whole validation split, e.g. 300 for a quick check
+    image_limit = None
+    # DeepFace.analyze's default detector
+    detector = 'opencv'
+    # crops per forward pass of each attribute head
+    batch_size = 64
+    # threads decoding images ahead of detection and the heads, which both stay on this thread
+    workers = 4
+
+    run_fairface(csv_path, image_dir, detector, image_limit, batch_size, workers)
+
+
+if __name__ == "__main__":
+    main()
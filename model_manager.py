@@ -0,0 +1,124 @@
+# Keeps each recognition model loaded for the whole race loop instead of calling
+# tf.keras.backend.clear_session() after every pair. The session is only reset every reset_every
+# pairs or once the process RSS passes rss_limit_mb (both optional), which bounds any slow leak
+# without paying model build and tracing costs on every pair.
+import gc
+import os
+import time
+
+import tensorflow as tf
+from deepface import DeepFace
+from deepface.modules import modeling
+
+from pair_index import load_pair_index
+
+
+def get_rss_mb():
+    # current resident set size, None where /proc is not available
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            resident_pages = int(file.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / 1024 ** 2
+    except (OSError, ValueError, IndexError, AttributeError):
+        return None
+
+
+class ModelManager:
+
+    def __init__(self, reset_every=None, rss_limit_mb=None):
+        self.reset_every = reset_every
+        self.rss_limit_mb = rss_limit_mb
+        self.loaded_models = []
+        self.pair_count = 0
+        self.reset_count = 0
+        self.load_time = 0
+        self.reset_time = 0
+
+    def load(self, model):
+        # DeepFace keeps built models in modeling.model_obj, so this only builds on first use
+        if model not in self.loaded_models:
+            start_time = time.time()
+            modeling.build_model(model)
+            self.load_time += time.time() - start_time
+            self.loaded_models.append(model)
+        return modeling.build_model(model)
+
+    def after_pair(self):
+        self.pair_count += 1
+
+        if self.reset_every and self.pair_count % self.reset_every == 0:
+            self.reset()
+        elif self.rss_limit_mb is not None:
+            rss_mb = get_rss_mb()
+            if rss_mb is not None and rss_mb > self.rss_limit_mb:
+                print(f"RSS {rss_mb:.0f} MB is over {self.rss_limit_mb} MB, resetting models")
+                self.reset()
+
+    def reset(self):
+        start_time = time.time()
+
+        # drop DeepFace's references too, otherwise the old models survive the session reset
+        tf.keras.backend.clear_session()
+        for model in self.loaded_models:
+            modeling.model_obj.pop(model, None)
+        gc.collect()
+
+        for model in self.loaded_models:
+            modeling.build_model(model)
+
+        self.reset_time += time.time() - start_time
+        self.reset_count += 1
+
+    def summary(self):
+        reset_time_per_pair = self.reset_time / self.pair_count if self.pair_count else 0
+        return (f"Pairs: {self.pair_count}\nResets: {self.reset_count}\n"
+                f"Load Time: {self.load_time:.2f}\nReset Time per Pair: {reset_time_per_pair:.4f}")
+
+
+def _time_pairs(image_path_pairs, model, detector, distance_metric, clear_every_pair):
+    pair_times = []
+    for template_image_path, test_image_path in image_path_pairs:
+        start_time = time.time()
+        try:
+            DeepFace.verify(template_image_path, test_image_path, model, detector, distance_metric)
+        except Exception as e:
+            print(str(e))
+            continue
+        if clear_every_pair:
+            tf.keras.backend.clear_session()
+        pair_times.append(time.time() - start_time)
+    return pair_times
+
+
+def compare_with_clear_every_pair(image_path_pairs, model, detector, distance_metric):
+    # per pair time of the old clear_session()-after-every-pair loop against a warm model
+    modeling.build_model(model)
+    _time_pairs(image_path_pairs[:2], model, detector, distance_metric, False)
+
+    cleared_times = _time_pairs(image_path_pairs, model, detector, distance_metric, True)
+    warm_times = _time_pairs(image_path_pairs, model, detector, distance_metric, False)
+
+    cleared_time = sum(cleared_times) / len(cleared_times)
+    warm_time = sum(warm_times) / len(warm_times)
+    return cleared_time, warm_time
+
+
+def main():
+    race = 'African'
+    model_list = ['Facenet', 'Facenet512', 'DeepFace', 'ArcFace']
+    distance_metric = 'cosine'
+    detector = 'mtcnn'
+    pair_limit = 100
+
+    pairs = load_pair_index(race).get_pairs(0, pair_limit)
+    image_path_pairs = [(pair[2], pair[5]) for pair in pairs]
+
+    for model in model_list:
+        cleared_time, warm_time = compare_with_clear_every_pair(image_path_pairs, model, detector, distance_metric)
+        print(f"\nModel: {model}\nclear_session() every pair: {cleared_time:.4f} s/pair\n"
+              f"Warm model: {warm_time:.4f} s/pair\nSaved: {cleared_time - warm_time:.4f} s/pair "
+              f"({100 * (cleared_time - warm_time) / cleared_time:.1f}%)")
+
+
+if __name__ == "__main__":
+    main()
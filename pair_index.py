@@ -0,0 +1,130 @@
+# Compiles rfw/test/txts/<race>/<race>_pairs.txt into NumPy arrays under tmp/pair_index/<race>/: the
+# unique image paths with their identity and image index, int32 template/test image ids per pair and a
+# genuine flag. The arrays are memory-mapped on load, so every model and worker process shares one
+# parse of the pairs file. The index is rebuilt whenever the pairs file's size or mtime changes.
+import json
+import os
+
+import numpy as np
+
+INDEX_VERSION = 1
+ARRAY_NAMES = ['image_paths', 'image_identities', 'image_indices', 'template_ids', 'test_ids', 'genuine']
+
+
+def get_pairs_path(race):
+    return 'rfw/test/txts/' + race + '/' + race + '_pairs.txt'
+
+
+def _get_index_dir(race):
+    return f'tmp/pair_index/{race}'
+
+
+def get_image_path(race, identity, image_index):
+    return 'rfw/test/data/' + race + '/' + identity + '/' + identity + '_000' + str(image_index) + '.jpg'
+
+
+def _get_source_key(pairs_path):
+    stat = os.stat(pairs_path)
+    return {'version': INDEX_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _parse_pairs(pairs_path):
+    # a row is either "identity index index" (genuine) or "identity index identity index"
+    rows = []
+    with open(pairs_path, 'r') as file:
+        for line in file:
+            fields = line.rstrip('\n').split('\t')
+            if fields == ['']:
+                continue
+            if len(fields) == 4:
+                rows.append((fields[0], int(fields[1]), fields[2], int(fields[3])))
+            elif len(fields) == 3:
+                rows.append((fields[0], int(fields[1]), fields[0], int(fields[2])))
+            else:
+                raise Exception(f"Error in {pairs_path}: {line!r}")
+    return rows
+
+
+def build_pair_index(race):
+    pairs_path = get_pairs_path(race)
+    source_key = _get_source_key(pairs_path)
+    rows = _parse_pairs(pairs_path)
+
+    image_ids = {}
+    template_ids = np.empty(len(rows), dtype=np.int32)
+    test_ids = np.empty(len(rows), dtype=np.int32)
+    for i, (template_identity, template_index, test_identity, test_index) in enumerate(rows):
+        template_ids[i] = image_ids.setdefault((template_identity, template_index), len(image_ids))
+        test_ids[i] = image_ids.setdefault((test_identity, test_index), len(image_ids))
+
+    images = list(image_ids)
+    arrays = {
+        'image_paths': np.array([get_image_path(race, identity, index).encode() for identity, index in images],
+                                dtype=bytes),
+        'image_identities': np.array([identity.encode() for identity, _ in images], dtype=bytes),
+        'image_indices': np.array([index for _, index in images], dtype=np.int32),
+        'template_ids': template_ids,
+        'test_ids': test_ids,
+        'genuine': np.array([row[0] == row[2] for row in rows], dtype=bool)}
+
+    index_dir = _get_index_dir(race)
+    os.makedirs(index_dir, exist_ok=True)
+    for name in ARRAY_NAMES:
+        tmp_path = f'{index_dir}/{name}.tmp.npy'
+        np.save(tmp_path, arrays[name])
+        os.replace(tmp_path, f'{index_dir}/{name}.npy')
+
+    # written last, an index without a matching source.json is rebuilt
+    with open(f'{index_dir}/source.json', 'w') as file:
+        json.dump(source_key, file)
+
+    print(f"Pair index for {race}: {len(rows)} pairs, {len(images)} unique images")
+
+
+def _is_current(race):
+    source_path = f'{_get_index_dir(race)}/source.json'
+    if not os.path.exists(source_path):
+        return False
+
+    # without the pairs file the existing index is the best there is
+    pairs_path = get_pairs_path(race)
+    if not os.path.exists(pairs_path):
+        return True
+
+    with open(source_path, 'r') as file:
+        return json.load(file) == _get_source_key(pairs_path)
+
+
+class PairIndex:
+
+    def __init__(self, race, arrays):
+        self.race = race
+        for name in ARRAY_NAMES:
+            setattr(self, name, arrays[name])
+
+    def __len__(self):
+        return len(self.template_ids)
+
+    def get_pair(self, i):
+        # (identity, index, path) of the template image, then of the test image
+        template_id = self.template_ids[i]
+        test_id = self.test_ids[i]
+        return (self.image_identities[template_id].decode(),
+                int(self.image_indices[template_id]),
+                self.image_paths[template_id].decode(),
+                self.image_identities[test_id].decode(),
+                int(self.image_indices[test_id]),
+                self.image_paths[test_id].decode())
+
+    def get_pairs(self, start=0, stop=None):
+        stop = len(self) if stop is None else min(stop, len(self))
+        return [self.get_pair(i) for i in range(start, stop)]
+
+
+def load_pair_index(race):
+    if not _is_current(race):
+        build_pair_index(race)
+
+    index_dir = _get_index_dir(race)
+    arrays = {name: np.load(f'{index_dir}/{name}.npy', mmap_mode='r') for name in ARRAY_NAMES}
+    return PairIndex(race, arrays)
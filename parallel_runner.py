@@ -0,0 +1,205 @@
+# Runs the (model, race, pair range) grid of verify.py in a process pool. Every shard is a slice of a
+# race's pairs file that one worker verifies into tmp/<model>/shards/<race>_<start>.txt; once all
+# shards of a (model, race) are done they are merged into tmp/<model>/<race>_results.txt in the
+# original pair order. Workers are spawned, so each one has its own TensorFlow runtime and models.
+# With --resume, merged (model, race) cells are skipped and shards carry on from their journals.
+import argparse
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from checkpoint import ResultJournal, get_journal_path
+from failure_log import FailureLog, get_failure_log_path
+from pair_index import load_pair_index
+from result_store import get_columnar_paths, write_metadata
+from stage_timer import StageTimer
+
+_model_manager = None
+
+
+def _get_shard_path(model, race, start):
+    return f'tmp/{model}/shards/{race}_{start:05d}.txt'
+
+
+def _get_shard_failure_path(model, race, start):
+    return f'tmp/{model}/shards/{race}_{start:05d}_failures.jsonl'
+
+
+def _get_merged_marker_path(model, race):
+    return f'tmp/{model}/shards/{race}_merged'
+
+
+def _init_worker(threads_per_worker, reset_every, rss_limit_mb):
+    global _model_manager
+
+    # must be set before TensorFlow is imported, otherwise every worker grabs all cores
+    os.environ['TF_NUM_INTRAOP_THREADS'] = str(threads_per_worker)
+    os.environ['TF_NUM_INTEROP_THREADS'] = '1'
+    os.environ['OMP_NUM_THREADS'] = str(threads_per_worker)
+
+    from model_manager import ModelManager
+    _model_manager = ModelManager(reset_every=reset_every, rss_limit_mb=rss_limit_mb)
+
+
+def _run_shard(model, race, detector, distance_metric, start, stop, resume, queue_depth, prefetch_threads):
+    import verify
+
+    # the parent built the index, so workers only memory-map it
+    pair_list = load_pair_index(race).get_pairs(start, stop)
+
+    # failed pairs are retried on resume, so the shard's failure log always starts empty
+    timer = StageTimer(model, detector, race)
+    with ResultJournal(model, race, _get_shard_path(model, race, start), resume, header=False) as journal, \
+            FailureLog(model, _get_shard_failure_path(model, race, start)) as failure_log:
+        verify._run_pairs(race, model, detector, distance_metric, pair_list, journal, failure_log, timer,
+                          _model_manager, start, queue_depth, prefetch_threads)
+
+    # the parent pools the shards' samples into one summary per (model, race)
+    return failure_log.count, timer.samples
+
+
+def make_shards(model_list, race_list, test_limit, shard_size, resume=False):
+    shards = []
+    for model in model_list:
+        for race in race_list:
+            if resume and os.path.exists(_get_merged_marker_path(model, race)):
+                print(f"Skipping {model} - {race}, merged by an earlier run")
+                continue
+
+            pair_count = min(len(load_pair_index(race)), test_limit + 1)
+            for start in range(0, pair_count, shard_size):
+                shards.append((model, race, start, min(start + shard_size, pair_count)))
+    return shards
+
+
+def merge_shards(model, race, starts):
+    results_path = f'tmp/{model}/{race}_results.txt'
+    data_path, _ = get_columnar_paths(results_path)
+    write_metadata(results_path, model, race)
+
+    with open(results_path, 'w') as results_file, open(data_path, 'wb') as data_file, \
+            open(get_journal_path(results_path), 'w') as journal_file:
+        results_file.write('File1\tFile2\tResult\n')
+        for start in sorted(starts):
+            shard_path = _get_shard_path(model, race, start)
+            shard_data_path, _ = get_columnar_paths(shard_path)
+            with open(shard_path, 'r') as shard_file:
+                for line in shard_file:
+                    results_file.write(line)
+            # columnar records are fixed size, so shards can be concatenated byte for byte
+            with open(shard_data_path, 'rb') as shard_data_file:
+                data_file.write(shard_data_file.read())
+            with open(get_journal_path(shard_path), 'r') as shard_journal_file:
+                for line in shard_journal_file:
+                    journal_file.write(line)
+
+    # shard failures go to the model's log a cell at a time, so it never holds a half-run cell
+    with open(get_failure_log_path(model), 'a') as failure_file:
+        for start in sorted(starts):
+            with open(_get_shard_failure_path(model, race, start), 'r') as shard_failure_file:
+                for line in shard_failure_file:
+                    failure_file.write(line)
+
+    # the marker is written last, so a crash mid-merge leaves the shards in place for --resume
+    with open(_get_merged_marker_path(model, race), 'w'):
+        pass
+    for start in starts:
+        shard_path = _get_shard_path(model, race, start)
+        shard_paths = (shard_path, get_journal_path(shard_path), _get_shard_failure_path(model, race, start))
+        for path in shard_paths + get_columnar_paths(shard_path):
+            os.remove(path)
+
+
+def _keep_merged_failures(model, race_list):
+    # on resume, failures of cells that are not merged yet are logged again when their shards rerun
+    log_path = get_failure_log_path(model)
+    merged_races = {race for race in race_list if os.path.exists(_get_merged_marker_path(model, race))}
+
+    tmp_path = log_path + '.tmp'
+    with open(tmp_path, 'w') as tmp_file:
+        if os.path.exists(log_path):
+            with open(log_path, 'r') as log_file:
+                for line in log_file:
+                    if line.endswith('\n') and json.loads(line)['race'] in merged_races:
+                        tmp_file.write(line)
+    os.replace(tmp_path, log_path)
+
+
+def run_parallel(model_list, race_list, detector, distance_metric, test_limit, workers, shard_size,
+                 threads_per_worker=1, reset_every=None, rss_limit_mb=None, resume=False, queue_depth=4,
+                 prefetch_threads=1):
+    # prefetch_threads and queue_depth are per worker, like threads_per_worker, so N workers decode
+    # with N * prefetch_threads threads
+    for model in model_list:
+        os.makedirs(f'tmp/{model}', exist_ok=True)
+        if not resume:
+            for race in race_list:
+                if os.path.exists(_get_merged_marker_path(model, race)):
+                    os.remove(_get_merged_marker_path(model, race))
+        _keep_merged_failures(model, race_list)
+
+    shards = make_shards(model_list, race_list, test_limit, shard_size, resume)
+    pending_starts = {}
+    finished_starts = {}
+    for model, race, start, _ in shards:
+        pending_starts.setdefault((model, race), []).append(start)
+        finished_starts.setdefault((model, race), [])
+
+    failure_counts = {model: 0 for model in model_list}
+    timers = {(model, race): StageTimer(model, detector, race) for model, race in pending_starts}
+
+    # spawn rather than fork, TensorFlow is not fork safe
+    with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                             initializer=_init_worker,
+                             initargs=(threads_per_worker, reset_every, rss_limit_mb)) as executor:
+        futures = {}
+        for model, race, start, stop in shards:
+            future = executor.submit(_run_shard, model, race, detector, distance_metric, start, stop, resume,
+                                     queue_depth, prefetch_threads)
+            futures[future] = (model, race, start)
+
+        for count, future in enumerate(as_completed(futures), start=1):
+            model, race, start = futures[future]
+            failure_count, samples = future.result()
+            failure_counts[model] += failure_count
+            for stage, stage_samples in samples.items():
+                timers[(model, race)].samples.setdefault(stage, []).extend(stage_samples)
+            finished_starts[(model, race)].append(start)
+            print(f"Shard {count}/{len(shards)} done: {model} - {race} from pair {start}")
+
+            if len(finished_starts[(model, race)]) == len(pending_starts[(model, race)]):
+                merge_shards(model, race, finished_starts[(model, race)])
+                print(f"Output file generated successfully for {model} - {race}.")
+                print(f"Stage timings written to {timers[(model, race)].write_summary()}")
+
+    return failure_counts
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resume', action='store_true', help='skip pairs finished by an interrupted run')
+    args = parser.parse_args()
+
+    race_list = ['African', 'Asian', 'Caucasian', 'Indian']
+    model_list = ['Facenet', 'Facenet512', 'DeepFace', 'ArcFace']
+    distance_metric = 'cosine'
+    detector = 'mtcnn'
+    test_limit = 10000
+    workers = os.cpu_count()
+    shard_size = 250
+    threads_per_worker = 1
+    # image reads ahead of each worker, kept at one thread so workers x threads stays within the cores
+    queue_depth = 4
+    prefetch_threads = 1
+
+    failure_counts = run_parallel(model_list, race_list, detector, distance_metric, test_limit, workers, shard_size,
+                                  threads_per_worker, reset_every=None, rss_limit_mb=8192, resume=args.resume,
+                                  queue_depth=queue_depth, prefetch_threads=prefetch_threads)
+
+    for model in model_list:
+        print(f"{model}: {failure_counts[model]} failures logged to {get_failure_log_path(model)}")
+
+
+if __name__ == "__main__":
+    main()
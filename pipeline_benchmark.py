@@ -0,0 +1,377 @@
+# Offline throughput benchmark of the verification pipeline. Builds a synthetic RFW-shaped tree
+# (rfw/test/data/<race>/<identity>/*.jpg and rfw/test/txts/<race>/<race>_pairs.txt) in a temporary
+# directory for each data size, and by default swaps deterministic stand-ins for DeepFace's detector
+# and embedding models and for TensorFlow into sys.modules, so it needs neither the RFW download,
+# model weights, a GPU nor network access. Times pair parsing, decode, detect, embed, distance,
+# result writing, the per-pair pipeline of verify.py and the analysis scripts, and writes them to
+# tmp/pipeline_benchmark.json so runs can be compared.
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+import types
+
+import cv2
+import numpy as np
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+RACE = 'African'
+MODEL = 'Facenet'
+DISTANCE_METRIC = 'cosine'
+IMAGE_SIZE = 400
+IMAGES_PER_IDENTITY = 4
+# share of synthetic images without a face, so the failure path is exercised too
+BLANK_IMAGE_SHARE = 0.01
+STUB_EMBEDDING_SIZE = 128
+STUB_INPUT_SHAPE = (160, 160)
+STUB_POOL_SIZE = 16
+
+
+class _StubModel:
+    # a fixed random projection of the 16x16 average-pooled face, deterministic and CPU only
+
+    def __init__(self, model_name):
+        seed = sum(map(ord, model_name))
+        rng = np.random.default_rng(seed)
+        self.projection = rng.standard_normal((STUB_POOL_SIZE * STUB_POOL_SIZE * 3, STUB_EMBEDDING_SIZE))
+        self.projection = self.projection.astype(np.float32)
+
+    def predict_on_batch(self, faces):
+        pooled = [cv2.resize(face, (STUB_POOL_SIZE, STUB_POOL_SIZE), interpolation=cv2.INTER_AREA) for face in faces]
+        return np.stack(pooled).reshape(len(faces), -1) @ self.projection
+
+
+class _StubClient:
+
+    def __init__(self, model_name):
+        self.model_name = model_name
+        self.input_shape = STUB_INPUT_SHAPE
+        self.output_shape = STUB_EMBEDDING_SIZE
+        self.model = _StubModel(model_name)
+
+    def find_embeddings(self, img):
+        return self.model.predict_on_batch(img)[0].tolist()
+
+
+def _stub_load_image(img):
+    if isinstance(img, np.ndarray):
+        return img
+    image = cv2.imread(img)
+    if image is None:
+        raise ValueError(f"Confirm that {img} exists")
+    return image
+
+
+def _stub_extract_faces(img_path, target_size=(224, 224), detector_backend='opencv', enforce_detection=True,
+                        align=True, grayscale=False, **kwargs):
+    # the synthetic faces sit in the middle half of the image, blank images have no face
+    image = _stub_load_image(img_path)
+    height, width = image.shape[:2]
+    x, y, w, h = width // 4, height // 4, width // 2, height // 2
+    face = image[y:y + h, x:x + w]
+    if enforce_detection and face.mean() < 5:
+        raise ValueError("Face could not be detected. Please confirm that the picture is a face photo "
+                         "or consider to set enforce_detection param to False.")
+
+    if target_size is not None:
+        face = cv2.resize(face, (target_size[1], target_size[0]))
+    return [{
+        'face': np.expand_dims(face.astype(np.float32) / 255, axis=0),
+        'facial_area': {'x': x, 'y': y, 'w': w, 'h': h,
+                        'left_eye': (x + w // 3, y + h // 3), 'right_eye': (x + 2 * w // 3, y + h // 3)},
+        'confidence': 1.0}]
+
+
+def _stub_build_model(model_name, modeling):
+    if model_name not in modeling.model_obj:
+        modeling.model_obj[model_name] = _StubClient(model_name)
+    return modeling.model_obj[model_name]
+
+
+def _stub_find_distance(source_representation, test_representation, distance_metric):
+    source = np.asarray(source_representation, dtype=np.float64)
+    test = np.asarray(test_representation, dtype=np.float64)
+    if distance_metric == 'cosine':
+        return 1 - np.dot(source, test) / (np.linalg.norm(source) * np.linalg.norm(test))
+    if distance_metric == 'euclidean_l2':
+        source = source / np.linalg.norm(source)
+        test = test / np.linalg.norm(test)
+    return np.linalg.norm(source - test)
+
+
+def _stub_represent(img_path, model_name='VGG-Face', detector_backend='opencv', enforce_detection=True,
+                    align=True, **kwargs):
+    from deepface.modules import modeling
+
+    client = modeling.build_model(model_name)
+    face_objs = _stub_extract_faces(img_path, client.input_shape, detector_backend, enforce_detection, align)
+    return [{'embedding': client.find_embeddings(face_obj['face']), 'facial_area': face_obj['facial_area'],
+             'face_confidence': face_obj['confidence']} for face_obj in face_objs]
+
+
+def _stub_verify(img1_path, img2_path, model_name='VGG-Face', detector_backend='opencv', distance_metric='cosine',
+                 **kwargs):
+    start_time = time.time()
+    img1 = _stub_represent(img1_path, model_name, detector_backend)[0]
+    img2 = _stub_represent(img2_path, model_name, detector_backend)[0]
+    distance = float(_stub_find_distance(img1['embedding'], img2['embedding'], distance_metric))
+    threshold = 0.4
+    return {
+        'verified': distance <= threshold,
+        'distance': distance,
+        'threshold': threshold,
+        'model': model_name,
+        'detector_backend': detector_backend,
+        'similarity_metric': distance_metric,
+        'facial_areas': {'img1': img1['facial_area'], 'img2': img2['facial_area']},
+        'time': round(time.time() - start_time, 2)}
+
+
+def install_stubs():
+    # must run before any module of this repository is imported
+    tensorflow = types.ModuleType('tensorflow')
+    tensorflow.keras = types.SimpleNamespace(backend=types.SimpleNamespace(clear_session=lambda: None))
+
+    deepface = types.ModuleType('deepface')
+    deepface.__path__ = []
+    modules = types.ModuleType('deepface.modules')
+    modules.__path__ = []
+
+    modeling = types.ModuleType('deepface.modules.modeling')
+    modeling.model_obj = {}
+    modeling.build_model = lambda model_name: _stub_build_model(model_name, modeling)
+
+    detection = types.ModuleType('deepface.modules.detection')
+    detection.extract_faces = _stub_extract_faces
+
+    verification = types.ModuleType('deepface.modules.verification')
+    verification.find_distance = _stub_find_distance
+    verification.find_threshold = lambda model_name, distance_metric: 0.4
+
+    deepface_module = types.ModuleType('deepface.DeepFace')
+    deepface_module.build_model = modeling.build_model
+    deepface_module.represent = _stub_represent
+    deepface_module.verify = _stub_verify
+
+    deepface.DeepFace = deepface_module
+    deepface.modules = modules
+    modules.modeling = modeling
+    modules.detection = detection
+    modules.verification = verification
+
+    sys.modules.update({
+        'tensorflow': tensorflow,
+        'deepface': deepface,
+        'deepface.DeepFace': deepface_module,
+        'deepface.modules': modules,
+        'deepface.modules.modeling': modeling,
+        'deepface.modules.detection': detection,
+        'deepface.modules.verification': verification})
+
+
+def make_synthetic_rfw(race, pair_count, seed=0):
+    # half genuine rows (identity index index), half impostor rows (identity index identity index)
+    rng = np.random.default_rng(seed)
+    identity_count = max(pair_count // 10, 2)
+    identities = [f'm.{i:06x}' for i in range(identity_count)]
+
+    for identity in identities:
+        identity_dir = f'rfw/test/data/{race}/{identity}'
+        os.makedirs(identity_dir, exist_ok=True)
+        base = rng.integers(0, 256, size=(IMAGE_SIZE // 8, IMAGE_SIZE // 8, 3), dtype=np.uint8)
+        for image_index in range(1, IMAGES_PER_IDENTITY + 1):
+            if rng.random() < BLANK_IMAGE_SHARE:
+                image = np.zeros((IMAGE_SIZE, IMAGE_SIZE, 3), dtype=np.uint8)
+            else:
+                # each identity has its own base pattern, each image of it adds its own noise
+                image = cv2.resize(base, (IMAGE_SIZE, IMAGE_SIZE), interpolation=cv2.INTER_LINEAR)
+                noise = rng.integers(-20, 21, size=image.shape)
+                image = np.clip(image.astype(np.int16) + noise, 1, 255).astype(np.uint8)
+            cv2.imwrite(f'{identity_dir}/{identity}_000{image_index}.jpg', image)
+
+    pairs_dir = f'rfw/test/txts/{race}'
+    os.makedirs(pairs_dir, exist_ok=True)
+    with open(f'{pairs_dir}/{race}_pairs.txt', 'w') as file:
+        for i in range(pair_count):
+            template_identity = identities[rng.integers(identity_count)]
+            template_index, test_index = rng.choice(np.arange(1, IMAGES_PER_IDENTITY + 1), size=2, replace=False)
+            if i % 2 == 0:
+                file.write(f'{template_identity}\t{template_index}\t{test_index}\n')
+            else:
+                test_identity = identities[(identities.index(template_identity) + 1 + rng.integers(identity_count - 1))
+                                           % identity_count]
+                file.write(f'{template_identity}\t{template_index}\t{test_identity}\t{test_index}\n')
+
+    return identity_count * IMAGES_PER_IDENTITY
+
+
+def _stage(stages, name, seconds, items):
+    stages[name] = {'seconds': seconds, 'items': items, 'per_second': items / seconds if seconds > 0 else None}
+
+
+def _run_size(pair_count, detector, batch_size):
+    import detection_cache
+    import embedding_cache
+    import verify
+    from checkpoint import ResultJournal
+    from failure_log import FailureLog
+    from image_prefetch import read_image
+    from model_manager import ModelManager
+    from pair_index import build_pair_index, load_pair_index
+    from stage_timer import StageTimer
+
+    from create_model_result_file import write_results_to_file
+    from results_loader import load_distances, load_results
+    from roc import compute_roc
+
+    stages = {}
+    start_time = time.time()
+    image_count = make_synthetic_rfw(RACE, pair_count)
+    setup_time = time.time() - start_time
+
+    start_time = time.time()
+    build_pair_index(RACE)
+    pairs = load_pair_index(RACE).get_pairs()
+    _stage(stages, 'pair_parsing', time.time() - start_time, len(pairs))
+
+    start_time = time.time()
+    pairs = load_pair_index(RACE).get_pairs()
+    _stage(stages, 'pair_index_load', time.time() - start_time, len(pairs))
+
+    image_paths = embedding_cache.get_unique_image_paths([(pair[2], pair[5]) for pair in pairs])
+    start_time = time.time()
+    for image_path in image_paths:
+        read_image(image_path)
+    _stage(stages, 'decode', time.time() - start_time, len(image_paths))
+
+    timer = StageTimer(MODEL, detector, RACE)
+    detection_store = detection_cache.DetectionStore(detector, RACE)
+    start_time = time.time()
+    detection_cache.detect_faces(detection_store, image_paths, timer)
+    _stage(stages, 'detect', time.time() - start_time, len(image_paths))
+
+    cache = embedding_cache.EmbeddingCache(MODEL, detector, RACE)
+    start_time = time.time()
+    embedding_cache.compute_embeddings(cache, image_paths, detection_store, batch_size, timer)
+    _stage(stages, 'embed', time.time() - start_time, len(image_paths))
+
+    results = []
+    start_time = time.time()
+    for pair in pairs:
+        if pair[2] not in cache.failures and pair[5] not in cache.failures:
+            results.append((pair, embedding_cache.build_result(cache, pair[2], pair[5], DISTANCE_METRIC)))
+    _stage(stages, 'distance', time.time() - start_time, len(results))
+
+    results_path = f'tmp/{MODEL}/{RACE}_results.txt'
+    start_time = time.time()
+    with ResultJournal(MODEL, RACE, results_path, resume=False) as journal:
+        for pair, result in results:
+            journal.write_result(pair[0], pair[1], pair[3], pair[4], result)
+    _stage(stages, 'result_writing', time.time() - start_time, len(results))
+
+    # the uncached per-pair path of verify.py: prefetch, detect, preprocess, embed, distance
+    pipeline_timer = StageTimer(MODEL, detector, RACE)
+    start_time = time.time()
+    with ResultJournal(MODEL, RACE, f'tmp/{MODEL}/pipeline_results.txt', resume=False) as journal, \
+            FailureLog(MODEL) as failure_log:
+        verify._run_pairs(RACE, MODEL, detector, DISTANCE_METRIC, pairs, journal, failure_log, pipeline_timer,
+                          ModelManager())
+    _stage(stages, 'pipeline', time.time() - start_time, len(pairs))
+
+    # analysis scripts: columnar results, then the text parse on first load and the cached reload
+    start_time = time.time()
+    load_results(results_path)
+    _stage(stages, 'analysis_load_columnar', time.time() - start_time, len(results))
+
+    for path in (f'tmp/{MODEL}/{RACE}_results.bin', f'tmp/{MODEL}/{RACE}_results.json'):
+        os.remove(path)
+    start_time = time.time()
+    load_results(results_path)
+    _stage(stages, 'analysis_load_text', time.time() - start_time, len(results))
+
+    start_time = time.time()
+    genuine, impostor = load_distances(results_path)
+    _stage(stages, 'analysis_load_cached', time.time() - start_time, len(results))
+
+    start_time = time.time()
+    compute_roc(genuine, impostor)
+    _stage(stages, 'analysis_roc', time.time() - start_time, len(results))
+
+    start_time = time.time()
+    write_results_to_file(RACE, 0.4, results_path, 'tmp/Standard_Results.txt')
+    _stage(stages, 'analysis_result_file', time.time() - start_time, len(results))
+
+    return {
+        'pairs': len(pairs),
+        'images': image_count,
+        'failed_images': len(cache.failures),
+        'setup_seconds': setup_time,
+        'stages': stages,
+        'stage_latency': timer.summarize()['stages'],
+        'pipeline_latency': pipeline_timer.summarize()['stages']}
+
+
+def run_benchmark(sizes, batch_size=32, real_models=False, output=None):
+    output = output or os.path.join(REPO_DIR, 'tmp', 'pipeline_benchmark.json')
+    if not real_models:
+        install_stubs()
+    detector = 'skip' if real_models else 'stub'
+    sys.path.append(os.path.join(REPO_DIR, 'scripts'))
+
+    runs = []
+    working_dir = os.getcwd()
+    for pair_count in sizes:
+        # every path in the pipeline is relative, so each size runs in its own scratch directory
+        scratch_dir = tempfile.mkdtemp(prefix='pipeline_benchmark_')
+        os.chdir(scratch_dir)
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                run = _run_size(pair_count, detector, batch_size)
+        finally:
+            os.chdir(working_dir)
+            shutil.rmtree(scratch_dir)
+
+        runs.append(run)
+        print(f"Pairs: {run['pairs']}")
+        for name, stage in run['stages'].items():
+            print(f"\t{name}:\t{stage['seconds']:.3f}s\t{stage['per_second'] or 0:.0f}/s")
+
+    report = {
+        'created': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'numpy': np.__version__,
+        'opencv': cv2.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'stub_models': not real_models,
+        'model': MODEL,
+        'detector': detector,
+        'batch_size': batch_size,
+        'runs': runs}
+
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print(f"Benchmark written to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 5000], help='pairs per run')
+    parser.add_argument('--batch-size', type=int, default=32)
+    parser.add_argument('--real-models', action='store_true',
+                        help='use the installed deepface and TensorFlow with the skip detector instead of the stubs')
+    parser.add_argument('--output', default=os.path.join(REPO_DIR, 'tmp', 'pipeline_benchmark.json'))
+    args = parser.parse_args()
+
+    run_benchmark(args.sizes, args.batch_size, args.real_models, args.output)
+
+
+if __name__ == "__main__":
+    main()
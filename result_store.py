@@ -0,0 +1,128 @@
+# Typed columnar results file written next to tmp/<model>/<race>_results.txt. <race>_results.bin holds
+# fixed-size RESULT_DTYPE records back to back and <race>_results.json describes the dtype, so a run
+# can append whole chunks as it goes and a reader gets NumPy arrays back without parsing any text.
+import json
+import os
+
+import numpy as np
+
+FORMAT_NAME = 'columnar-results'
+FORMAT_VERSION = 1
+IDENTITY_WIDTH = 24
+
+# facial areas are stored as [x, y, w, h, left_eye_x, left_eye_y, right_eye_x, right_eye_y]
+# with -1 standing in for a missing value
+FACIAL_AREA_FIELDS = 8
+
+RESULT_DTYPE = np.dtype([
+    ('template_identity', f'S{IDENTITY_WIDTH}'),
+    ('template_index', np.int16),
+    ('test_identity', f'S{IDENTITY_WIDTH}'),
+    ('test_index', np.int16),
+    ('genuine', np.bool_),
+    ('distance', np.float64),
+    ('threshold', np.float64),
+    ('verified', np.bool_),
+    ('time', np.float32),
+    ('img1_area', np.int32, (FACIAL_AREA_FIELDS,)),
+    ('img2_area', np.int32, (FACIAL_AREA_FIELDS,)),
+])
+
+
+def facial_area_to_array(facial_area):
+    left_eye = facial_area.get('left_eye') or (-1, -1)
+    right_eye = facial_area.get('right_eye') or (-1, -1)
+    values = [facial_area.get('x'), facial_area.get('y'), facial_area.get('w'), facial_area.get('h'),
+              left_eye[0], left_eye[1], right_eye[0], right_eye[1]]
+    return np.array([-1 if value is None else value for value in values], dtype=np.int32)
+
+
+def array_to_facial_area(values):
+    x, y, w, h, left_eye_x, left_eye_y, right_eye_x, right_eye_y = (int(value) for value in values)
+    return {
+        'x': x,
+        'y': y,
+        'w': w,
+        'h': h,
+        'left_eye': (left_eye_x, left_eye_y) if left_eye_x >= 0 else None,
+        'right_eye': (right_eye_x, right_eye_y) if right_eye_x >= 0 else None}
+
+
+def get_columnar_paths(results_path):
+    # tmp/<model>/<race>_results.txt -> tmp/<model>/<race>_results.bin and .json
+    root = os.path.splitext(results_path)[0]
+    return root + '.bin', root + '.json'
+
+
+def _dtype_from_descr(descr):
+    # JSON turns the (name, type, shape) tuples into lists
+    return np.dtype([tuple(field[:2]) + ((tuple(field[2]),) if len(field) > 2 else ()) for field in descr])
+
+
+def write_metadata(results_path, model, race):
+    _, metadata_path = get_columnar_paths(results_path)
+    metadata = {
+        'format': FORMAT_NAME,
+        'version': FORMAT_VERSION,
+        'model': model,
+        'race': race,
+        'dtype': RESULT_DTYPE.descr}
+    with open(metadata_path, 'w') as file:
+        json.dump(metadata, file)
+
+
+def make_row(template_folder, template_index, test_folder, test_index, result):
+    row = np.zeros((), dtype=RESULT_DTYPE)
+    row['template_identity'] = template_folder
+    row['template_index'] = int(template_index)
+    row['test_identity'] = test_folder
+    row['test_index'] = int(test_index)
+    row['genuine'] = template_folder == test_folder
+    row['distance'] = result['distance']
+    row['threshold'] = result['threshold']
+    row['verified'] = result['verified']
+    row['time'] = result['time']
+    row['img1_area'] = facial_area_to_array(result['facial_areas']['img1'])
+    row['img2_area'] = facial_area_to_array(result['facial_areas']['img2'])
+    return row
+
+
+def read_results(results_path):
+    # memory-maps the records; a partly written trailing record is ignored
+    data_path, metadata_path = get_columnar_paths(results_path)
+    with open(metadata_path, 'r') as file:
+        dtype = _dtype_from_descr(json.load(file)['dtype'])
+
+    row_count = os.path.getsize(data_path) // dtype.itemsize
+    if row_count == 0:
+        return np.zeros(0, dtype=dtype)
+    return np.memmap(data_path, dtype=dtype, mode='r', shape=(row_count,))
+
+
+def get_row_key(row):
+    return (row['template_identity'].decode(), str(row['template_index']),
+            row['test_identity'].decode(), str(row['test_index']))
+
+
+class ColumnarResultWriter:
+    # rows are buffered and appended a chunk at a time; flush() forces the buffer to disk
+
+    def __init__(self, results_path, model, race, append=False):
+        self.data_path, _ = get_columnar_paths(results_path)
+        write_metadata(results_path, model, race)
+        self._file = open(self.data_path, 'ab' if append else 'wb')
+        self._rows = []
+
+    def append(self, template_folder, template_index, test_folder, test_index, result):
+        self._rows.append(make_row(template_folder, template_index, test_folder, test_index, result))
+
+    def flush(self):
+        if self._rows:
+            self._file.write(np.array(self._rows, dtype=RESULT_DTYPE).tobytes())
+            self._rows = []
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def close(self):
+        self.flush()
+        self._file.close()
@@ -0,0 +1,156 @@
+# Bootstrap confidence intervals for the per-race metrics of create_model_result_file.py (f1 score,
+# accuracy, recall, precision, specificity) and for the differences between every pair of races.
+# The genuine and impostor distances are sorted once, so a pair's outcome at the threshold only depends
+# on its position: each replicate is a row of a NumPy index matrix and the confusion counts of all
+# replicates come from comparing that matrix against two cut-off positions, with no per-replicate loop.
+import time
+from itertools import combinations
+
+import numpy as np
+
+from results_loader import get_results_path, load_distances
+from threshold_config import race_order, standard_threshold_dictionary
+
+METRICS = ['f1 score', 'accuracy', 'recall', 'precision', 'specificity']
+# index matrix entries generated per block, bounds the memory of a bootstrap run
+BLOCK_ELEMENTS = 1 << 23
+
+
+def _get_cut_offs(distances, threshold):
+    # (accepted, rejected): like roc.py and write_results_to_file, a pair is accepted at distance <= threshold
+    accepted = int(np.searchsorted(np.sort(distances), threshold, side='right'))
+    return accepted, len(distances) - accepted
+
+
+def resample_counts(distances, threshold, replicates, rng):
+    # for every replicate, how many resampled pairs are accepted and rejected at the threshold
+    count = len(distances)
+    accepted, _ = _get_cut_offs(distances, threshold)
+    accepted_counts = np.zeros(replicates, dtype=np.int64)
+    if count == 0:
+        return accepted_counts, accepted_counts.copy()
+
+    index_dtype = np.uint16 if count <= np.iinfo(np.uint16).max else np.int64
+    block_size = max(1, BLOCK_ELEMENTS // count)
+    for start in range(0, replicates, block_size):
+        stop = min(start + block_size, replicates)
+        # one replicate per row; in the sorted distances the first `accepted` are at or below the threshold
+        indices = rng.integers(0, count, size=(stop - start, count), dtype=index_dtype)
+        accepted_counts[start:stop] = np.count_nonzero(indices < accepted, axis=1)
+    return accepted_counts, count - accepted_counts
+
+
+def compute_metrics(tp, fp, tn, fn):
+    # the scores of create_model_result_file._calculate_scores for arrays of counts, NaN where undefined
+    tp, fp, tn, fn = (np.asarray(value, dtype=np.float64) for value in (tp, fp, tn, fn))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        precision = np.where(tp + fp > 0, tp / (tp + fp), np.nan)
+        recall = np.where(tp + fn > 0, tp / (tp + fn), np.nan)
+        f1_score = np.where(precision + recall > 0, 2 * precision * recall / (precision + recall), np.nan)
+        accuracy = np.where(tp + fp + tn + fn > 0, (tp + tn) / (tp + fp + tn + fn), np.nan)
+        specificity = np.where(tn + fp > 0, tn / (tn + fp), np.nan)
+
+    return {
+        'f1 score': f1_score,
+        'accuracy': accuracy,
+        'recall': recall,
+        'precision': precision,
+        'specificity': specificity}
+
+
+def bootstrap_metrics(genuine, impostor, threshold, replicates, rng):
+    # genuine and impostor pairs are resampled separately, as in a stratified bootstrap
+    tp, fn = resample_counts(genuine, threshold, replicates, rng)
+    fp, tn = resample_counts(impostor, threshold, replicates, rng)
+    samples = compute_metrics(tp, fp, tn, fn)
+
+    genuine_accepted, genuine_rejected = _get_cut_offs(genuine, threshold)
+    impostor_accepted, impostor_rejected = _get_cut_offs(impostor, threshold)
+    point = {metric: float(value) for metric, value in
+             compute_metrics(genuine_accepted, impostor_accepted, impostor_rejected, genuine_rejected).items()}
+    return point, samples
+
+
+def confidence_interval(samples, level=0.95):
+    tail = (1 - level) / 2 * 100
+    lower, upper = np.nanpercentile(samples, [tail, 100 - tail])
+    return float(lower), float(upper)
+
+
+def bootstrap_races(distances, thresholds, race_list, replicates=10000, level=0.95, seed=0):
+    # distances: race -> (genuine, impostor), thresholds: race -> threshold
+    rng = np.random.default_rng(seed)
+    points = {}
+    samples = {}
+    for race in race_list:
+        genuine, impostor = distances[race]
+        points[race], samples[race] = bootstrap_metrics(genuine, impostor, thresholds[race], replicates, rng)
+
+    race_intervals = {race: {metric: (points[race][metric], *confidence_interval(samples[race][metric], level))
+                             for metric in METRICS} for race in race_list}
+
+    # replicates of different races are independent, so their difference is a replicate of the difference
+    difference_intervals = {}
+    for race_a, race_b in combinations(race_list, 2):
+        difference_intervals[(race_a, race_b)] = {
+            metric: (points[race_a][metric] - points[race_b][metric],
+                     *confidence_interval(samples[race_a][metric] - samples[race_b][metric], level))
+            for metric in METRICS}
+    return race_intervals, difference_intervals
+
+
+def write_intervals_to_file(model, mode, thresholds, race_intervals, difference_intervals, replicates, level,
+                            output_file):
+    with open(output_file, 'w') as f_out:
+        f_out.write(f"{model}\n{mode}Thresholds\n")
+        f_out.write(f"Bootstrap:\t{replicates} replicates, {level:.0%} percentile intervals\n\n")
+
+        for race, intervals in race_intervals.items():
+            f_out.write(f"{race}\n\tThreshold:\t{thresholds[race]}\n")
+            for metric, (point, lower, upper) in intervals.items():
+                f_out.write(f"\t{metric}:\t{point:.4f}\t[{lower:.4f}, {upper:.4f}]\n")
+            f_out.write("\n")
+
+        f_out.write("Race Differences\n")
+        for (race_a, race_b), intervals in difference_intervals.items():
+            f_out.write(f"{race_a} - {race_b}\n")
+            for metric, (point, lower, upper) in intervals.items():
+                # an interval that excludes zero marks a difference the bootstrap supports
+                marker = '\t*' if lower > 0 or upper < 0 else ''
+                f_out.write(f"\t{metric}:\t{point:+.4f}\t[{lower:+.4f}, {upper:+.4f}]{marker}\n")
+            f_out.write("\n")
+
+
+def run_bootstrap(model_list, race_list, mode, threshold_dictionary, replicates=10000, level=0.95):
+    start_time = time.time()
+    for model in model_list:
+        distances = {}
+        for race in race_list:
+            # the same arrays roc.py and the calibration work on
+            distances[race] = load_distances(get_results_path(model, race))
+        thresholds = {race: threshold_dictionary[model][race_order.index(race)] for race in race_list}
+
+        race_intervals, difference_intervals = bootstrap_races(distances, thresholds, race_list, replicates, level)
+        output_file = f"testing_results/verification/{model}/{mode}_Bootstrap.txt"
+        write_intervals_to_file(model, mode, thresholds, race_intervals, difference_intervals, replicates, level,
+                                output_file)
+        print(f"{model}: {output_file}")
+
+    print(f"{replicates} replicates x {len(model_list) * len(race_list)} cells in {time.time() - start_time:.1f}s")
+
+
+def main():
+    race_list = ["African", "Asian", "Caucasian", "Indian"]
+    model_list = ["DeepFace", "ArcFace", "Facenet", "Facenet512"]
+    replicates = 10000
+    level = 0.95
+
+    # the other threshold dictionaries of threshold_config.py: python cli.py report --mode optimal --bootstrap
+    mode = "Standard"
+    threshold_dictionary = standard_threshold_dictionary
+
+    run_bootstrap(model_list, race_list, mode, threshold_dictionary, replicates, level)
+
+
+if __name__ == "__main__":
+    main()
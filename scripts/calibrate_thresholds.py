@@ -0,0 +1,151 @@
+# Threshold calibration for every (model, race) results file. The genuine and impostor distances of a
+# cell are sorted once; the EER and optimal thresholds come from roc.compute_roc, a threshold at a target
+# FMR is read straight off the sorted impostor distances, and the FMR/FNMR a threshold yields is two
+# searchsorted calls. scripts/threshold_config.py is rewritten with one per-race dictionary per operating
+# point (threshold_dict and standard_threshold_dictionary are kept as they are) and the FMR/FNMR of every
+# threshold in every race goes to testing_results/verification/Threshold_Calibration.txt.
+import os
+import time
+
+import numpy as np
+
+import threshold_config
+from results_loader import RESULTS_DIR, load_all_distances
+from roc import compute_roc
+
+CONFIG_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'threshold_config.py')
+# name of the dictionary in threshold_config.py -> target FMR
+FMR_TARGETS = {
+    'fmr_1e2_threshold_dictionary': 1e-2,
+    'fmr_1e3_threshold_dictionary': 1e-3}
+
+
+def threshold_at_fmr(sorted_impostor, target_fmr):
+    # the largest threshold that accepts at most target_fmr of the impostor pairs (distance <= threshold)
+    if len(sorted_impostor) == 0:
+        return float('nan')
+    accepted = int(np.floor(target_fmr * len(sorted_impostor)))
+    if accepted >= len(sorted_impostor):
+        return float(sorted_impostor[-1])
+    # just below the first impostor distance that would push the FMR past the target
+    return float(np.nextafter(sorted_impostor[accepted], -np.inf))
+
+
+def error_rates_at(sorted_genuine, sorted_impostor, threshold):
+    # (fmr, fnmr) at a threshold
+    fmr = np.searchsorted(sorted_impostor, threshold, side='right') / max(len(sorted_impostor), 1)
+    fnmr = 1 - np.searchsorted(sorted_genuine, threshold, side='right') / max(len(sorted_genuine), 1)
+    return float(fmr), float(fnmr)
+
+
+def calibrate(distances, model_list, race_list, reference_race, reference_fmr):
+    # distances: (model, race) -> (genuine, impostor); returns dictionary name -> model -> per-race list
+    sorted_distances = {cell: (np.sort(genuine), np.sort(impostor)) for cell, (genuine, impostor) in distances.items()}
+
+    thresholds = {name: {} for name in ['eer_threshold_dictionary', 'optimal_threshold_dictionary',
+                                        *FMR_TARGETS, 'global_threshold_dictionary']}
+    for model in model_list:
+        for name in thresholds:
+            thresholds[name][model] = []
+
+        for race in race_list:
+            genuine, impostor = sorted_distances[(model, race)]
+            roc = compute_roc(genuine, impostor)
+            thresholds['eer_threshold_dictionary'][model].append(roc['eer_threshold'])
+            thresholds['optimal_threshold_dictionary'][model].append(roc['optimal_threshold'])
+            for name, target_fmr in FMR_TARGETS.items():
+                thresholds[name][model].append(threshold_at_fmr(impostor, target_fmr))
+
+        # one threshold for every race, fixed at the target FMR of the reference race
+        _, reference_impostor = sorted_distances[(model, reference_race)]
+        global_threshold = threshold_at_fmr(reference_impostor, reference_fmr)
+        thresholds['global_threshold_dictionary'][model] = [global_threshold] * len(race_list)
+
+    rates = {}
+    for name, model_thresholds in thresholds.items():
+        for model in model_list:
+            for race, threshold in zip(race_list, model_thresholds[model]):
+                rates[(name, model, race)] = error_rates_at(*sorted_distances[(model, race)], threshold)
+    return thresholds, rates
+
+
+def _format_dictionary(name, dictionary):
+    # one model per line; plain floats, so the file does not depend on how NumPy prints its scalars
+    rows = [f'        "{model}": {[float(value) for value in race_values]}' for model, race_values in dictionary.items()]
+    return f'{name} = {{\n' + ',\n'.join(rows) + '}\n'
+
+
+def write_threshold_config(thresholds, race_list, reference_race, reference_fmr, config_path=CONFIG_PATH):
+    # the model default thresholds are maintained by hand, every calibrated dictionary is regenerated
+    lines = [
+        '# Generated by scripts/calibrate_thresholds.py; threshold_dict and standard_threshold_dictionary are kept\n',
+        '# on recalibration, every other dictionary is overwritten.\n',
+        '\n',
+        'threshold_dict = {\n' + ',\n'.join(f"        '{model}': {threshold}" for model, threshold in
+                                            threshold_config.threshold_dict.items()) + '}\n',
+        '\n',
+        '# per-race thresholds, in the order of race_order\n',
+        f'race_order = {list(race_list)}\n',
+        '\n',
+        _format_dictionary('standard_threshold_dictionary', threshold_config.standard_threshold_dictionary),
+        '\n',
+        '# minimises max(FMR, FNMR)\n',
+        _format_dictionary('optimal_threshold_dictionary', thresholds['optimal_threshold_dictionary']),
+        '\n',
+        '# FMR = FNMR\n',
+        _format_dictionary('eer_threshold_dictionary', thresholds['eer_threshold_dictionary'])]
+    for name, target_fmr in FMR_TARGETS.items():
+        lines += ['\n', f'# FMR <= {target_fmr:g} in each race\n', _format_dictionary(name, thresholds[name])]
+    lines += ['\n', f'# one threshold for all races, FMR <= {reference_fmr:g} on {reference_race}\n',
+              _format_dictionary('global_threshold_dictionary', thresholds['global_threshold_dictionary'])]
+
+    tmp_path = config_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        file.writelines(lines)
+    os.replace(tmp_path, config_path)
+
+
+def write_calibration_report(thresholds, rates, distances, model_list, race_list, output_file):
+    with open(output_file, 'w') as f_out:
+        for model in model_list:
+            f_out.write(f"{model}\n")
+            for race in race_list:
+                genuine, impostor = distances[(model, race)]
+                f_out.write(f"\t{race}:\t{len(genuine)} genuine, {len(impostor)} impostor pairs\n")
+
+            for name, model_thresholds in thresholds.items():
+                f_out.write(f"\t{name}\n")
+                for race, threshold in zip(race_list, model_thresholds[model]):
+                    fmr, fnmr = rates[(name, model, race)]
+                    f_out.write(f"\t\t{race}:\tThreshold {threshold:.6f}\tFMR {fmr:.4f}\tFNMR {fnmr:.4f}\n")
+            f_out.write("\n")
+
+
+def run_calibration(model_list, race_list, reference_race="Caucasian", reference_fmr=1e-3):
+    start_time = time.time()
+    distances = load_all_distances(model_list, race_list)
+    load_time = time.time() - start_time
+
+    start_time = time.time()
+    thresholds, rates = calibrate(distances, model_list, race_list, reference_race, reference_fmr)
+    calibrate_time = time.time() - start_time
+
+    write_threshold_config(thresholds, race_list, reference_race, reference_fmr)
+    output_file = f"{RESULTS_DIR}/Threshold_Calibration.txt"
+    write_calibration_report(thresholds, rates, distances, model_list, race_list, output_file)
+    print(f"Loaded {len(distances)} cells in {load_time:.2f}s, calibrated in {calibrate_time:.3f}s")
+    print(f"Thresholds written to {CONFIG_PATH}, error rates to {output_file}")
+
+
+def main():
+    race_list = ["African", "Asian", "Caucasian", "Indian"]
+    model_list = ["DeepFace", "ArcFace", "Facenet", "Facenet512"]
+    # the global threshold is set on this race and applied to all of them
+    reference_race = "Caucasian"
+    reference_fmr = 1e-3
+
+    run_calibration(model_list, race_list, reference_race, reference_fmr)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,101 +1,33 @@
 import matplotlib.pyplot as plt
 import numpy as np
-from sklearn.metrics import confusion_matrix, accuracy_score
 
-
-def read_data(file_path):
-    matching_pair_list = []
-    non_matching_pair_list = []
-
-    with open(file_path, 'r') as file:
-        file.readline()  # Skip the header
-        count = 0
-        for line in file:
-            parts = line.split()
-            # Extracting and converting the distance to float
-            distance = float(parts[7][:7])
-            if parts[0] == parts[2]:
-                matching_pair_list.append(distance)
-            else:
-                non_matching_pair_list.append(distance)
-
-            count += 1
-            if count > 10000:
-                break
-
-    return matching_pair_list, non_matching_pair_list
-
-
-def calculate_rate_and_threshold(positive_pairs, negative_pairs, thresholds):
-    fmr_list = []
-    fnmr_list = []
-    with open('tmp/temporary.txt', 'w') as file:
-        pass
-
-    min_value = 1
-    for threshold in thresholds:
-        false_positive = sum(
-            1 for distance in positive_pairs if distance > threshold)
-        true_negative = len(positive_pairs) - false_positive
-
-        false_negative = sum(
-            1 for distance in negative_pairs if distance < threshold)
-        true_positive = len(negative_pairs) - false_negative
-
-        fmr = false_positive / \
-            (false_positive + true_negative) if (false_positive +
-                                                 true_negative) != 0 else 0
-        fnmr = false_negative / \
-            (false_negative + true_positive) if (true_positive +
-                                                 false_negative) != 0 else 0
-
-        # find the minimum value of fmr and fnmr
-        if fmr >= fnmr and fmr < min_value:
-            min_value = fmr
-            optimal_threshold = threshold
-        elif fnmr > fmr and fnmr < min_value:
-            min_value = fnmr
-            optimal_threshold = threshold
-
-        fmr_list.append(fmr)
-        fnmr_list.append(fnmr)
-
-    return fmr_list, fnmr_list, optimal_threshold
+from results_loader import get_results_path, load_distances
+from roc import compute_roc, count_outcomes
 
 
 def calculate_accuracy(matrix):
     return (matrix[0] + matrix[3]) / sum(matrix)
 
 
-def plot_rates(model, race_list, fmr_dict, fnmr_dict, optimal_threshold_dict, threshold_list):
+def plot_rates(model, race_list, fmr_dict, fnmr_dict, optimal_threshold_dict, threshold_dict):
     fig, axs = plt.subplots(2, 2, figsize=(10, 8))
     axs = axs.flatten()
 
     for i, race in enumerate(race_list):
-        axs[i].plot(threshold_list, fmr_dict[race],
-                    label='False Positive Rate (FPR)')
-        axs[i].plot(threshold_list, fnmr_dict[race],
-                    label='False Negative Rate (FNR)')
+        axs[i].plot(threshold_dict[race], fmr_dict[race],
+                    label='False Positive Rate (FPR)', drawstyle='steps-post')
+        axs[i].plot(threshold_dict[race], fnmr_dict[race],
+                    label='False Negative Rate (FNR)', drawstyle='steps-post')
         axs[i].set_xlabel('Threshold')
         axs[i].set_ylabel('Rate')
         axs[i].set_title(f'{model} - {race}')
         axs[i].legend()
         axs[i].grid(True)
         axs[i].text(optimal_threshold_dict[race] + .15, 0.7,
-                    s=f"Optimal Threshold: {optimal_threshold_dict[race]}", color='green')
+                    s=f"Optimal Threshold: {optimal_threshold_dict[race]:.4f}", color='green')
 
     plt.tight_layout()
-    plt.show()
-
-
-def calculate_tp_tn_fp_fn(matching_pair_list, non_matching_pair_list, optimal_threshold):
-    tp = sum(1 for distance in matching_pair_list if distance < optimal_threshold)
-    tn = sum(1 for distance in non_matching_pair_list if distance >
-             optimal_threshold)
-    fp = len(matching_pair_list) - tp
-    fn = len(non_matching_pair_list) - tn
-
-    return tp, tn, fp, fn
+    return fig
 
 
 def display_confusion_matrix(ax, matrix, accuracy):
@@ -125,7 +57,7 @@ def plot_confusion_matrices(model, race_list, matrix_dict, accuracy_dict):
         axs[i].set_title(f'{model} - {race}', weight='bold')
 
     plt.tight_layout()
-    plt.show()
+    return fig
 
 
 def plot_bar_chart(model_list, race_list, matrix_dict, accuracy_dict, optimal_threshold_dict):
@@ -141,7 +73,7 @@ def plot_bar_chart(model_list, race_list, matrix_dict, accuracy_dict, optimal_th
         axs[i].set_ylim(0, 1)
 
     plt.tight_layout()
-    plt.show()
+    return fig
 
 
 def plot_metrics(model, race_list, matrix_dict):
@@ -173,45 +105,56 @@ def plot_metrics(model, race_list, matrix_dict):
             axs[j].set_xticks([])  # Remove x ticks
 
     plt.tight_layout()
-    plt.show()
+    return fig
 
 
-def main():
-    model_list = ['DeepFace', 'ArcFace', 'Facenet', 'Facenet512']
-    # model_list = ['DeepFace']
-    race_list = ['African', 'Asian', 'Caucasian', 'Indian']
+def compute_chart_data(model, race_list):
+    fmr_dict = {}
+    fnmr_dict = {}
+    matrix_dict = {}
+    accuracy_dict = {}
+    optimal_threshold_dict = {}
+    threshold_dict = {}
 
-    for model in model_list:
-        fmr_dict = {}
-        fnmr_dict = {}
-        matrix_dict = {}
-        accuracy_dict = {}
-        optimal_threshold_dict = {}
+    standard_threshold = {"ArcFace": .68, "Facenet": .4, "Facenet512": .3, "DeepFace": .23}
+
+    for race in race_list:
+        file_path = get_results_path(model, race)
+        matching_pair_list, non_matching_pair_list = load_distances(file_path)
+        roc = compute_roc(matching_pair_list, non_matching_pair_list)
+        optimal_threshold = roc['optimal_threshold']
+        tp, tn, fp, fn = count_outcomes(
+            matching_pair_list, non_matching_pair_list, standard_threshold[model])
 
-        standard_threshold = {"ArcFace": .68, "Facenet": .4, "Facenet512": .3, "DeepFace": .23}
+        print(f"{model}, {race} Optimal threshold: {optimal_threshold:.6f}, EER: {roc['eer']:.4f} "
+              f"at {roc['eer_threshold']:.6f}")
+        print(f"{model}, {race} TP: {tp}, TN: {tn}, FP: {fp}, FN: {fn}")
 
-        for race in race_list:
-            file_path = f'testing_results/verification/{model}/{race}_results.txt'
-            threshold_list = [(i / 100) for i in range(101)]
+        fmr_dict[race] = roc['fmr']
+        fnmr_dict[race] = roc['fnmr']
+        threshold_dict[race] = roc['thresholds']
+        matrix_dict[race] = (tp, fp, fn, tn)
+        accuracy_dict[race] = calculate_accuracy(matrix_dict[race])
+        optimal_threshold_dict[race] = standard_threshold[model]
 
-            matching_pair_list, non_matching_pair_list = read_data(file_path)
-            fmr_list, fnmr_list, optimal_threshold = calculate_rate_and_threshold(
-                matching_pair_list, non_matching_pair_list, threshold_list)
-            tp, tn, fp, fn = calculate_tp_tn_fp_fn(
-                matching_pair_list, non_matching_pair_list, standard_threshold[model])
+    return fmr_dict, fnmr_dict, matrix_dict, accuracy_dict, optimal_threshold_dict, threshold_dict
 
-            print(f"{model}, {race} Optimal threshold: {optimal_threshold}")
-            print(f"{model}, {race} TP: {tp}, TN: {tn}, FP: {fp}, FN: {fn}")
 
-            fmr_dict[race] = fmr_list
-            fnmr_dict[race] = fnmr_list
-            matrix_dict[race] = (tp, fp, fn, tn)
-            accuracy_dict[race] = calculate_accuracy(matrix_dict[race])
-            optimal_threshold_dict[race] = standard_threshold[model]
+def main():
+    model_list = ['DeepFace', 'ArcFace', 'Facenet', 'Facenet512']
+    # model_list = ['DeepFace']
+    race_list = ['African', 'Asian', 'Caucasian', 'Indian']
+
+    # render_charts.py writes the same figures to files without a window per figure
+    for model in model_list:
+        fmr_dict, fnmr_dict, matrix_dict, accuracy_dict, optimal_threshold_dict, threshold_dict = compute_chart_data(
+            model, race_list)
 
         plot_rates(model, race_list, fmr_dict, fnmr_dict,
-                   optimal_threshold_dict, threshold_list)
+                   optimal_threshold_dict, threshold_dict)
+        plt.show()
         plot_confusion_matrices(model, race_list, matrix_dict, accuracy_dict)
+        plt.show()
 
         # plot_metrics(model, race_list, matrix_dict)
     # plot_bar_chart(model_list, race_list, matrix_dict, accuracy_dict, optimal_threshold_dict)
@@ -1,5 +1,8 @@
 # calculates the race results for a set of files. The code reads the input file, processes the header and lines, and writes the output file. The code is executed for each file in the file_list list. The input and output paths are hard-coded in the script.
-from threshold_config import threshold_dict
+import numpy as np
+
+from results_loader import load_results
+from threshold_config import optimal_threshold_dictionary, race_order, standard_threshold_dictionary, threshold_dict
 
 
 def _calculate_scores(tp, fp, tn, fn):
@@ -37,32 +40,16 @@ def _calculate_scores(tp, fp, tn, fn):
 
 def write_results_to_file(race, threshold, input_file, output_file):
     # Read input file
-    with open(input_file, 'r') as f_in:
-        header = f_in.readline()
-        lines = f_in.readlines()
-
-    tp, fp, tn, fn = 0, 0, 0, 0
-
-    # Process lines
-    count = 0
-    for line in lines:
-        parts = line.strip('/t').split()
-        # print(parts)
-
-        distance = float(parts[7][:7])
+    results = load_results(input_file)
+    genuine = results['genuine']
+    distance = results['distance']
 
-        if parts[0] == parts[2] and distance < threshold:
-            tp = tp + 1
-        elif parts[0] == parts[2] and distance > threshold:
-            fn = fn + 1
-        elif parts[0] != parts[2] and distance < threshold:
-            fp = fp + 1
-        elif parts[0] != parts[2] and distance > threshold:
-            tn = tn + 1
-
-        count += 1
-        if count > 100000:
-            break
+    # a pair is accepted when its distance is <= the threshold, the rule of roc.py and DeepFace.verify, so
+    # every pair lands in one column even at a calibrated threshold that is one of the distances
+    tp = int(np.count_nonzero(genuine & (distance <= threshold)))
+    fn = int(np.count_nonzero(genuine & (distance > threshold)))
+    fp = int(np.count_nonzero(~genuine & (distance <= threshold)))
+    tn = int(np.count_nonzero(~genuine & (distance > threshold)))
 
     # Calculate accuracy
     f1_score, accuracy, recall, precision, specificity = _calculate_scores(
@@ -81,29 +68,9 @@ def write_results_to_file(race, threshold, input_file, output_file):
             f"\tf1 score:\t{f1_score}\n\taccuracy:\t{accuracy}\n\trecall:\t\t{recall}\n\tprecision:\t{precision}\n\tspecificity:\t{specificity}\n\n")
 
 
-if __name__ == "__main__":
-
-    race_list = ["African", "Asian", "Caucasian", "Indian"]
-    # race_list = ["African"]
-    model_list = ["DeepFace", "ArcFace", "Facenet", "Facenet512"]
-
-    # mode = "Optimal"
-    # threshold_dictionary = {
-    #         "DeepFace": [0.35, 0.36, 0.3, 0.3], 
-    #         "ArcFace": [0.68, 0.67, 0.73, 0.69],
-    #         "Facenet": [0.47, 0.46, 0.61, 0.55],
-    #         "Facenet512": [0.44, 0.44, 0.59, 0.5]
-    #     }
-    
-    mode = "Standard"
-    threshold_dictionary = {
-            "DeepFace": [0.23, 0.23, 0.23, 0.23], 
-            "ArcFace": [0.68, 0.68, 0.68, 0.68],
-            "Facenet": [0.4, 0.4, 0.4, 0.4],
-            "Facenet512": [0.3, 0.3, 0.3, 0.3]
-        }
-
-    # NOTE: Model Thresholds are defined in threshold_config.py
+def create_result_files(model_list, race_list, mode, threshold_dictionary):
+    # NOTE: Model Thresholds are defined in threshold_config.py, regenerated by calibrate_thresholds.py with
+    # eer, fmr_1e2, fmr_1e3 and global threshold dictionaries next to the standard and optimal ones
     for model in model_list:
         path = "testing_results/verification/" + model + "/"
         output_file = path + f"{mode}_Results.txt"
@@ -114,18 +81,26 @@ if __name__ == "__main__":
         for race in race_list:
             input_file = path + race + "_results.txt"
             # threshold = threshold_dict[model]
-            if race == "African":
-                pos = 0
-            elif race == "Asian":
-                pos = 1
-            elif race == "Caucasian":
-                pos = 2
-            elif race == "Indian":
-                pos = 3
-                        
-            threshold = threshold_dictionary[model][pos]
+            threshold = threshold_dictionary[model][race_order.index(race)]
             print(model, race, threshold)
 
-
             write_results_to_file(race, threshold, input_file, output_file)
         print("Output file generated successfully.")
+
+
+def main():
+    race_list = ["African", "Asian", "Caucasian", "Indian"]
+    # race_list = ["African"]
+    model_list = ["DeepFace", "ArcFace", "Facenet", "Facenet512"]
+
+    # mode = "Optimal"
+    # threshold_dictionary = optimal_threshold_dictionary
+
+    mode = "Standard"
+    threshold_dictionary = standard_threshold_dictionary
+
+    create_result_files(model_list, race_list, mode, threshold_dictionary)
+
+
+if __name__ == "__main__":
+    main()
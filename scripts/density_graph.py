@@ -1,66 +1,129 @@
+# Genuine and impostor distance densities of every model and race on one 4 x 4 grid. The densities are
+# binned kernel density estimates: the distances are linearly binned onto a fine grid in one pass and the
+# bin counts are convolved with the Gaussian kernel by FFT, so a curve costs O(N + G log G) instead of the
+# O(N * G) of evaluating scipy's gaussian_kde on G points. Whole results files, or the all-pairs distances
+# of all_pairs.py, are plotted without subsampling. The overlap of the two curves is shaded per race.
 import matplotlib.pyplot as plt
 import numpy as np
-from sklearn.metrics import confusion_matrix, accuracy_score
-from scipy.stats import gaussian_kde
 
-
-def read_data(file_path):
-    matching_pair_list = []
-    non_matching_pair_list = []
-
-    with open(file_path, 'r') as file:
-        file.readline()  # Skip the header
-        count = 0
-        for line in file:
-            parts = line.split()
-            # Extracting and converting the distance to float
-            distance = float(parts[7][:7])
-            if parts[0] == parts[2]:
-                matching_pair_list.append(distance)
-            else:
-                non_matching_pair_list.append(distance)
-
-            count += 1
-            if count > 10000:
-                break
-
-    return matching_pair_list, non_matching_pair_list
-
-
-def plot_graph_density(matching_pair_list, non_matching_pair_list, model, race):
-    density_matching = gaussian_kde(matching_pair_list)
-    density_non_matching = gaussian_kde(non_matching_pair_list)
-
-    print(density_matching)
-    print(density_non_matching)
-
-    x = np.linspace(0, 1.2, 1000)
-
-    # Plot the density curves
-    plt.plot(x, density_matching(x), label='Positive Pair', color='blue')
-    plt.plot(x, density_non_matching(x), label='Negative Pair', color='orange')
-
-    # Add labels and legend
-    plt.xlabel('Cosine Distance')
-    plt.ylabel('Density')
-    plt.title(f'{model}, {race}')
-    plt.legend()
-
-    # Show plot
-    plt.show()
+from results_loader import get_results_path, load_distances
+
+GRID_SIZE = 2048
+# distances binned per pass, bounds the memory used on memory-mapped all-pairs files
+CHUNK_SIZE = 1 << 22
+
+
+def _summarize(values):
+    # (count, min, max, Scott's bandwidth) in one streaming pass; gaussian_kde's default bandwidth is
+    # std * n ** (-1 / 5)
+    count = 0
+    total = 0.0
+    total_squares = 0.0
+    low = np.inf
+    high = -np.inf
+    for start in range(0, len(values), CHUNK_SIZE):
+        chunk = np.asarray(values[start:start + CHUNK_SIZE], dtype=np.float64)
+        count += len(chunk)
+        total += chunk.sum()
+        total_squares += np.square(chunk).sum()
+        low = min(low, chunk.min())
+        high = max(high, chunk.max())
+    mean = total / count
+    std = np.sqrt(max(total_squares / count - mean ** 2, 0) * count / max(count - 1, 1))
+    return count, low, high, std * count ** (-1 / 5)
+
+
+def _linear_binning(values, start, step, size):
+    # each value is split between its two neighbouring grid points in proportion to its distance to them
+    counts = np.zeros(size)
+    for chunk_start in range(0, len(values), CHUNK_SIZE):
+        position = (np.asarray(values[chunk_start:chunk_start + CHUNK_SIZE], dtype=np.float64) - start) / step
+        lower = np.clip(position.astype(np.int64), 0, size - 2)
+        upper_weight = position - lower
+        counts += np.bincount(lower, weights=1 - upper_weight, minlength=size)
+        counts += np.bincount(lower + 1, weights=upper_weight, minlength=size)
+    return counts
+
+
+def binned_kde(values, grid, bandwidth=None):
+    # density of values at the points of an evenly spaced grid; a flat zero curve for fewer than two values,
+    # e.g. a model and race without any genuine or impostor rows
+    if len(values) < 2:
+        return np.zeros(len(grid))
+    count, low, high, scott_bandwidth = _summarize(values)
+    step = grid[1] - grid[0]
+    # a kernel narrower than the grid spacing cannot be resolved, e.g. for identical values with no spread
+    bandwidth = bandwidth or max(scott_bandwidth, step)
+
+    # binned on the grid's spacing over the whole data range plus the kernel's reach, so values outside
+    # the plotted grid still add their tails to it
+    reach = int(np.ceil(4 * bandwidth / step))
+    start = min(grid[0], low) - reach * step
+    size = int(np.ceil((max(grid[-1], high) - start) / step)) + reach + 2
+    counts = _linear_binning(values, start, step, size)
+
+    # zero padding keeps the circular FFT convolution from wrapping around
+    offsets = np.arange(-reach, reach + 1) * step
+    kernel = np.exp(-0.5 * (offsets / bandwidth) ** 2) / (bandwidth * np.sqrt(2 * np.pi))
+    fft_size = size + len(kernel) - 1
+    density = np.fft.irfft(np.fft.rfft(counts, fft_size) * np.fft.rfft(kernel, fft_size), fft_size)[reach:reach + size]
+    return np.interp(grid, start + np.arange(size) * step, np.maximum(density, 0)) / count
+
+
+def load_all_pair_distances(model, race):
+    # genuine and impostor distances written by all_pairs.py, memory-mapped
+    return (np.load(f'tmp/{model}/all_pairs/{race}_genuine.npy', mmap_mode='r'),
+            np.load(f'tmp/{model}/all_pairs/{race}_impostor.npy', mmap_mode='r'))
+
+
+def plot_graph_density(ax, x, density_matching, density_non_matching, model, race):
+    ax.plot(x, density_matching, label='Positive Pair', color='blue')
+    ax.plot(x, density_non_matching, label='Negative Pair', color='orange')
+
+    # the area under both curves, the share of the distributions a threshold cannot separate
+    overlap = np.minimum(density_matching, density_non_matching)
+    ax.fill_between(x, overlap, color='grey', alpha=0.4, label='Overlap')
+    overlap_coefficient = np.sum(overlap) * (x[1] - x[0])
+
+    ax.set_xlabel('Cosine Distance')
+    ax.set_ylabel('Density')
+    ax.set_title(f'{model}, {race} (overlap {overlap_coefficient:.2f})')
+
+
+def plot_density_grid(densities, x, model_list, race_list):
+    # one row per model, one column per race
+    fig, axs = plt.subplots(len(model_list), len(race_list), figsize=(4 * len(race_list), 3 * len(model_list)),
+                            squeeze=False, sharex=True)
+    for i, model in enumerate(model_list):
+        for j, race in enumerate(race_list):
+            plot_graph_density(axs[i, j], x, *densities[(model, race)], model, race)
+
+    axs[0, 0].legend()
+    plt.tight_layout()
+    return fig
+
+
+def compute_densities(model, race, x, use_all_pairs=False):
+    if use_all_pairs:
+        matching_pair_list, non_matching_pair_list = load_all_pair_distances(model, race)
+    else:
+        matching_pair_list, non_matching_pair_list = load_distances(get_results_path(model, race))
+    return binned_kde(matching_pair_list, x), binned_kde(non_matching_pair_list, x)
 
 
 def main():
     model_list = ['DeepFace', 'ArcFace', 'Facenet', 'Facenet512']
     # model_list = ['Facenet']
     race_list = ['African', 'Asian', 'Caucasian', 'Indian']
+    # every image pair of the people files from all_pairs.py instead of the pairs files' results
+    use_all_pairs = False
+
+    x = np.linspace(0, 1.2, GRID_SIZE)
+    densities = {(model, race): compute_densities(model, race, x, use_all_pairs)
+                 for model in model_list for race in race_list}
 
-    for model in model_list:
-        for race in race_list:
-            file_path = f'testing_results/verification/{model}/{race}_results.txt'
-            matching_pair_list, non_matching_pair_list = read_data(file_path)
-            plot_graph_density(matching_pair_list,
-                               non_matching_pair_list, model, race)
+    plot_density_grid(densities, x, model_list, race_list)
+    plt.show()
 
 
 if __name__ == "__main__":
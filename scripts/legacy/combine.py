@@ -57,11 +57,11 @@ if __name__ == "__main__":
 
     race_list = ["African", "Asian", "Caucasian", "Indian"]
     model = "DeepFace"
-    output_path = "C:/Users/jay/Desktop/combined/"+ model + "/"
+    output_path = "tmp/legacy/combined/"+ model + "/"
 
     for race in race_list:
-        file1 = "C:/Users/jay/Desktop/1_new/" + model + "/" + race + "_results.txt"
-        file2 = "C:/Users/jay/Desktop/2_new/" + model + "/" + race + "_results.txt"
+        file1 = "tmp/legacy/1_new/" + model + "/" + race + "_results.txt"
+        file2 = "tmp/legacy/2_new/" + model + "/" + race + "_results.txt"
         output_file = output_path + race + "_results.txt" 
 
         file = race + "_results.txt"
@@ -34,9 +34,9 @@ if __name__ == "__main__":
     model = "DeepFace"
 
     for file in file_list:
-        input_path = "C:/Users/jay/Desktop/2_original/" + model + "/"
+        input_path = "tmp/legacy/2_original/" + model + "/"
 
-        output_path = "C:/Users/jay/Desktop/2_new/" + model + "/"
+        output_path = "tmp/legacy/2_new/" + model + "/"
 
         process_structure_file(input_path + file, output_path + file)
         print("Output file generated successfully.")
@@ -80,9 +80,9 @@ if __name__ == "__main__":
 #     model = "DeepFace"
 
 #     for file in file_list:
-#         input_path = "C:/Users/jay/Desktop/1_original/" + model + "/"
+#         input_path = "tmp/legacy/1_original/" + model + "/"
 
-#         output_path = "C:/Users/jay/Desktop/1_new/" + model + "/"
+#         output_path = "tmp/legacy/1_new/" + model + "/"
 
 #         process_structure_file(input_path + file, output_path + file)
 #         print("Output file generated successfully.")
@@ -1,3 +1,5 @@
+# one DeepFace.verify call per image pair; all_pairs.py at the repository root embeds every image once
+# and computes all genuine and impostor distances with blocked matrix products
 from deepface import DeepFace
 import time
 import tensorflow as tf
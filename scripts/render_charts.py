@@ -0,0 +1,204 @@
+# Renders the whole chart set to files without opening a window: the FMR/FNMR rates and confusion
+# matrices of create_charts_optimal.py and create_charts_standard.py for every model, the density of every
+# model and race, and the density grid of density_graph.py. Figures are drawn with the Agg backend in a
+# process pool and written as PNG and SVG to the output directory. manifest.json there keeps a hash of
+# each figure's inputs (its results files and the code drawing it), so a figure whose inputs are unchanged
+# is skipped on the next run. Run from the repository root: python scripts/render_charts.py
+import argparse
+import hashlib
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import matplotlib
+
+# the file backend has to be chosen before pyplot is imported, here and in the chart modules
+matplotlib.use('Agg')
+
+import matplotlib.pyplot as plt
+import numpy as np
+
+import create_charts_optimal
+import create_charts_standard
+import density_graph
+from results_loader import get_results_path
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+CHART_MODULES = {
+    'optimal': create_charts_optimal,
+    'standard': create_charts_standard}
+# code every figure depends on, besides its own chart module
+SHARED_SOURCES = ['render_charts.py', 'results_loader.py', 'roc.py']
+
+
+def _get_input_paths(model, race):
+    # the text results and, when present, the columnar copy load_results prefers
+    results_path = get_results_path(model, race)
+    root = os.path.splitext(results_path)[0]
+    return [path for path in (results_path, root + '.bin', root + '.json') if os.path.exists(path)]
+
+
+def _hash_file(path, file_hashes):
+    if path not in file_hashes:
+        digest = hashlib.sha256()
+        with open(path, 'rb') as file:
+            for block in iter(lambda: file.read(1 << 20), b''):
+                digest.update(block)
+        file_hashes[path] = digest.hexdigest()
+    return file_hashes[path]
+
+
+def get_input_hash(job, file_hashes):
+    digest = hashlib.sha256(json.dumps(job, sort_keys=True).encode())
+    paths = [os.path.join(SCRIPTS_DIR, source) for source in SHARED_SOURCES + [job['source']]]
+    for model, race in job['cells']:
+        paths += _get_input_paths(model, race)
+    for path in paths:
+        digest.update(path.encode())
+        digest.update(_hash_file(path, file_hashes).encode())
+    return digest.hexdigest()
+
+
+def make_jobs(model_list, race_list):
+    # each job draws one or more figures from the results of its cells
+    jobs = []
+    for mode, module in CHART_MODULES.items():
+        for model in model_list:
+            jobs.append({
+                'name': f'{model}_{mode}',
+                'kind': 'charts',
+                'mode': mode,
+                'model': model,
+                'races': race_list,
+                'source': os.path.basename(module.__file__),
+                'cells': [(model, race) for race in race_list],
+                'figures': [f'{model}_{mode}_rates', f'{model}_{mode}_confusion']})
+
+    for model in model_list:
+        for race in race_list:
+            jobs.append({
+                'name': f'{model}_{race}_density',
+                'kind': 'density',
+                'model': model,
+                'race': race,
+                'source': 'density_graph.py',
+                'cells': [(model, race)],
+                'figures': [f'{model}_{race}_density']})
+
+    jobs.append({
+        'name': 'density_grid',
+        'kind': 'density_grid',
+        'models': model_list,
+        'races': race_list,
+        'source': 'density_graph.py',
+        'cells': [(model, race) for model in model_list for race in race_list],
+        'figures': ['density_grid']})
+    return jobs
+
+
+def _draw_figures(job):
+    if job['kind'] == 'charts':
+        module = CHART_MODULES[job['mode']]
+        fmr_dict, fnmr_dict, matrix_dict, accuracy_dict, optimal_threshold_dict, threshold_dict = \
+            module.compute_chart_data(job['model'], job['races'])
+        return [module.plot_rates(job['model'], job['races'], fmr_dict, fnmr_dict, optimal_threshold_dict,
+                                  threshold_dict),
+                module.plot_confusion_matrices(job['model'], job['races'], matrix_dict, accuracy_dict)]
+
+    x = np.linspace(0, 1.2, density_graph.GRID_SIZE)
+    if job['kind'] == 'density':
+        fig, ax = plt.subplots(figsize=(6, 4))
+        density_graph.plot_graph_density(ax, x, *density_graph.compute_densities(job['model'], job['race'], x),
+                                         job['model'], job['race'])
+        ax.legend()
+        plt.tight_layout()
+        return [fig]
+
+    densities = {(model, race): density_graph.compute_densities(model, race, x)
+                 for model in job['models'] for race in job['races']}
+    return [density_graph.plot_density_grid(densities, x, job['models'], job['races'])]
+
+
+def render_job(job, output_dir, formats):
+    # runs in a worker process; returns the files written
+    paths = []
+    for name, fig in zip(job['figures'], _draw_figures(job)):
+        for image_format in formats:
+            path = os.path.join(output_dir, f'{name}.{image_format}')
+            fig.savefig(path, format=image_format)
+            paths.append(path)
+        plt.close(fig)
+    return paths
+
+
+def _load_manifest(manifest_path):
+    if not os.path.exists(manifest_path):
+        return {}
+    with open(manifest_path, 'r') as file:
+        return json.load(file)
+
+
+def _write_manifest(manifest, manifest_path):
+    tmp_path = manifest_path + '.tmp'
+    with open(tmp_path, 'w') as file:
+        json.dump(manifest, file, indent=2, sort_keys=True)
+    os.replace(tmp_path, manifest_path)
+
+
+def render_charts(model_list, race_list, output_dir, formats, workers=None, force=False):
+    os.makedirs(output_dir, exist_ok=True)
+    manifest_path = os.path.join(output_dir, 'manifest.json')
+    manifest = _load_manifest(manifest_path)
+
+    jobs = make_jobs(model_list, race_list)
+    file_hashes = {}
+    pending = []
+    for job in jobs:
+        input_hash = get_input_hash(job, file_hashes)
+        entry = manifest.get(job['name'], {})
+        expected_paths = [os.path.join(output_dir, f'{name}.{image_format}')
+                          for name in job['figures'] for image_format in formats]
+        if not force and entry.get('hash') == input_hash and all(os.path.exists(path) for path in expected_paths):
+            continue
+        pending.append((job, input_hash))
+
+    rendered = 0
+    if pending:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = {executor.submit(render_job, job, output_dir, formats): (job, input_hash)
+                       for job, input_hash in pending}
+            for future in as_completed(futures):
+                job, input_hash = futures[future]
+                try:
+                    paths = future.result()
+                except Exception as e:
+                    # the job stays out of the manifest, so the next run retries it
+                    print(f"{job['name']}: {e}")
+                    continue
+                manifest[job['name']] = {'hash': input_hash, 'files': paths}
+                rendered += 1
+        _write_manifest(manifest, manifest_path)
+
+    return rendered, len(jobs) - len(pending)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--output-dir', default='testing_results/charts')
+    parser.add_argument('--formats', nargs='+', default=['png', 'svg'])
+    parser.add_argument('--workers', type=int, default=None, help='processes, one per core by default')
+    parser.add_argument('--force', action='store_true', help='render every figure, even if its inputs are unchanged')
+    args = parser.parse_args()
+
+    model_list = ['DeepFace', 'ArcFace', 'Facenet', 'Facenet512']
+    race_list = ['African', 'Asian', 'Caucasian', 'Indian']
+
+    start_time = time.time()
+    rendered, skipped = render_charts(model_list, race_list, args.output_dir, args.formats, args.workers, args.force)
+    print(f"Rendered {rendered} chart jobs, skipped {skipped} unchanged, in {time.time() - start_time:.1f}s "
+          f"to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
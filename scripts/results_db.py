@@ -0,0 +1,282 @@
+# SQLite copy of the verification results, so questions across models and races are SQL joins on
+# indexed columns instead of repeated parses of the results files. The schema is normalised: a run is one
+# (model, race) results file, an image is an (identity, index) of a race, a pair is two images under a
+# pair key shared by every model, and a score is one run's result for one pair. Each results file is read
+# through results_loader.load_results and bulk-inserted in a single transaction; files whose size and
+# mtime match the run already stored are skipped. The canned bias queries are in QUERIES.
+import os
+import re
+import sqlite3
+import time
+
+import numpy as np
+
+# results_loader puts the repository root on the path and re-exports result_store.get_columnar_paths
+from results_loader import RESULTS_DIR, get_columnar_paths, get_results_path, load_results
+
+DB_PATH = 'tmp/results.db'
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id INTEGER PRIMARY KEY,
+    model TEXT NOT NULL,
+    race TEXT NOT NULL,
+    detector TEXT,
+    source_path TEXT NOT NULL,
+    source_size INTEGER NOT NULL,
+    source_mtime_ns INTEGER NOT NULL,
+    pair_count INTEGER NOT NULL,
+    ingested_at TEXT NOT NULL,
+    UNIQUE (model, race)
+);
+CREATE TABLE IF NOT EXISTS images (
+    image_id INTEGER PRIMARY KEY,
+    race TEXT NOT NULL,
+    identity TEXT NOT NULL,
+    image_index INTEGER NOT NULL,
+    UNIQUE (race, identity, image_index)
+);
+CREATE TABLE IF NOT EXISTS pairs (
+    pair_id INTEGER PRIMARY KEY,
+    pair_key TEXT NOT NULL UNIQUE,
+    race TEXT NOT NULL,
+    image1_id INTEGER NOT NULL REFERENCES images (image_id),
+    image2_id INTEGER NOT NULL REFERENCES images (image_id),
+    genuine INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS scores (
+    run_id INTEGER NOT NULL REFERENCES runs (run_id),
+    pair_id INTEGER NOT NULL REFERENCES pairs (pair_id),
+    distance REAL NOT NULL,
+    threshold REAL NOT NULL,
+    verified INTEGER NOT NULL,
+    time REAL,
+    PRIMARY KEY (run_id, pair_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS images_identity ON images (identity);
+CREATE INDEX IF NOT EXISTS pairs_race ON pairs (race);
+CREATE INDEX IF NOT EXISTS pairs_image1 ON pairs (image1_id);
+CREATE INDEX IF NOT EXISTS pairs_image2 ON pairs (image2_id);
+CREATE INDEX IF NOT EXISTS scores_pair ON scores (pair_id, run_id);
+"""
+
+QUERIES = {
+    # identities ranked by the failed pairs they appear in under a model, in one race or all of them
+    'identity_failures': """
+        SELECT i.identity,
+               SUM(p.genuine = 1 AND s.verified = 0) AS false_non_matches,
+               SUM(p.genuine = 0 AND s.verified = 1) AS false_matches,
+               COUNT(*) AS pairs
+        FROM runs r
+        JOIN scores s ON s.run_id = r.run_id
+        JOIN pairs p ON p.pair_id = s.pair_id
+        -- both images of an impostor pair, a genuine pair counts once for its identity
+        JOIN images i ON i.image_id = p.image1_id OR (p.genuine = 0 AND i.image_id = p.image2_id)
+        WHERE r.model = :model AND (:race IS NULL OR r.race = :race)
+        GROUP BY i.identity
+        HAVING false_non_matches + false_matches > 0
+        ORDER BY false_non_matches + false_matches DESC, i.identity
+        LIMIT :limit""",
+    # pairs one model accepts and the other rejects
+    'model_disagreements': """
+        SELECT p.pair_key, p.race, p.genuine,
+               a.distance AS distance_a, a.verified AS verified_a,
+               b.distance AS distance_b, b.verified AS verified_b
+        FROM runs ra
+        JOIN runs rb ON rb.race = ra.race AND rb.model = :model_b
+        JOIN scores a ON a.run_id = ra.run_id
+        JOIN scores b ON b.run_id = rb.run_id AND b.pair_id = a.pair_id
+        JOIN pairs p ON p.pair_id = a.pair_id
+        WHERE ra.model = :model_a AND (:race IS NULL OR ra.race = :race) AND a.verified != b.verified
+        ORDER BY p.race, p.pair_key
+        LIMIT :limit""",
+    # pairs that every model ingested for their race gets wrong
+    'common_failures': """
+        SELECT p.pair_key, p.genuine, COUNT(*) AS models, AVG(s.distance) AS mean_distance
+        FROM runs r
+        JOIN scores s ON s.run_id = r.run_id
+        JOIN pairs p ON p.pair_id = s.pair_id
+        WHERE :race IS NULL OR r.race = :race
+        GROUP BY p.pair_id
+        HAVING SUM(p.genuine != s.verified) = COUNT(*)
+           AND COUNT(*) = (SELECT COUNT(*) FROM runs WHERE race = p.race)
+        ORDER BY p.pair_key
+        LIMIT :limit""",
+    # FMR and FNMR of every run at the thresholds stored with its scores
+    'error_rates': """
+        SELECT r.model, r.race,
+               SUM(p.genuine = 0 AND s.verified = 1) * 1.0 / MAX(SUM(p.genuine = 0), 1) AS fmr,
+               SUM(p.genuine = 1 AND s.verified = 0) * 1.0 / MAX(SUM(p.genuine = 1), 1) AS fnmr,
+               COUNT(*) AS pairs
+        FROM runs r
+        JOIN scores s ON s.run_id = r.run_id
+        JOIN pairs p ON p.pair_id = s.pair_id
+        GROUP BY r.run_id
+        ORDER BY r.model, r.race
+        LIMIT :limit"""}
+# parameters a query cannot run without
+QUERY_PARAMS = {
+    'identity_failures': ['model'],
+    'model_disagreements': ['model_a', 'model_b'],
+    'common_failures': [],
+    'error_rates': []}
+# default values of the optional query parameters; a limit of -1 returns every row
+QUERY_DEFAULTS = {'limit': 20, 'race': None}
+
+_DETECTOR_PATTERN = re.compile(r"'detector_backend': '([^']+)'")
+
+
+def connect(db_path=DB_PATH):
+    os.makedirs(os.path.dirname(db_path) or '.', exist_ok=True)
+    connection = sqlite3.connect(db_path)
+    connection.execute('PRAGMA foreign_keys = ON')
+    connection.execute('PRAGMA journal_mode = WAL')
+    # a crash can lose the last transaction but not corrupt the file, and a run is simply ingested again
+    connection.execute('PRAGMA synchronous = NORMAL')
+    version = connection.execute('PRAGMA user_version').fetchone()[0]
+    if version not in (0, SCHEMA_VERSION):
+        raise ValueError(f"{db_path} has schema version {version}, expected {SCHEMA_VERSION}")
+    connection.executescript(SCHEMA)
+    connection.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    return connection
+
+
+def _get_source_path(results_path):
+    # the file load_results reads: the columnar copy when there is one, the text file otherwise
+    data_path, _ = get_columnar_paths(results_path)
+    return data_path if os.path.exists(data_path) else results_path
+
+
+def _read_detector(results_path):
+    if not os.path.exists(results_path):
+        return None
+    with open(results_path, 'r') as file:
+        file.readline()  # Skip the header
+        match = _DETECTOR_PATTERN.search(file.readline())
+    return match.group(1) if match else None
+
+
+def _assign_ids(connection, table, id_column, key_columns, race, rows):
+    # rows: key -> the row's other columns in table order; returns key -> id for every row of the race,
+    # inserting the rows not in the table yet
+    ids = {tuple(row[1:]): row[0] for row in connection.execute(
+        f"SELECT {id_column}, {', '.join(key_columns)} FROM {table} WHERE race = ?", (race,))}
+    missing = [key for key in rows if key not in ids]
+    if missing:
+        next_id = (connection.execute(f"SELECT MAX({id_column}) FROM {table}").fetchone()[0] or 0) + 1
+        ids.update(zip(missing, range(next_id, next_id + len(missing))))
+        connection.executemany(f"INSERT INTO {table} VALUES ({', '.join('?' * (len(rows[missing[0]]) + 1))})",
+                               [(ids[key],) + rows[key] for key in missing])
+    return ids
+
+
+def ingest_run(connection, model, race, results_path, force=False):
+    # stores one results file; returns the number of scores written, 0 when the stored run is current
+    source_path = _get_source_path(results_path)
+    stat = os.stat(source_path)
+    stored = connection.execute(
+        "SELECT run_id, source_path, source_size, source_mtime_ns FROM runs WHERE model = ? AND race = ?",
+        (model, race)).fetchone()
+    if not force and stored is not None and stored[1:] == (source_path, stat.st_size, stat.st_mtime_ns):
+        return 0
+
+    results = load_results(results_path)
+    image1_keys = list(zip(np.char.decode(np.asarray(results['template_identity']), 'ascii').tolist(),
+                           np.asarray(results['template_index']).tolist()))
+    image2_keys = list(zip(np.char.decode(np.asarray(results['test_identity']), 'ascii').tolist(),
+                           np.asarray(results['test_index']).tolist()))
+    # race/identity/index/identity/index, the same key for a pair under every model
+    pair_keys = [f'{race}/{identity1}/{index1}/{identity2}/{index2}'
+                 for (identity1, index1), (identity2, index2) in zip(image1_keys, image2_keys)]
+
+    with connection:
+        if stored is not None:
+            connection.execute("DELETE FROM scores WHERE run_id = ?", (stored[0],))
+            connection.execute("DELETE FROM runs WHERE run_id = ?", (stored[0],))
+        connection.execute(
+            "INSERT INTO runs (model, race, detector, source_path, source_size, source_mtime_ns, pair_count, "
+            "ingested_at) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (model, race, _read_detector(results_path), source_path, stat.st_size, stat.st_mtime_ns, len(results),
+             time.strftime('%Y-%m-%dT%H:%M:%S')))
+        run_id = connection.execute("SELECT last_insert_rowid()").fetchone()[0]
+
+        image_ids = _assign_ids(connection, 'images', 'image_id', ['identity', 'image_index'], race,
+                                {key: (race,) + key for key in image1_keys + image2_keys})
+        pair_ids = _assign_ids(connection, 'pairs', 'pair_id', ['pair_key'], race, {
+            (pair_key,): (pair_key, race, image_ids[image1], image_ids[image2], int(image1[0] == image2[0]))
+            for pair_key, image1, image2 in zip(pair_keys, image1_keys, image2_keys)})
+
+        # a pair listed twice in a results file keeps its last score, as the journal does on resume
+        connection.executemany(
+            "INSERT OR REPLACE INTO scores VALUES (?, ?, ?, ?, ?, ?)",
+            zip([run_id] * len(results), [pair_ids[(pair_key,)] for pair_key in pair_keys],
+                np.asarray(results['distance']).tolist(), np.asarray(results['threshold']).tolist(),
+                np.asarray(results['verified']).astype(int).tolist(), np.asarray(results['time']).tolist()))
+    return len(results)
+
+
+def ingest(model_list, race_list, results_dir=RESULTS_DIR, db_path=DB_PATH, force=False):
+    # (scores written, runs skipped as unchanged)
+    connection = connect(db_path)
+    written = 0
+    skipped = 0
+    try:
+        for model in model_list:
+            for race in race_list:
+                results_path = get_results_path(model, race, results_dir)
+                if not os.path.exists(results_path) and not os.path.exists(_get_source_path(results_path)):
+                    print(f"{model}, {race}: no results in {results_dir}")
+                    continue
+                count = ingest_run(connection, model, race, results_path, force)
+                written += count
+                skipped += count == 0
+        connection.execute('PRAGMA optimize')
+    finally:
+        connection.close()
+    return written, skipped
+
+
+def run_query(connection, name, **params):
+    # (column names, rows) of a canned query
+    missing = [param for param in QUERY_PARAMS[name] if params.get(param) is None]
+    if missing:
+        raise ValueError(f"{name} needs {', '.join(missing)}")
+    cursor = connection.execute(QUERIES[name], {**QUERY_DEFAULTS, **params})
+    return [column[0] for column in cursor.description], cursor.fetchall()
+
+
+def print_rows(columns, rows):
+    print('\t'.join(columns))
+    for row in rows:
+        print('\t'.join(f'{value:.4f}' if isinstance(value, float) else str(value) for value in row))
+
+
+def main():
+    race_list = ["African", "Asian", "Caucasian", "Indian"]
+    model_list = ["DeepFace", "ArcFace", "Facenet", "Facenet512"]
+    # testing_results/verification for the committed results, tmp for the output of a local run
+    results_dir = RESULTS_DIR
+
+    start_time = time.time()
+    written, skipped = ingest(model_list, race_list, results_dir)
+    print(f"Ingested {written} scores into {DB_PATH}, {skipped} runs unchanged, in {time.time() - start_time:.2f}s")
+
+    connection = connect()
+    try:
+        start_time = time.time()
+        columns, rows = run_query(connection, 'identity_failures', model='ArcFace', race='Indian', limit=10)
+        print(f"\nIndian identities failing most under ArcFace ({(time.time() - start_time) * 1000:.1f}ms)")
+        print_rows(columns, rows)
+
+        start_time = time.time()
+        columns, rows = run_query(connection, 'model_disagreements', model_a='Facenet', model_b='Facenet512',
+                                  limit=-1)
+        print(f"\n{len(rows)} pairs where Facenet and Facenet512 disagree ({(time.time() - start_time) * 1000:.1f}ms)")
+        print_rows(columns, rows[:10])
+    finally:
+        connection.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+# Loads verification results files into NumPy arrays for all analysis scripts. Text results files
+# (one stringified DeepFace result dict per line) are parsed once and the parsed records are kept in
+# a memory-mapped .npy sidecar under tmp/cache/results/, keyed by the source file's size and mtime,
+# so repeat loads skip parsing. Columnar results (<race>_results.bin from verify.py) are read through
+# result_store.py, which owns their record layout.
+import json
+import os
+import re
+import sys
+
+import numpy as np
+
+# result_store.py is in the repository root, one level up from the scripts
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.append(REPO_DIR)
+
+from result_store import RESULT_DTYPE, get_columnar_paths, read_results
+
+CACHE_DIR = 'tmp/cache/results'
+CACHE_VERSION = 1
+RESULTS_DIR = 'testing_results/verification'
+
+# the fields of result_store.RESULT_DTYPE the text results are parsed into, in the same types
+RESULTS_DTYPE = np.dtype([(name, RESULT_DTYPE.fields[name][0]) for name in [
+    'template_identity', 'template_index', 'test_identity', 'test_index', 'genuine', 'distance', 'threshold',
+    'verified', 'time']])
+
+_NUMBER = r'(?:np\.float\d+\()?([-+]?(?:\d+\.?\d*(?:[eE][-+]?\d+)?|nan|inf))'
+_DISTANCE_PATTERN = re.compile(r"'distance': " + _NUMBER)
+_THRESHOLD_PATTERN = re.compile(r"'threshold': " + _NUMBER)
+_TIME_PATTERN = re.compile(r"'time': " + _NUMBER)
+_VERIFIED_PATTERN = re.compile(r"'verified': (?:np\.)?(True|False)")
+
+
+def get_results_path(model, race, results_dir=RESULTS_DIR):
+    return f'{results_dir}/{model}/{race}_results.txt'
+
+
+def _parse_text_results(file_path):
+    rows = []
+    with open(file_path, 'r') as file:
+        file.readline()  # Skip the header
+        for line in file:
+            fields = line.split('\t')
+            if len(fields) < 5:
+                continue
+            result = fields[4]
+            rows.append((
+                fields[0], int(fields[1]), fields[2], int(fields[3]), fields[0] == fields[2],
+                float(_DISTANCE_PATTERN.search(result).group(1)),
+                float(_THRESHOLD_PATTERN.search(result).group(1)),
+                _VERIFIED_PATTERN.search(result).group(1) == 'True',
+                float(_TIME_PATTERN.search(result).group(1))))
+    return np.array(rows, dtype=RESULTS_DTYPE)
+
+
+def _read_columnar_results(file_path):
+    records = read_results(file_path)
+    results = np.empty(len(records), dtype=RESULTS_DTYPE)
+    for name in RESULTS_DTYPE.names:
+        results[name] = records[name]
+    return results
+
+
+def _get_cache_paths(file_path):
+    name = os.path.normpath(file_path).replace(os.sep, '__')
+    return os.path.join(CACHE_DIR, name + '.npy'), os.path.join(CACHE_DIR, name + '.json')
+
+
+def load_results(file_path):
+    # every line of the file as one RESULTS_DTYPE record, nothing is capped or truncated
+    data_path, metadata_path = get_columnar_paths(file_path)
+    if os.path.exists(data_path) and os.path.exists(metadata_path):
+        return _read_columnar_results(file_path)
+
+    stat = os.stat(file_path)
+    cache_key = {'version': CACHE_VERSION, 'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+    cache_path, cache_key_path = _get_cache_paths(file_path)
+
+    if os.path.exists(cache_path) and os.path.exists(cache_key_path):
+        with open(cache_key_path, 'r') as file:
+            if json.load(file) == cache_key:
+                return np.load(cache_path, mmap_mode='r')
+
+    results = _parse_text_results(file_path)
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = cache_path + '.tmp.npy'
+    np.save(tmp_path, results)
+    os.replace(tmp_path, cache_path)
+    with open(cache_key_path, 'w') as file:
+        json.dump(cache_key, file)
+
+    return results
+
+
+def load_distances(file_path):
+    # genuine (same identity) and impostor distances as float64 arrays
+    results = load_results(file_path)
+    genuine = results['genuine']
+    return np.asarray(results['distance'][genuine]), np.asarray(results['distance'][~genuine])
+
+
+def load_all_distances(model_list, race_list, results_dir=RESULTS_DIR):
+    distances = {}
+    for model in model_list:
+        for race in race_list:
+            distances[(model, race)] = load_distances(get_results_path(model, race, results_dir))
+    return distances
@@ -0,0 +1,65 @@
+# Exact FMR / FNMR curves from genuine and impostor distances. Both distance arrays are sorted once and
+# searchsorted gives the error counts at every distinct distance, so the curve has full resolution and
+# costs O(N log N) instead of one pass over all pairs per threshold. A pair is accepted as a match when
+# its distance is <= the threshold, the same rule DeepFace.verify uses.
+import numpy as np
+
+
+def compute_error_rates(genuine, impostor):
+    # every distinct distance as a threshold, the rates only change at these values
+    genuine = np.sort(np.asarray(genuine, dtype=np.float64))
+    impostor = np.sort(np.asarray(impostor, dtype=np.float64))
+    thresholds = np.unique(np.concatenate([genuine, impostor]))
+    if len(thresholds) == 0:
+        raise ValueError("No genuine or impostor distances to compute error rates from")
+
+    # impostor pairs accepted (distance <= threshold)
+    fmr = np.searchsorted(impostor, thresholds, side='right') / max(len(impostor), 1)
+    # genuine pairs rejected (distance > threshold)
+    fnmr = 1 - np.searchsorted(genuine, thresholds, side='right') / max(len(genuine), 1)
+    return thresholds, fmr, fnmr
+
+
+def find_equal_error_rate(thresholds, fmr, fnmr):
+    # fmr rises and fnmr falls with the threshold, the EER is where they cross
+    if len(thresholds) == 0:
+        raise ValueError("No thresholds to find the equal error rate at")
+    crossing = int(np.argmax(fmr >= fnmr))
+    if crossing == 0:
+        return (fmr[0] + fnmr[0]) / 2, thresholds[0]
+
+    # interpolate linearly between the last threshold before the crossing and the first one after it
+    before = (fnmr - fmr)[crossing - 1]
+    after = (fnmr - fmr)[crossing]
+    weight = before / (before - after)
+    eer = fmr[crossing - 1] + weight * (fmr[crossing] - fmr[crossing - 1])
+    eer_threshold = thresholds[crossing - 1] + weight * (thresholds[crossing] - thresholds[crossing - 1])
+    return eer, eer_threshold
+
+
+def compute_roc(genuine, impostor):
+    thresholds, fmr, fnmr = compute_error_rates(genuine, impostor)
+    eer, eer_threshold = find_equal_error_rate(thresholds, fmr, fnmr)
+
+    # the threshold minimising max(FMR, FNMR), the lowest one on ties
+    worst_rate = np.maximum(fmr, fnmr)
+    optimal = int(np.argmin(worst_rate))
+
+    return {
+        'thresholds': thresholds,
+        'fmr': fmr,
+        'fnmr': fnmr,
+        'eer': float(eer),
+        'eer_threshold': float(eer_threshold),
+        'optimal_threshold': float(thresholds[optimal]),
+        'optimal_fmr': float(fmr[optimal]),
+        'optimal_fnmr': float(fnmr[optimal])}
+
+
+def count_outcomes(genuine, impostor, threshold):
+    # (tp, tn, fp, fn) at a threshold; fp is an accepted impostor, fn a rejected genuine pair
+    genuine = np.asarray(genuine)
+    impostor = np.asarray(impostor)
+    tp = int(np.count_nonzero(genuine <= threshold))
+    fp = int(np.count_nonzero(impostor <= threshold))
+    return tp, len(impostor) - fp, fp, len(genuine) - tp
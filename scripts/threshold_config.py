@@ -1,5 +1,52 @@
+# Generated by scripts/calibrate_thresholds.py; threshold_dict and standard_threshold_dictionary are kept
+# on recalibration, every other dictionary is overwritten.
+
 threshold_dict = {
-        'DeepFace':0.35, 
-        'ArcFace':0.8, 
-        'Facenet': 0.4, 
+        'DeepFace': 0.35,
+        'ArcFace': 0.8,
+        'Facenet': 0.4,
         'Facenet512': 0.4}
+
+# per-race thresholds, in the order of race_order
+race_order = ['African', 'Asian', 'Caucasian', 'Indian']
+
+standard_threshold_dictionary = {
+        "DeepFace": [0.23, 0.23, 0.23, 0.23],
+        "ArcFace": [0.68, 0.68, 0.68, 0.68],
+        "Facenet": [0.4, 0.4, 0.4, 0.4],
+        "Facenet512": [0.3, 0.3, 0.3, 0.3]}
+
+# minimises max(FMR, FNMR)
+optimal_threshold_dictionary = {
+        "DeepFace": [0.35243698650655275, 0.36239686331385146, 0.3044281247309366, 0.29844320021552184],
+        "ArcFace": [0.6811937113789137, 0.6729467123305948, 0.7314239951842103, 0.6922974441248744],
+        "Facenet": [0.47109170385374, 0.4685493787754711, 0.6154019293785932, 0.5466722574367469],
+        "Facenet512": [0.43424231107969347, 0.44564129412707254, 0.5944876819740987, 0.49641140036169407]}
+
+# FMR = FNMR
+eer_threshold_dictionary = {
+        "DeepFace": [0.35243706458246477, 0.3623712299872389, 0.3044291224057802, 0.29851849006187103],
+        "ArcFace": [0.6811956644940178, 0.6729544359763114, 0.7315625157374553, 0.6922817382739163],
+        "Facenet": [0.4710187307568951, 0.46852205605470226, 0.6154124365146683, 0.546672040893442],
+        "Facenet512": [0.43421572403869213, 0.44562602034315574, 0.5947268150405927, 0.49672740538188104]}
+
+# FMR <= 0.01 in each race
+fmr_1e2_threshold_dictionary = {
+        "DeepFace": [0.18769156820241925, 0.1780130715230603, 0.15554552609984304, 0.15794105610320594],
+        "ArcFace": [0.44978996866308635, 0.4733635602972837, 0.5614060136785105, 0.4829822831477027],
+        "Facenet": [0.24690758741442861, 0.2592578398186823, 0.391113386587365, 0.33054909130795723],
+        "Facenet512": [0.2534627892683577, 0.2553788518526065, 0.39504090020197286, 0.30049278769885507]}
+
+# FMR <= 0.001 in each race
+fmr_1e3_threshold_dictionary = {
+        "DeepFace": [0.1460960986256938, 0.12988737541052073, 0.12507508178079083, 0.13015546548373577],
+        "ArcFace": [0.1135909063916176, 0.3953040550762181, 0.39189017044902125, 0.010565124575205307],
+        "Facenet": [0.1485219888541429, 0.18180895917525616, 0.1905134888314942, 0.09226042201793204],
+        "Facenet512": [0.205396616403647, 0.17986693142402574, 0.32227399711857857, 0.2147315791021633]}
+
+# one threshold for all races, FMR <= 0.001 on Caucasian
+global_threshold_dictionary = {
+        "DeepFace": [0.12507508178079083, 0.12507508178079083, 0.12507508178079083, 0.12507508178079083],
+        "ArcFace": [0.39189017044902125, 0.39189017044902125, 0.39189017044902125, 0.39189017044902125],
+        "Facenet": [0.1905134888314942, 0.1905134888314942, 0.1905134888314942, 0.1905134888314942],
+        "Facenet512": [0.32227399711857857, 0.32227399711857857, 0.32227399711857857, 0.32227399711857857]}
@@ -0,0 +1,76 @@
+# Per-stage latency for one (model, detector, race) run. Every stage of the pipeline (decode, detect,
+# preprocess, embed, distance, ...) is timed separately and the summary written at the end of the race
+# gives count, mean, p50/p95/p99, max and a log-spaced histogram per stage in
+# tmp/<model>/<race>_<detector>_timings.json, so tail latency can be compared across races.
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+
+import numpy as np
+
+PERCENTILES = [50, 95, 99]
+# 0.1 ms to 100 s, 10 bins per decade
+HISTOGRAM_EDGES = np.logspace(-4, 2, 61)
+
+
+def get_timings_path(model, detector, race):
+    return f'tmp/{model}/{race}_{detector}_timings.json'
+
+
+class StageTimer:
+
+    def __init__(self, model, detector, race):
+        self.model = model
+        self.detector = detector
+        self.race = race
+        self.samples = {}
+        # the image prefetcher records decode times from its reader threads
+        self._lock = threading.Lock()
+
+    def add(self, stage, seconds):
+        with self._lock:
+            self.samples.setdefault(stage, []).append(seconds)
+
+    @contextmanager
+    def time(self, stage):
+        # only stages that finish are recorded, a stage that raises is counted in the failure log
+        start_time = time.perf_counter()
+        yield
+        self.add(stage, time.perf_counter() - start_time)
+
+    def summarize(self):
+        stages = {}
+        for stage, samples in self.samples.items():
+            samples = np.asarray(samples)
+            counts, _ = np.histogram(np.clip(samples, HISTOGRAM_EDGES[0], HISTOGRAM_EDGES[-1]), HISTOGRAM_EDGES)
+            stages[stage] = {
+                'count': len(samples),
+                'total': float(samples.sum()),
+                'mean': float(samples.mean()),
+                **{f'p{q}': float(value) for q, value in zip(PERCENTILES, np.percentile(samples, PERCENTILES))},
+                'max': float(samples.max()),
+                'histogram': counts.tolist()}
+
+        return {
+            'model': self.model,
+            'detector': self.detector,
+            'race': self.race,
+            'unit': 'seconds',
+            'histogram_edges': HISTOGRAM_EDGES.tolist(),
+            'stages': stages}
+
+    def write_summary(self, path=None):
+        path = path or get_timings_path(self.model, self.detector, self.race)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w') as file:
+            json.dump(self.summarize(), file, indent=2)
+        return path
+
+    def summary(self):
+        lines = [f"Stage timings for {self.model} - {self.detector} - {self.race}:"]
+        for stage, values in self.summarize()['stages'].items():
+            lines.append(f"  {stage}: n={values['count']} p50={values['p50'] * 1000:.1f}ms "
+                         f"p95={values['p95'] * 1000:.1f}ms p99={values['p99'] * 1000:.1f}ms")
+        return '\n'.join(lines)
@@ -1,117 +1,238 @@
-from deepface import DeepFace
-import tensorflow as tf
-
-exception_list = []
-exception_write_to_file_count = 0
-
-
-def _write_exceptions_to_file(model):
-    filename = 'tmp/' + model + '/exceptions.txt'
-    with open(filename, 'w') as file:
-        for exception in exception_list:
-            file.write(str(exception) + '\n')
-    
-
-def _write_test_result_to_file(template_folder, template_image_index, test_folder, test_image_index, result, results_file):
-
-    results_file.write(
-        f'{template_folder}\t'
-        f'{template_image_index}\t'
-        f'{test_folder}\t'
-        f'{test_image_index}\t'
-        f'{result}\t\n')
-
-def get_image_from_pair(race, pair):
-    if len(pair) == 4:
-        template_folder = pair[0]
-        template_index = int(pair[1])
-        template_image = '_000' + str(template_index) + '.jpg'
-        template_image_path = 'rfw/test/data/' + race + '/' + template_folder + '/' + template_folder + template_image
-
-        test_folder = pair[2]
-        test_index = int(pair[3])
-        test_image = '_000' + str(test_index) + '.jpg'
-        test_image_path = 'rfw/test/data/' + race + '/' + test_folder + '/' + test_folder + test_image
-    elif len(pair) == 3:
-        template_folder = pair[0]
-        template_index = int(pair[1])
-        template_image = '_000' + str(template_index) + '.jpg'
-        template_image_path = 'rfw/test/data/' + race + '/' + template_folder + '/' + template_folder + template_image
-
-        test_folder = pair[0]
-        test_index = int(pair[2])
-        test_image = '_000' + str(test_index) + '.jpg'
-        test_image_path = 'rfw/test/data/'+ race + '/' + test_folder + '/' + test_folder + test_image
-    else:
-        raise Exception("Error in get_pair()")
-    
-    return template_folder, template_index, template_image_path, test_folder, test_index, test_image_path
-    
-
-
-def _run_tests(race, model, detector, distance_metric, pair_list, test_limit):
-
-    global exception_list
-
-    # Open results file for writing
-    with open(f'tmp/{model}/{race}_results.txt', 'w') as results_file:
-
-        # Write the header of results file
-        results_file.write('File1\tFile2\tResult\n')
-
-        # iterate through each image in the folder
-        count = 0
-        for pair in pair_list:
-            template_folder, template_index, template_image_path, test_folder, test_index, test_image_path = get_image_from_pair(race, pair)
-            
+import argparse
+import time
+
+import numpy as np
+from deepface.modules import detection, modeling
+
+import detection_cache
+import embedding_cache
+from checkpoint import ResultJournal
+from failure_log import DECODE, DETECT, EMBED, FailureLog, StageError, get_failure
+from image_prefetch import ImagePrefetcher
+from live_metrics import LiveMetrics
+from model_manager import ModelManager
+from pair_index import load_pair_index
+from result_store import facial_area_to_array, read_results
+from stage_timer import StageTimer
+
+
+def _verify_images(race, model, detector, distance_metric, image_paths, images, timer):
+    # DeepFace.verify split into its stages so each one is timed on its own; the crops are resized and
+    # the result built the way the embedding cache does it, which matches DeepFace.verify
+    client = modeling.build_model(model)
+    cache = embedding_cache.EmbeddingCache(model, detector, race, persist=False)
+
+    for image_path, image in zip(image_paths, images):
+        start_time = time.time()
+        try:
+            # detection includes the alignment, the detectors align each face as they crop it
+            with timer.time('detect'):
+                face_objs = detection.extract_faces(
+                    img_path=image, target_size=None, detector_backend=detector,
+                    grayscale=False, enforce_detection=True, align=True)
+        except Exception as e:
+            raise StageError(get_failure(e, DETECT))
+
+        try:
+            with timer.time('preprocess'):
+                # extract_faces scales the uint8 crop to [0, 1], preprocess_face expects the crop itself
+                faces = [embedding_cache.preprocess_face(np.rint(face_obj['face'][0] * 255).astype(np.uint8), client.input_shape)
+                         for face_obj in face_objs]
+            with timer.time('embed'):
+                embeddings = [client.find_embeddings(face) for face in faces]
+        except Exception as e:
+            raise StageError(get_failure(e, EMBED))
+
+        facial_areas = [facial_area_to_array(face_obj['facial_area']) for face_obj in face_objs]
+        cache.add(image_path, embeddings, facial_areas, time.time() - start_time)
+
+    with timer.time('distance'):
+        return embedding_cache.build_result(cache, image_paths[0], image_paths[1], distance_metric)
+
+
+def _run_pairs(race, model, detector, distance_metric, pair_list, journal, failure_log, timer, model_manager, start_count=0,
+               queue_depth=16, prefetch_threads=4, live_metrics=None):
+    # pair_list holds PairIndex.get_pair tuples; live_metrics, if given, is fed every finished pair
+
+    # load once and keep the model resident for the whole race
+    model_manager.load(model)
+
+    # start_count is the position of pair_list[0] in the race's pairs file
+    pairs = []
+    for count, pair in enumerate(pair_list, start=start_count):
+        template_folder, template_index, template_image_path, test_folder, test_index, test_image_path = pair
+
+        # finished in an earlier, interrupted run
+        if journal.is_done(template_folder, template_index, test_folder, test_index):
+            continue
+        pairs.append((count, template_folder, template_index, template_image_path, test_folder, test_index, test_image_path))
+
+    # the next queue_depth pairs' images are read and decoded while the current pair is verified
+    path_pairs = [(pair[3], pair[6]) for pair in pairs]
+    with ImagePrefetcher(path_pairs, queue_depth, prefetch_threads, timer) as prefetcher:
+        for pair, futures in zip(pairs, prefetcher):
+            count, template_folder, template_index, template_image_path, test_folder, test_index, test_image_path = pair
+
             print(f"\n{template_image_path}\n{test_image_path}")
 
+            try:
+                template_image, test_image = prefetcher.wait(futures)
+            except Exception as e:
+                print(str(e))
+                failure_log.write(race, count, template_folder, template_index, test_folder, test_index,
+                                  template_image_path, test_image_path, get_failure(e, DECODE))
+                if live_metrics:
+                    live_metrics.add_failure()
+                continue
+
             try:
                 # run model
-                result = DeepFace.verify(template_image_path, test_image_path, model, detector, distance_metric)
+                with timer.time('pair'):
+                    result = _verify_images(race, model, detector, distance_metric,
+                                            (template_image_path, test_image_path), (template_image, test_image), timer)
 
                 print(f"Model: {model}\nTest Time: {result['time']}\nCount: {count}")
-                tf.keras.backend.clear_session()
+                model_manager.after_pair()
 
-                _write_test_result_to_file(template_folder, template_index, test_folder, test_index, result, results_file)
+                journal.write_result(template_folder, template_index, test_folder, test_index, result)
             except Exception as e:
                 print(str(e))
-                exception_info = [str(e), race, count, template_folder, template_image_path, test_image_path]
-                exception_list.append(exception_info)
+                failure_log.write(race, count, template_folder, template_index, test_folder, test_index,
+                                  template_image_path, test_image_path, get_failure(e))
+                if live_metrics:
+                    live_metrics.add_failure()
+                continue
+
+            if live_metrics:
+                live_metrics.add(template_folder == test_folder, result)
+
+        print(prefetcher.summary())
+
+
+def _start_live_metrics(model, race, journal, resume, snapshot_every):
+    live_metrics = LiveMetrics(model, race, snapshot_every)
+    # the snapshots cover the whole race, including the pairs an interrupted run finished
+    if resume:
+        live_metrics.add_rows(read_results(journal.results_path))
+    return live_metrics
 
-            count += 1
-            if count > test_limit:
-                break
 
-def _init_values(race):
-    pairs_file_path = 'rfw/test/txts/' + race + '/' + race + '_pairs.txt'
+def _run_tests(race, model, detector, distance_metric, index, test_limit, failure_log, model_manager, resume, write_text_results, queue_depth, prefetch_threads, snapshot_every):
 
-    pair_list = []
-    with open(pairs_file_path, 'r') as f:
-        for line in f:
-            data = line.split('\t')
-            data[-1] = data[-1].strip('\n')
-            data_tuple = tuple(data)
-            pair_list.append(data_tuple)
+    timer = StageTimer(model, detector, race)
 
-    return pair_list
+    # Open results files for appending, with the header written unless resuming
+    with ResultJournal(model, race, f'tmp/{model}/{race}_results.txt', resume, write_text=write_text_results) as journal:
+        live_metrics = _start_live_metrics(model, race, journal, resume, snapshot_every)
+
+        # the loop used to stop once count passed test_limit, i.e. after test_limit + 1 pairs
+        _run_pairs(race, model, detector, distance_metric, index.get_pairs(0, test_limit + 1), journal, failure_log, timer, model_manager,
+                   queue_depth=queue_depth, prefetch_threads=prefetch_threads, live_metrics=live_metrics)
+
+    live_metrics.write_snapshot()
+    print(model_manager.summary())
+    print(timer.summary())
+    print(f"Stage timings written to {timer.write_summary()}")
+
+
+def _run_cached_tests(race, model, detector, distance_metric, index, test_limit, failure_log, use_detection_store, batch_size, resume, write_text_results, snapshot_every):
+
+    timer = StageTimer(model, detector, race)
+
+    # same pairs as _run_tests, which stops once count passes test_limit
+    pairs = index.get_pairs(0, test_limit + 1)
+
+    cache = embedding_cache.EmbeddingCache(model, detector, race)
+    image_path_pairs = [(pair[2], pair[5]) for pair in pairs]
+    image_paths = embedding_cache.get_unique_image_paths(image_path_pairs)
+
+    # detection is model independent, so only the first model to reach this race runs the detector
+    detection_store = None
+    if use_detection_store:
+        detection_store = detection_cache.DetectionStore(detector, race)
+        detection_cache.detect_faces(detection_store, cache.get_missing_paths(image_paths), timer)
+
+    # embed every unique image once, then read each pair's distance from the cache
+    embedding_cache.compute_embeddings(cache, image_paths, detection_store, batch_size, timer)
+
+    with ResultJournal(model, race, f'tmp/{model}/{race}_results.txt', resume, write_text=write_text_results) as journal:
+        live_metrics = _start_live_metrics(model, race, journal, resume, snapshot_every)
+
+        for count, pair in enumerate(pairs):
+            template_folder, template_index, template_image_path, test_folder, test_index, test_image_path = pair
+            if journal.is_done(template_folder, template_index, test_folder, test_index):
+                continue
+
+            failed_paths = [path for path in (template_image_path, test_image_path) if path in cache.failures]
+            if failed_paths:
+                failure_log.write(race, count, template_folder, template_index, test_folder, test_index,
+                                  template_image_path, test_image_path, cache.failures[failed_paths[0]])
+                live_metrics.add_failure()
+                continue
+
+            with timer.time('distance'):
+                result = embedding_cache.build_result(cache, template_image_path, test_image_path, distance_metric)
+            journal.write_result(template_folder, template_index, test_folder, test_index, result)
+            live_metrics.add(template_folder == test_folder, result)
+
+    live_metrics.write_snapshot()
+    print(timer.summary())
+    print(f"Stage timings written to {timer.write_summary()}")
+
+
+def run_verification(model_list, race_list, detector, distance_metric, test_limit, resume=False,
+                     use_embedding_cache=True, use_detection_store=True, batch_size=32, reset_every=None,
+                     rss_limit_mb=8192, write_text_results=True, prefetch_queue_depth=16, prefetch_threads=4,
+                     snapshot_every=500):
+    # models stay loaded between pairs; the Keras session is only reset every N pairs or past the RSS limit
+    model_manager = ModelManager(reset_every=reset_every, rss_limit_mb=rss_limit_mb)
+
+    for model in model_list:
+        # failed pairs are never journaled, so a resumed run retries them; the log is appended to, keeping
+        # the interrupted run's failures, and a pair that fails again is logged once more
+        with FailureLog(model, append=resume) as failure_log:
+            for race in race_list:
+                # compiled from the race's pairs file once, memory-mapped on every later load
+                index = load_pair_index(race)
+
+                if use_embedding_cache:
+                    _run_cached_tests(race, model, detector, distance_metric, index, test_limit, failure_log, use_detection_store, batch_size, resume, write_text_results, snapshot_every)
+                else:
+                    _run_tests(race, model, detector, distance_metric, index, test_limit, failure_log, model_manager, resume, write_text_results, prefetch_queue_depth, prefetch_threads, snapshot_every)
+
+        print(f"Output file generated successfully for {model}. {failure_log.count} failures logged to {failure_log.path}")
 
 
 def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--resume', action='store_true', help='skip pairs finished by an interrupted run')
+    args = parser.parse_args()
+
     race_list = ['African', 'Asian', 'Caucasian', 'Indian']
     model_list = ['Facenet', 'Facenet512', 'DeepFace', 'ArcFace']
     distance_metric = 'cosine'
     detector = 'mtcnn'
     test_limit = 10000
-    
-    for model in model_list:
-        for race in race_list:
-            pair_list = _init_values(race)
-
-            _run_tests(race, model, detector, distance_metric, pair_list, test_limit)
+    # embed each image once and take pair distances from tmp/<model>/<race>_<detector>_embeddings.npz
+    use_embedding_cache = True
+    # detect each image once for all models and keep the crops in tmp/detections/<detector>/<race>/
+    use_detection_store = True
+    # faces per forward pass when embedding from the detection store, see batch_size_benchmark.py
+    batch_size = 32
+    # Keras session resets, see ModelManager
+    reset_every = None
+    rss_limit_mb = 8192
+    # results always go to the columnar tmp/<model>/<race>_results.bin, the text file is optional
+    write_text_results = True
+    # pairs whose images are read ahead, and the threads reading them, when not using the embedding cache
+    prefetch_queue_depth = 16
+    prefetch_threads = 4
+    # pairs between two snapshots of tmp/<model>/<race>_live_metrics.json
+    snapshot_every = 500
 
-        print(f"Output file generated successfully for {model}.")
-        _write_exceptions_to_file(model)
+    run_verification(model_list, race_list, detector, distance_metric, test_limit, args.resume, use_embedding_cache,
+                     use_detection_store, batch_size, reset_every, rss_limit_mb, write_text_results,
+                     prefetch_queue_depth, prefetch_threads, snapshot_every)
 
 
 if __name__ == "__main__":